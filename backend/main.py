@@ -1,4 +1,4 @@
-from fastapi import FastAPI, HTTPException, Depends, WebSocket, WebSocketDisconnect, File, UploadFile
+from fastapi import FastAPI, HTTPException, Depends, WebSocket, WebSocketDisconnect, File, UploadFile, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.responses import FileResponse, StreamingResponse
@@ -11,7 +11,6 @@ import asyncio
 from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional
 import os
-import subprocess
 import shutil
 from pathlib import Path
 from dotenv import load_dotenv
@@ -19,8 +18,27 @@ import aiofiles
 import asyncio.subprocess
 import time
 import threading
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
+from multiprocessing import shared_memory
 import hashlib
+import enum
+import bisect
+import fnmatch
+import mmap
+import sqlite3
+import array
+import operator
+import re
+import heapq
+import itertools
+import gzip
+import zlib
+import codecs
+import signal
+import struct
+import ctypes
+from collections import deque, OrderedDict
 import logging
 import secrets
 import mimetypes
@@ -31,6 +49,7 @@ from mss import mss
 import pyautogui
 from PIL import Image
 import numpy as np
+import httpx
 
 # Disable pyautogui failsafe for remote control (prevents mouse from moving to corner)
 pyautogui.FAILSAFE = False
@@ -274,8 +293,115 @@ network_last_check = None
 # Shareable links storage with expiry
 shareable_links = {}
 
-# Thread pool for CPU-intensive operations
-executor = ThreadPoolExecutor(max_workers=4)
+# Worker pools, one per kind of blocking work, so a busy screen share or a
+# slow package query can't starve the metrics endpoints. Each pool is sized
+# and queue-limited on its own (EXECUTOR_<NAME>_WORKERS / _QUEUE) and keeps
+# counters for /api/system/executors.
+workload_executors: Dict[str, "WorkloadExecutor"] = {}
+
+class ExecutorSaturated(HTTPException):
+    def __init__(self, name: str):
+        super().__init__(status_code=503, detail=f"Server busy: the {name} worker pool queue is full")
+
+class WorkloadExecutor(Executor):
+    """Named thread or process pool with a queue limit and saturation counters"""
+
+    def __init__(self, name: str, workers: int, max_queue: int, processes: bool = False):
+        self.name = name
+        self.max_workers = max(1, int(os.getenv(f"EXECUTOR_{name.upper()}_WORKERS", str(workers))))
+        self.max_queue = max(0, int(os.getenv(f"EXECUTOR_{name.upper()}_QUEUE", str(max_queue))))
+        self.processes = processes
+        self._pool = None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+        self.latency_seconds = 0.0
+        workload_executors[name] = self
+
+    def _get_pool(self):
+        # Created on first use: spawned helper processes import this module too
+        if self._pool is None:
+            if self.processes:
+                # spawn, not fork: the server process runs threads and an event loop
+                self._pool = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+            else:
+                self._pool = ThreadPoolExecutor(self.max_workers, thread_name_prefix=f"serverguard-{self.name}")
+        return self._pool
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            if self.in_flight >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise ExecutorSaturated(self.name)
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            self.submitted += 1
+            pool = self._get_pool()
+        submitted_at = time.monotonic()
+        try:
+            if self.processes:
+                future = pool.submit(fn, *args, **kwargs)
+            else:
+                future = pool.submit(self._timed, submitted_at, fn, args, kwargs)
+        except Exception:
+            with self._lock:
+                self.in_flight -= 1
+            raise
+        future.add_done_callback(lambda done: self._finished(done, submitted_at))
+        return future
+
+    def _timed(self, submitted_at: float, fn, args, kwargs):
+        with self._lock:
+            self.wait_seconds += time.monotonic() - submitted_at
+        return fn(*args, **kwargs)
+
+    def _finished(self, future, submitted_at: float):
+        with self._lock:
+            self.in_flight -= 1
+            self.latency_seconds += time.monotonic() - submitted_at
+            if future.cancelled() or future.exception() is not None:
+                self.failed += 1
+            else:
+                self.completed += 1
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False):
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=cancel_futures)
+            self._pool = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            active = min(self.in_flight, self.max_workers)
+            finished = self.completed + self.failed
+            return {
+                "kind": "process" if self.processes else "thread",
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "active": active,
+                "queued": self.in_flight - active,
+                "utilization": round(active / self.max_workers, 3),
+                "peak_in_flight": self.peak_in_flight,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                # Queue wait is only observable for thread pools
+                "avg_wait_ms": None if self.processes else round(self.wait_seconds / max(1, finished) * 1000, 2),
+                "avg_latency_ms": round(self.latency_seconds / max(1, finished) * 1000, 2)
+            }
+
+metrics_executor = WorkloadExecutor("metrics", workers=4, max_queue=64)
+filesystem_executor = WorkloadExecutor("filesystem", workers=4, max_queue=64)
+subprocess_executor = WorkloadExecutor("subprocess", workers=4, max_queue=16)
+# JPEG encoding holds the GIL; a process pool keeps frames off the API workers' cores
+screen_executor = WorkloadExecutor("screen", workers=2, max_queue=2, processes=True)
+# One worker: pyautogui calls must run one at a time and in order
+input_executor = WorkloadExecutor("input", workers=1, max_queue=256)
 
 class SystemInfo(BaseModel):
     timestamp: str
@@ -291,6 +417,8 @@ class LoginResponse(BaseModel):
 
 class CommandRequest(BaseModel):
     command: str
+    timeout: Optional[float] = None
+    stream: bool = False
 
 class CommandResponse(BaseModel):
     output: str
@@ -386,6 +514,15 @@ async def set_cached_data(key: str, data: Any):
     async with cache_lock:
         system_cache[key] = (data, time.time())
 
+async def prune_cached_data(prefix: str, ttl: float):
+    """Drop expired entries under a key prefix that are never overwritten in place"""
+    async with cache_lock:
+        now = time.time()
+        stale = [key for key, (_, timestamp) in system_cache.items()
+                 if key.startswith(prefix) and now - timestamp >= ttl]
+        for key in stale:
+            del system_cache[key]
+
 async def clear_cache():
     """Clear all cached data"""
     async with cache_lock:
@@ -430,8 +567,639 @@ def get_file_mime_type(file_path: str) -> str:
     mime_type, _ = mimetypes.guess_type(file_path)
     return mime_type or 'application/octet-stream'
 
+# ==================== Shared Metrics Collector ====================
+# A single collector process samples psutil once per tick and publishes the
+# latest snapshot plus a fixed-size history ring into a shared-memory segment.
+# Every API worker attaches to the same segment and reads it without touching
+# psutil, so adding workers does not multiply the sampling overhead.
+
+COLLECTOR_ENABLED = os.getenv("COLLECTOR_ENABLED", "true").lower() == "true"
+COLLECTOR_INTERVAL = float(os.getenv("COLLECTOR_INTERVAL", "1.0"))
+COLLECTOR_SHM_NAME = os.getenv("COLLECTOR_SHM_NAME", "serverguard_metrics")
+COLLECTOR_SNAPSHOT_CAPACITY = int(os.getenv("COLLECTOR_SNAPSHOT_CAPACITY", str(512 * 1024)))
+COLLECTOR_HISTORY_LENGTH = int(os.getenv("COLLECTOR_HISTORY_LENGTH", "3600"))
+# Snapshots older than this are treated as stale and endpoints sample directly
+COLLECTOR_STALE_AFTER = max(COLLECTOR_INTERVAL * 5, 5.0)
+
+# Fixed-width history row; every worker maps the ring with this dtype
+HISTORY_DTYPE = np.dtype([
+    ("timestamp", "<f8"),
+    ("cpu_percent", "<f4"),
+    ("memory_percent", "<f4"),
+    ("swap_percent", "<f4"),
+    ("load_1", "<f4"),
+    ("disk_read_bytes_per_sec", "<f8"),
+    ("disk_write_bytes_per_sec", "<f8"),
+    ("net_sent_bytes_per_sec", "<f8"),
+    ("net_recv_bytes_per_sec", "<f8"),
+    # Share of the tick some/all tasks were stalled (Linux PSI, 0 when unavailable)
+    ("psi_cpu_some", "<f4"),
+    ("psi_memory_some", "<f4"),
+    ("psi_memory_full", "<f4"),
+    ("psi_io_some", "<f4"),
+    ("psi_io_full", "<f4"),
+    # /proc/meminfo breakdown in bytes (0 when unavailable)
+    ("mem_cached", "<f8"),
+    ("mem_buffers", "<f8"),
+    ("mem_dirty", "<f8"),
+    ("mem_writeback", "<f8"),
+    ("mem_slab", "<f8"),
+    ("mem_hugepages_used", "<f8"),
+])
+
+# Header slots (uint64 each)
+SEGMENT_HEADER_SLOTS = 8
+SEGMENT_HEADER_SIZE = SEGMENT_HEADER_SLOTS * 8
+HDR_SEQ, HDR_SNAPSHOT_LEN, HDR_HISTORY_WRITTEN, HDR_COLLECTOR_PID, \
+    HDR_HISTORY_CAPACITY, HDR_SNAPSHOT_CAPACITY, HDR_LAYOUT, HDR_WRITTEN_AT_NS = range(SEGMENT_HEADER_SLOTS)
+# Bumped whenever HISTORY_DTYPE or the header layout changes
+SEGMENT_LAYOUT_VERSION = 2
+SEQLOCK_READ_RETRIES = 100
+
+def _attach_shared_memory(name: str, untrack: bool = True) -> shared_memory.SharedMemory:
+    """Attach to an existing segment without letting this process own its lifetime"""
+    shm = shared_memory.SharedMemory(name=name, create=False)
+    # Before 3.13 every attaching process registers the segment with its
+    # resource tracker, which would unlink it when that process exits.
+    # Children spawned by the owner share the owner's tracker and must not
+    # unregister, or the owner's own registration is dropped.
+    if untrack:
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+    return shm
+
+class SegmentLayoutMismatch(ValueError):
+    """An existing segment was created with a different SEGMENT_LAYOUT_VERSION"""
+
+class MetricsSegment:
+    """Shared-memory segment with a seqlock-protected snapshot and history ring.
+
+    The single writer makes the sequence counter odd before touching the
+    payload and even again afterwards. Readers never lock: they copy what they
+    need and retry if the counter was odd or moved while they were copying.
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool = False):
+        self.shm = shm
+        self.owner = owner
+        self.header = np.ndarray((SEGMENT_HEADER_SLOTS,), dtype=np.uint64, buffer=shm.buf, offset=0)
+        if owner:
+            return
+        layout = int(self.header[HDR_LAYOUT])
+        if layout != SEGMENT_LAYOUT_VERSION:
+            self.header = None
+            shm.close()
+            raise SegmentLayoutMismatch(f"Metrics segment has layout {layout}, expected {SEGMENT_LAYOUT_VERSION}")
+        self._map_regions()
+
+    def _map_regions(self):
+        self.snapshot_capacity = int(self.header[HDR_SNAPSHOT_CAPACITY])
+        self.history_capacity = int(self.header[HDR_HISTORY_CAPACITY])
+        self.snapshot_view = self.shm.buf[SEGMENT_HEADER_SIZE:SEGMENT_HEADER_SIZE + self.snapshot_capacity]
+        history_offset = SEGMENT_HEADER_SIZE + self.snapshot_capacity
+        self.history = np.ndarray((self.history_capacity,), dtype=HISTORY_DTYPE,
+                                  buffer=self.shm.buf, offset=history_offset)
+
+    @classmethod
+    def create(cls, name: str, snapshot_capacity: int = COLLECTOR_SNAPSHOT_CAPACITY,
+               history_capacity: int = COLLECTOR_HISTORY_LENGTH) -> "MetricsSegment":
+        # Keep the history ring 8-byte aligned
+        snapshot_capacity = (snapshot_capacity + 7) // 8 * 8
+        size = SEGMENT_HEADER_SIZE + snapshot_capacity + history_capacity * HISTORY_DTYPE.itemsize
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        segment = cls(shm, owner=True)
+        segment.header[:] = 0
+        segment.header[HDR_SNAPSHOT_CAPACITY] = snapshot_capacity
+        segment.header[HDR_HISTORY_CAPACITY] = history_capacity
+        segment.header[HDR_LAYOUT] = SEGMENT_LAYOUT_VERSION
+        segment._map_regions()
+        return segment
+
+    @classmethod
+    def attach(cls, name: str, untrack: bool = True) -> "MetricsSegment":
+        return cls(_attach_shared_memory(name, untrack=untrack))
+
+    @staticmethod
+    def discard(name: str):
+        """Unlink a segment without mapping its layout (e.g. one left by an older version)"""
+        shm = _attach_shared_memory(name)
+        shm.close()
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.register(shm._name, "shared_memory")
+        except Exception:
+            pass
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+    def set_writer(self, pid: int):
+        self.header[HDR_COLLECTOR_PID] = pid
+
+    def writer_alive(self) -> bool:
+        pid = int(self.header[HDR_COLLECTOR_PID])
+        return pid > 0 and psutil.pid_exists(pid)
+
+    def age(self) -> float:
+        """Seconds since the last completed write (inf if never written)"""
+        written_at = int(self.header[HDR_WRITTEN_AT_NS])
+        if not written_at:
+            return float("inf")
+        return max(0.0, (time.time_ns() - written_at) / 1e9)
+
+    def write(self, payload: bytes, history_row: tuple):
+        if len(payload) > self.snapshot_capacity:
+            raise ValueError(f"Snapshot of {len(payload)} bytes exceeds segment capacity {self.snapshot_capacity}")
+        header = self.header
+        header[HDR_SEQ] += 1  # odd: write in progress
+        self.snapshot_view[:len(payload)] = payload
+        header[HDR_SNAPSHOT_LEN] = len(payload)
+        written = int(header[HDR_HISTORY_WRITTEN])
+        self.history[written % self.history_capacity] = history_row
+        header[HDR_HISTORY_WRITTEN] = written + 1
+        header[HDR_WRITTEN_AT_NS] = time.time_ns()
+        header[HDR_SEQ] += 1  # even: consistent again
+
+    def read(self, history_count: int = 0):
+        """Return (seq, snapshot bytes, history rows oldest first) or None if the writer kept racing us"""
+        header = self.header
+        for _ in range(SEQLOCK_READ_RETRIES):
+            seq = int(header[HDR_SEQ])
+            if seq & 1:
+                time.sleep(0)
+                continue
+            length = int(header[HDR_SNAPSHOT_LEN])
+            payload = bytes(self.snapshot_view[:length])
+            history = self._copy_history(history_count) if history_count else None
+            if int(header[HDR_SEQ]) == seq:
+                return seq, payload, history
+        return None
+
+    def _copy_history(self, count: int) -> np.ndarray:
+        written = int(self.header[HDR_HISTORY_WRITTEN])
+        count = min(count, written, self.history_capacity)
+        indices = np.arange(written - count, written) % self.history_capacity
+        # Fancy indexing copies, so the result stays valid after the read
+        return self.history[indices]
+
+    def close(self):
+        # Drop our numpy/memoryview exports before closing the mapping
+        self.header = None
+        self.history = None
+        if getattr(self, "snapshot_view", None) is not None:
+            self.snapshot_view.release()
+            self.snapshot_view = None
+        try:
+            self.shm.close()
+        except BufferError:
+            pass
+
+    def unlink(self):
+        if not self.owner:
+            # unlink() unregisters from the resource tracker; balance the
+            # registration we dropped when attaching
+            try:
+                from multiprocessing import resource_tracker
+                resource_tracker.register(self.shm._name, "shared_memory")
+            except Exception:
+                pass
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+PRESSURE_RESOURCES = ("cpu", "memory", "io")
+
+def read_pressure() -> Dict[str, Optional[dict]]:
+    """Parse /proc/pressure/*; a resource is None where PSI is unavailable"""
+    result = {}
+    for resource in PRESSURE_RESOURCES:
+        try:
+            with open(f"/proc/pressure/{resource}") as f:
+                lines = f.read().splitlines()
+        except OSError:
+            # Not Linux 4.20+, or PSI disabled at boot (psi=0)
+            result[resource] = None
+            continue
+        parsed = {}
+        for line in lines:
+            kind, *pairs = line.split()
+            values = dict(pair.split("=", 1) for pair in pairs)
+            parsed[kind] = {
+                "avg10": float(values["avg10"]),
+                "avg60": float(values["avg60"]),
+                "avg300": float(values["avg300"]),
+                "total": int(values["total"])  # cumulative stall time in microseconds
+            }
+        result[resource] = parsed
+    return result
+
+def read_meminfo() -> Optional[Dict[str, int]]:
+    """All /proc/meminfo fields; sizes in bytes, HugePages_* as page counts"""
+    try:
+        with open("/proc/meminfo", "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    fields = {}
+    for line in data.splitlines():
+        name, _, rest = line.partition(b":")
+        parts = rest.split()
+        if not parts:
+            continue
+        value = int(parts[0])
+        if len(parts) > 1 and parts[1] == b"kB":
+            value *= 1024
+        fields[name.decode()] = value
+    return fields
+
+def summarize_meminfo(fields: Dict[str, int]) -> dict:
+    """Group the raw /proc/meminfo fields into where the memory actually went"""
+    get = fields.get
+    hugepage_size = get("Hugepagesize", 0)
+    return {
+        "total": get("MemTotal", 0),
+        "free": get("MemFree", 0),
+        "available": get("MemAvailable", 0),
+        "anon": get("AnonPages", 0),
+        "cached": get("Cached", 0),
+        "buffers": get("Buffers", 0),
+        "swap_cached": get("SwapCached", 0),
+        "shmem": get("Shmem", 0),
+        "mapped": get("Mapped", 0),
+        "dirty": get("Dirty", 0),
+        "writeback": get("Writeback", 0),
+        "slab": get("Slab", 0),
+        "slab_reclaimable": get("SReclaimable", 0),
+        "slab_unreclaimable": get("SUnreclaim", 0),
+        "kernel_stack": get("KernelStack", 0),
+        "page_tables": get("PageTables", 0),
+        # Page cache and reclaimable slab the kernel can drop under pressure; shmem lives in the cache but can't be dropped
+        "reclaimable": max(0, get("Cached", 0) + get("Buffers", 0) + get("SReclaimable", 0) - get("Shmem", 0)),
+        "committed": get("Committed_AS", 0),
+        "commit_limit": get("CommitLimit", 0),
+        "swap_total": get("SwapTotal", 0),
+        "swap_free": get("SwapFree", 0),
+        "anon_hugepages": get("AnonHugePages", 0),
+        "hugepages": {
+            "total": get("HugePages_Total", 0),
+            "free": get("HugePages_Free", 0),
+            "reserved": get("HugePages_Rsvd", 0),
+            "surplus": get("HugePages_Surp", 0),
+            "page_size": hugepage_size,
+            "used_bytes": (get("HugePages_Total", 0) - get("HugePages_Free", 0)) * hugepage_size
+        }
+    }
+
+class MetricsCollector:
+    """Samples host metrics in the same shapes the system endpoints return"""
+
+    PARTITION_REFRESH_SECONDS = 30
+
+    def __init__(self):
+        self.platform_cpu_info = get_platform_specific_cpu_info()
+        self._partitions = []
+        self._partitions_at = 0.0
+        self._last_sample_at = None
+        self._last_net = None
+        self._last_disk = None
+        self._last_pressure = None
+        # Prime the non-blocking cpu_percent counters so the first tick has a baseline
+        psutil.cpu_percent(interval=None)
+        psutil.cpu_percent(interval=None, percpu=True)
+
+    def _get_partitions(self, now: float):
+        if now - self._partitions_at > self.PARTITION_REFRESH_SECONDS:
+            self._partitions = get_platform_specific_disk_info()["partitions"]
+            self._partitions_at = now
+        return self._partitions
+
+    def _rate(self, current, previous, field: str, elapsed: Optional[float]) -> float:
+        if current is None or previous is None or not elapsed:
+            return 0.0
+        return max(0, getattr(current, field) - getattr(previous, field)) / elapsed
+
+    def sample(self):
+        """Return (snapshot dict, history row) for one tick"""
+        now = time.time()
+        timestamp = datetime.now().isoformat()
+        elapsed = now - self._last_sample_at if self._last_sample_at else None
+        system = platform.system()
+
+        cpu_percent = psutil.cpu_percent(interval=None)
+        cpu_percent_per_core = psutil.cpu_percent(interval=None, percpu=True)
+        cpu_freq_info = {"current": None, "min": None, "max": None}
+        try:
+            freq = psutil.cpu_freq()
+            if freq:
+                cpu_freq_info = {"current": freq.current, "min": freq.min, "max": freq.max}
+        except (AttributeError, FileNotFoundError, OSError):
+            pass
+        static_cpu = self.platform_cpu_info
+        cpu = {
+            "timestamp": timestamp,
+            "cpu_percent": cpu_percent,
+            "cpu_count": static_cpu["cpu_count"],
+            "cpu_count_logical": static_cpu["cpu_count_logical"],
+            "cpu_count_physical": static_cpu["cpu_count_physical"],
+            "cpu_freq": cpu_freq_info,
+            "cpu_percent_per_core": cpu_percent_per_core,
+            "cpu_model": static_cpu["cpu_model"],
+            "platform": static_cpu["system"]
+        }
+
+        memory_info = {"total": 0, "available": 0, "used": 0, "free": 0, "percent": 0}
+        swap_info = {"total": 0, "used": 0, "free": 0, "percent": 0}
+        platform_memory_info = get_platform_specific_memory_info()
+        if platform_memory_info["memory"]:
+            vm = platform_memory_info["memory"]
+            memory_info = {"total": vm.total, "available": vm.available, "used": vm.used,
+                           "free": vm.free, "percent": vm.percent}
+        if platform_memory_info["swap"]:
+            sw = platform_memory_info["swap"]
+            swap_info = {"total": sw.total, "used": sw.used, "free": sw.free, "percent": sw.percent}
+        memory = {"timestamp": timestamp, "memory": memory_info, "swap": swap_info, "platform": system}
+
+        partitions = {}
+        for partition in self._get_partitions(now):
+            try:
+                usage = psutil.disk_usage(partition.mountpoint)
+            except (PermissionError, FileNotFoundError, OSError):
+                continue
+            partitions[partition.device] = {
+                "mountpoint": partition.mountpoint,
+                "fstype": partition.fstype,
+                "total": usage.total,
+                "used": usage.used,
+                "free": usage.free,
+                "percent": usage.percent
+            }
+        disk_io = None
+        try:
+            disk_io = psutil.disk_io_counters()
+        except Exception:
+            pass
+        io_counters = {"read_count": 0, "write_count": 0, "read_bytes": 0, "write_bytes": 0}
+        if disk_io:
+            io_counters = {"read_count": disk_io.read_count, "write_count": disk_io.write_count,
+                           "read_bytes": disk_io.read_bytes, "write_bytes": disk_io.write_bytes}
+        disk = {"timestamp": timestamp, "partitions": partitions, "io_counters": io_counters, "platform": system}
+
+        platform_network_info = get_platform_specific_network_info()
+        net_io = platform_network_info["io_counters"]
+        utilization = {
+            "bytes_sent_per_sec": self._rate(net_io, self._last_net, "bytes_sent", elapsed),
+            "bytes_recv_per_sec": self._rate(net_io, self._last_net, "bytes_recv", elapsed),
+            "packets_sent_per_sec": self._rate(net_io, self._last_net, "packets_sent", elapsed),
+            "packets_recv_per_sec": self._rate(net_io, self._last_net, "packets_recv", elapsed),
+        }
+        utilization["mb_sent_per_sec"] = utilization["bytes_sent_per_sec"] / (1024 * 1024)
+        utilization["mb_recv_per_sec"] = utilization["bytes_recv_per_sec"] / (1024 * 1024)
+        interfaces = {}
+        for interface_name, addresses in platform_network_info["interfaces"].items():
+            interface_info = {"addresses": [], "stats": {}}
+            for addr in addresses:
+                interface_info["addresses"].append({
+                    "family": str(addr.family),
+                    "address": addr.address,
+                    "netmask": addr.netmask,
+                    "broadcast": addr.broadcast
+                })
+            stats = platform_network_info["stats"].get(interface_name)
+            if stats:
+                interface_info["stats"] = {"isup": stats.isup, "duplex": stats.duplex,
+                                           "speed": stats.speed, "mtu": stats.mtu}
+            interfaces[interface_name] = interface_info
+        net_counters = {"bytes_sent": 0, "bytes_recv": 0, "packets_sent": 0, "packets_recv": 0}
+        if net_io:
+            net_counters = {"bytes_sent": net_io.bytes_sent, "bytes_recv": net_io.bytes_recv,
+                            "packets_sent": net_io.packets_sent, "packets_recv": net_io.packets_recv}
+        network = {
+            "timestamp": timestamp,
+            "interfaces": interfaces,
+            "io_counters": net_counters,
+            "utilization": utilization,
+            "formatted_utilization": {
+                "upload_speed": f"{utilization['mb_sent_per_sec']:.2f} MB/s",
+                "download_speed": f"{utilization['mb_recv_per_sec']:.2f} MB/s",
+                "upload_packets": f"{utilization['packets_sent_per_sec']:.1f} pkt/s",
+                "download_packets": f"{utilization['packets_recv_per_sec']:.1f} pkt/s"
+            }
+        }
+
+        # Summary reports only the first readable partition, like the endpoint does
+        summary_disk = {}
+        for device, usage in partitions.items():
+            summary_disk[device] = {key: usage[key] for key in ("mountpoint", "total", "used", "free", "percent")}
+            break
+        summary = {
+            "timestamp": timestamp,
+            "cpu_percent": cpu_percent,
+            "memory_percent": memory_info["percent"],
+            "memory_used": memory_info["used"],
+            "memory_total": memory_info["total"],
+            "disk_usage": summary_disk,
+            "network_bytes_sent": net_counters["bytes_sent"],
+            "network_bytes_recv": net_counters["bytes_recv"],
+            "platform": system
+        }
+
+        pressure_resources = read_pressure()
+        for resource, kinds in pressure_resources.items():
+            previous = (self._last_pressure or {}).get(resource)
+            for kind, values in (kinds or {}).items():
+                # The kernel's shortest average is over 10s; per-tick deltas of the stall counter are sharper
+                if previous and kind in previous and elapsed:
+                    stalled_us = max(0, values["total"] - previous[kind]["total"])
+                    values["stall_percent"] = min(100.0, stalled_us / (elapsed * 1e6) * 100)
+                else:
+                    values["stall_percent"] = values["avg10"]
+        pressure = {"timestamp": timestamp, "available": any(pressure_resources.values()),
+                    "resources": pressure_resources}
+
+        def stall_percent(resource: str, kind: str) -> float:
+            return ((pressure_resources.get(resource) or {}).get(kind) or {}).get("stall_percent", 0.0)
+
+        meminfo_fields = read_meminfo()
+        breakdown = summarize_meminfo(meminfo_fields) if meminfo_fields else None
+        meminfo = {"timestamp": timestamp, "breakdown": breakdown, "fields": meminfo_fields}
+
+        try:
+            load_1 = psutil.getloadavg()[0]
+        except (AttributeError, OSError):
+            load_1 = 0.0
+        history_row = (
+            now,
+            cpu_percent,
+            memory_info["percent"],
+            swap_info["percent"],
+            load_1,
+            self._rate(disk_io, self._last_disk, "read_bytes", elapsed),
+            self._rate(disk_io, self._last_disk, "write_bytes", elapsed),
+            utilization["bytes_sent_per_sec"],
+            utilization["bytes_recv_per_sec"],
+            stall_percent("cpu", "some"),
+            stall_percent("memory", "some"),
+            stall_percent("memory", "full"),
+            stall_percent("io", "some"),
+            stall_percent("io", "full"),
+            breakdown["cached"] if breakdown else 0,
+            breakdown["buffers"] if breakdown else 0,
+            breakdown["dirty"] if breakdown else 0,
+            breakdown["writeback"] if breakdown else 0,
+            breakdown["slab"] if breakdown else 0,
+            breakdown["hugepages"]["used_bytes"] if breakdown else 0,
+        )
+
+        self._last_sample_at = now
+        self._last_pressure = pressure_resources
+        self._last_net = net_io
+        self._last_disk = disk_io
+        snapshot = {
+            "collected_at": now,
+            "interval": COLLECTOR_INTERVAL,
+            "cpu": cpu,
+            "memory": memory,
+            "disk": disk,
+            "network": network,
+            "summary": summary,
+            "pressure": pressure,
+            "meminfo": meminfo
+        }
+        return snapshot, history_row
+
+def run_collector(segment_name: str = COLLECTOR_SHM_NAME, interval: float = COLLECTOR_INTERVAL,
+                  spawned: bool = False):
+    """Collector process entry point: sample forever and publish into the segment"""
+    try:
+        segment = MetricsSegment.attach(segment_name, untrack=not spawned)
+        created = False
+    except FileNotFoundError:
+        # Standalone collector (python main.py --collector) owns the segment
+        segment = MetricsSegment.create(segment_name)
+        created = True
+    segment.set_writer(os.getpid())
+    collector = MetricsCollector()
+    logger.info(f"Metrics collector started (pid {os.getpid()}, interval {interval}s, segment {segment_name})")
+    try:
+        while True:
+            started = time.monotonic()
+            try:
+                snapshot, history_row = collector.sample()
+                segment.write(json.dumps(snapshot).encode(), history_row)
+            except Exception as e:
+                logger.error(f"Metrics collector tick failed: {e}")
+            time.sleep(max(0.0, interval - (time.monotonic() - started)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        segment.close()
+        if created:
+            segment.unlink()
+
+# Worker-side view of the collector segment
+metrics_segment: Optional[MetricsSegment] = None
+collector_process = None
+_collector_snapshot_memo = (None, None)  # (seq, parsed snapshot)
+
+def read_collector_snapshot() -> Optional[dict]:
+    """Latest collector snapshot, or None if no fresh snapshot is available"""
+    global _collector_snapshot_memo
+    if metrics_segment is None or metrics_segment.age() > COLLECTOR_STALE_AFTER:
+        return None
+    result = metrics_segment.read()
+    if result is None:
+        return None
+    seq, payload, _ = result
+    memo_seq, memo_snapshot = _collector_snapshot_memo
+    if memo_seq == seq:
+        return memo_snapshot
+    # Parse each published snapshot at most once per worker
+    snapshot = json.loads(payload)
+    _collector_snapshot_memo = (seq, snapshot)
+    return snapshot
+
+def read_collector_history(count: int) -> Optional[np.ndarray]:
+    """Copy of the most recent history rows (oldest first), or None without a collector"""
+    if metrics_segment is None:
+        return None
+    result = metrics_segment.read(history_count=count)
+    return result[2] if result else None
+
+def _spawn_collector_process():
+    ctx = multiprocessing.get_context("spawn")
+    process = ctx.Process(target=run_collector, args=(COLLECTOR_SHM_NAME, COLLECTOR_INTERVAL, True),
+                          name="serverguard-collector", daemon=True)
+    process.start()
+    return process
+
+async def _watch_collector_process():
+    """Restart the collector if it dies while this worker owns the segment"""
+    global collector_process
+    while True:
+        await asyncio.sleep(max(COLLECTOR_INTERVAL * 5, 5.0))
+        if collector_process is not None and not collector_process.is_alive():
+            logger.warning("Metrics collector exited; restarting")
+            collector_process = _spawn_collector_process()
+
+@app.on_event("startup")
+async def start_metrics_collector():
+    global metrics_segment, collector_process
+    if not COLLECTOR_ENABLED:
+        return
+    try:
+        try:
+            metrics_segment = MetricsSegment.create(COLLECTOR_SHM_NAME)
+        except FileExistsError:
+            try:
+                metrics_segment = MetricsSegment.attach(COLLECTOR_SHM_NAME)
+            except SegmentLayoutMismatch as e:
+                # Left behind by an older version; its readers keep their own mapping
+                logger.warning(f"Replacing metrics segment: {e}")
+                MetricsSegment.discard(COLLECTOR_SHM_NAME)
+                metrics_segment = MetricsSegment.create(COLLECTOR_SHM_NAME)
+            else:
+                if metrics_segment.writer_alive() or metrics_segment.age() < COLLECTOR_STALE_AFTER:
+                    logger.info("Attached to running metrics collector")
+                    return
+                # Left behind by a crashed server: take it over
+                logger.warning("Removing stale metrics segment")
+                metrics_segment.close()
+                metrics_segment.unlink()
+                metrics_segment = MetricsSegment.create(COLLECTOR_SHM_NAME)
+        collector_process = _spawn_collector_process()
+        asyncio.create_task(_watch_collector_process())
+        logger.info(f"Spawned metrics collector process (pid {collector_process.pid})")
+    except Exception as e:
+        # Endpoints fall back to sampling psutil directly
+        logger.error(f"Metrics collector unavailable: {e}")
+        metrics_segment = None
+
+@app.on_event("shutdown")
+async def stop_metrics_collector():
+    global metrics_segment, collector_process
+    if collector_process is not None:
+        collector_process.terminate()
+        collector_process.join(timeout=5)
+        collector_process = None
+    if metrics_segment is not None:
+        owner = metrics_segment.owner
+        metrics_segment.close()
+        if owner:
+            metrics_segment.unlink()
+        metrics_segment = None
+
 # Optimized CPU info with caching - Cross-platform optimized
 async def get_cpu_info_optimized():
+    # Served from the shared collector when it is running
+    snapshot = read_collector_snapshot()
+    if snapshot:
+        return snapshot["cpu"]
+    
     cached = await get_cached_data('cpu_info', 1)  # 1 second cache for real-time updates
     if cached:
         return cached
@@ -462,9 +1230,9 @@ async def get_cpu_info_optimized():
     def get_platform_cpu_info():
         return get_platform_specific_cpu_info()
     
-    cpu_percent = await loop.run_in_executor(executor, get_cpu_percent)
-    cpu_percent_per_core = await loop.run_in_executor(executor, get_cpu_percent_per_core)
-    platform_cpu_info = await loop.run_in_executor(executor, get_platform_cpu_info)
+    cpu_percent = await loop.run_in_executor(metrics_executor, get_cpu_percent)
+    cpu_percent_per_core = await loop.run_in_executor(metrics_executor, get_cpu_percent_per_core)
+    platform_cpu_info = await loop.run_in_executor(metrics_executor, get_platform_cpu_info)
     
     # Ensure we don't return 0 if there's actual CPU usage
     # Use a minimum threshold or alternative calculation
@@ -476,7 +1244,7 @@ async def get_cpu_info_optimized():
             nice_value = getattr(cpu_times, 'nice', 0.0)
             return cpu_times.user + cpu_times.system + nice_value
         
-        cpu_percent = await loop.run_in_executor(executor, get_cpu_usage_alternative)
+        cpu_percent = await loop.run_in_executor(metrics_executor, get_cpu_usage_alternative)
     
     # Handle CPU frequency safely
     cpu_freq_info = {
@@ -524,6 +1292,8 @@ async def get_cpu_info(token: str = Depends(verify_token)):
     try:
         logger.debug("Fetching CPU info")
         return await get_cpu_info_optimized()
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error fetching CPU info: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -599,10 +1369,10 @@ async def get_detailed_cpu_info(token: str = Depends(verify_token)):
             return get_platform_specific_cpu_info()
         
         # Get all CPU information concurrently
-        standard_cpu = await loop.run_in_executor(executor, get_standard_cpu)
-        cpu_times = await loop.run_in_executor(executor, get_cpu_times)
-        per_core_detailed = await loop.run_in_executor(executor, get_per_core_detailed)
-        platform_cpu_info = await loop.run_in_executor(executor, get_platform_cpu_info)
+        standard_cpu = await loop.run_in_executor(metrics_executor, get_standard_cpu)
+        cpu_times = await loop.run_in_executor(metrics_executor, get_cpu_times)
+        per_core_detailed = await loop.run_in_executor(metrics_executor, get_per_core_detailed)
+        platform_cpu_info = await loop.run_in_executor(metrics_executor, get_platform_cpu_info)
         
         # Use the most reliable method as the primary CPU percentage
         primary_cpu_percent = max(standard_cpu, cpu_times["total_active"])
@@ -644,6 +1414,8 @@ async def get_detailed_cpu_info(token: str = Depends(verify_token)):
         }
         
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error fetching detailed CPU info: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -651,6 +1423,10 @@ async def get_detailed_cpu_info(token: str = Depends(verify_token)):
 @app.get("/api/system/memory")
 async def get_memory_info(token: str = Depends(verify_token)):
     try:
+        snapshot = read_collector_snapshot()
+        if snapshot:
+            return snapshot["memory"]
+        
         cached = await get_cached_data('memory_info', 1)  # 1 second cache for real-time updates
         if cached:
             return cached
@@ -661,7 +1437,7 @@ async def get_memory_info(token: str = Depends(verify_token)):
         def get_platform_memory_info():
             return get_platform_specific_memory_info()
         
-        platform_memory_info = await loop.run_in_executor(executor, get_platform_memory_info)
+        platform_memory_info = await loop.run_in_executor(metrics_executor, get_platform_memory_info)
         
         # Handle memory info safely
         memory_info = {
@@ -713,6 +1489,8 @@ async def get_memory_info(token: str = Depends(verify_token)):
         
         await set_cached_data('memory_info', result)
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error fetching memory info: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -720,6 +1498,10 @@ async def get_memory_info(token: str = Depends(verify_token)):
 @app.get("/api/system/disk")
 async def get_disk_info(token: str = Depends(verify_token)):
     try:
+        snapshot = read_collector_snapshot()
+        if snapshot:
+            return snapshot["disk"]
+        
         cached = await get_cached_data('disk_info', 2)  # 2 second cache for disk info
         if cached:
             return cached
@@ -730,13 +1512,13 @@ async def get_disk_info(token: str = Depends(verify_token)):
         def get_platform_disk_info():
             return get_platform_specific_disk_info()
         
-        platform_disk_info = await loop.run_in_executor(executor, get_platform_disk_info)
+        platform_disk_info = await loop.run_in_executor(metrics_executor, get_platform_disk_info)
         
         disk_usage = {}
         if platform_disk_info["partitions"]:
             for partition in platform_disk_info["partitions"]:
                 try:
-                    usage = await loop.run_in_executor(executor, lambda p=partition: psutil.disk_usage(p.mountpoint))
+                    usage = await loop.run_in_executor(metrics_executor, lambda p=partition: psutil.disk_usage(p.mountpoint))
                     disk_usage[partition.device] = {
                         "mountpoint": partition.mountpoint,
                         "fstype": partition.fstype,
@@ -777,6 +1559,8 @@ async def get_disk_info(token: str = Depends(verify_token)):
         
         await set_cached_data('disk_info', result)
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error fetching disk info: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -784,6 +1568,10 @@ async def get_disk_info(token: str = Depends(verify_token)):
 @app.get("/api/system/network")
 async def get_network_info(token: str = Depends(verify_token)):
     try:
+        snapshot = read_collector_snapshot()
+        if snapshot:
+            return snapshot["network"]
+        
         cached = await get_cached_data('network_info', 1)  # 1 second cache for real-time network info
         if cached:
             return cached
@@ -794,7 +1582,7 @@ async def get_network_info(token: str = Depends(verify_token)):
         def get_platform_network_info():
             return get_platform_specific_network_info()
         
-        platform_network_info = await loop.run_in_executor(executor, get_platform_network_info)
+        platform_network_info = await loop.run_in_executor(metrics_executor, get_platform_network_info)
         
         # Handle network data safely
         network_io = platform_network_info["io_counters"]
@@ -896,6 +1684,8 @@ async def get_network_info(token: str = Depends(verify_token)):
         
         await set_cached_data('network_info', result)
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error fetching network info: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -913,7 +1703,7 @@ async def get_os_info(token: str = Depends(verify_token)):
         def get_platform_os_info():
             return get_platform_specific_os_info()
         
-        platform_os_info = await loop.run_in_executor(executor, get_platform_os_info)
+        platform_os_info = await loop.run_in_executor(metrics_executor, get_platform_os_info)
         
         result = {
             "timestamp": datetime.now().isoformat(),
@@ -930,6 +1720,8 @@ async def get_os_info(token: str = Depends(verify_token)):
         
         await set_cached_data('os_info', result)
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error fetching OS info: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -937,6 +1729,10 @@ async def get_os_info(token: str = Depends(verify_token)):
 @app.get("/api/system/summary")
 async def get_system_summary(token: str = Depends(verify_token)):
     try:
+        snapshot = read_collector_snapshot()
+        if snapshot:
+            return snapshot["summary"]
+        
         cached = await get_cached_data('system_summary', 1)  # 1 second cache for real-time updates
         if cached:
             return cached
@@ -953,13 +1749,13 @@ async def get_system_summary(token: str = Depends(verify_token)):
         def get_platform_disk_info():
             return get_platform_specific_disk_info()
         
-        platform_disk_info = await loop.run_in_executor(executor, get_platform_disk_info)
+        platform_disk_info = await loop.run_in_executor(metrics_executor, get_platform_disk_info)
         
         disk_usage = {}
         if platform_disk_info["partitions"]:
             for partition in platform_disk_info["partitions"]:
                 try:
-                    usage = await loop.run_in_executor(executor, lambda p=partition: psutil.disk_usage(p.mountpoint))
+                    usage = await loop.run_in_executor(metrics_executor, lambda p=partition: psutil.disk_usage(p.mountpoint))
                     disk_usage[partition.device] = {
                         "mountpoint": partition.mountpoint,
                         "total": usage.total,
@@ -978,7 +1774,7 @@ async def get_system_summary(token: str = Depends(verify_token)):
         def get_platform_network_info():
             return get_platform_specific_network_info()
         
-        platform_network_info = await loop.run_in_executor(executor, get_platform_network_info)
+        platform_network_info = await loop.run_in_executor(metrics_executor, get_platform_network_info)
         
         if platform_network_info["io_counters"]:
             try:
@@ -1002,10 +1798,110 @@ async def get_system_summary(token: str = Depends(verify_token)):
         
         await set_cached_data('system_summary', result)
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error fetching system summary: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/system/history")
+async def get_system_history(seconds: int = 300, token: str = Depends(verify_token)):
+    """Recent host metrics from the shared collector's history ring"""
+    try:
+        count = max(1, int(seconds / COLLECTOR_INTERVAL))
+        history = read_collector_history(count)
+        if history is None:
+            raise HTTPException(status_code=503, detail="Metrics collector is not running")
+        return {
+            "timestamp": datetime.now().isoformat(),
+            "interval": COLLECTOR_INTERVAL,
+            "count": len(history),
+            "samples": history_samples(history)
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error fetching system history: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def history_samples(history) -> Dict[str, list]:
+    """History columns as lists; float32 fields are rounded to drop the conversion noise"""
+    return {
+        field: (np.round(history[field].astype(np.float64), 3) if history.dtype[field] == np.float32
+                else history[field]).tolist()
+        for field in history.dtype.names
+    }
+
+@app.get("/api/system/executors")
+async def get_executor_stats(token: str = Depends(verify_token)):
+    """Saturation of each worker pool: busy workers, queue depth, rejections, latency"""
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "executors": {name: pool.stats() for name, pool in workload_executors.items()}
+    }
+
+@app.on_event("shutdown")
+async def shutdown_executors():
+    for pool in workload_executors.values():
+        pool.shutdown(wait=False, cancel_futures=True)
+
+@app.get("/api/system/pressure")
+async def get_pressure_info(token: str = Depends(verify_token)):
+    """Linux pressure-stall information for CPU, memory and I/O"""
+    try:
+        snapshot = read_collector_snapshot()
+        if snapshot and "pressure" in snapshot:
+            return {**snapshot["pressure"], "platform": platform.system()}
+        resources = read_pressure()
+        return {
+            "timestamp": datetime.now().isoformat(),
+            "available": any(resources.values()),
+            "resources": resources,
+            "platform": platform.system()
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error fetching pressure info: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/system/memory/breakdown")
+async def get_memory_breakdown(raw: bool = False, token: str = Depends(verify_token)):
+    """Full /proc/meminfo breakdown next to memory pressure.
+
+    High usage with low pressure is just a well-used page cache; rising
+    memory "some"/"full" stall time means tasks are actually waiting on
+    reclaim.
+    """
+    try:
+        snapshot = read_collector_snapshot()
+        if snapshot and "meminfo" in snapshot:
+            meminfo = snapshot["meminfo"]
+            memory_pressure = snapshot["pressure"]["resources"].get("memory")
+        else:
+            fields = read_meminfo()
+            meminfo = {
+                "timestamp": datetime.now().isoformat(),
+                "breakdown": summarize_meminfo(fields) if fields else None,
+                "fields": fields
+            }
+            memory_pressure = read_pressure().get("memory")
+        if meminfo["breakdown"] is None:
+            raise HTTPException(status_code=501, detail="Memory breakdown requires /proc/meminfo (Linux)")
+        result = {
+            "timestamp": meminfo["timestamp"],
+            "breakdown": meminfo["breakdown"],
+            "pressure": memory_pressure
+        }
+        if raw:
+            result["fields"] = meminfo["fields"]
+        return result
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error fetching memory breakdown: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.websocket("/ws/system")
 async def websocket_endpoint(websocket: WebSocket):
     logger.info("System WebSocket connection attempt")
@@ -1023,971 +1919,4862 @@ async def websocket_endpoint(websocket: WebSocket):
         logger.error(f"System WebSocket error: {e}")
         manager.disconnect(websocket)
 
-# Optimized processes endpoint with pagination and caching
-@app.get("/api/system/processes")
-async def get_processes(
-    page: int = 1, 
-    limit: int = 50, 
-    sort_by: str = "cpu_percent", 
-    sort_order: str = "desc",
-    token: str = Depends(verify_token)
-):
-    try:
-        # Cache key includes pagination parameters
-        cache_key = f"processes_{page}_{limit}_{sort_by}_{sort_order}"
-        cached = await get_cached_data(cache_key, 1)  # 1 second cache for processes
-        if cached:
-            return cached
-        
-        loop = asyncio.get_event_loop()
-        
-        # Get all processes efficiently
-        def get_processes_data():
-            processes = []
-            for proc in psutil.process_iter(['pid', 'name', 'username', 'memory_percent', 'status', 'create_time']):
-                try:
-                    pinfo = proc.info
-                    # Get CPU percent without blocking
-                    pinfo['cpu_percent'] = proc.cpu_percent(interval=None)
-                    # Convert create_time to ISO format
-                    if pinfo['create_time']:
-                        pinfo['create_time'] = datetime.fromtimestamp(pinfo['create_time']).isoformat()
-                    processes.append(pinfo)
-                except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-                    pass
-            return processes
-        
-        processes = await loop.run_in_executor(executor, get_processes_data)
-        
-        # Sort processes
-        reverse = sort_order == "desc"
-        if sort_by == "cpu_percent":
-            processes.sort(key=lambda x: x.get('cpu_percent', 0) or 0, reverse=reverse)
-        elif sort_by == "memory_percent":
-            processes.sort(key=lambda x: x.get('memory_percent', 0) or 0, reverse=reverse)
+# ==================== Process Table ====================
+# One persistent table of processes, refreshed at most once per tick and keyed
+# by (pid, start time) so recycled PIDs are never confused. Each refresh diffs
+# against the previous tick, only rebuilds rows for processes that changed and
+# every sort/page variant of the processes endpoint is served from the same
+# snapshot.
+
+PROCESS_TABLE_INTERVAL = float(os.getenv("PROCESS_TABLE_INTERVAL", "1.0"))
+
+PROC_STATUS_NAMES = {
+    "R": psutil.STATUS_RUNNING, "S": psutil.STATUS_SLEEPING, "D": psutil.STATUS_DISK_SLEEP,
+    "Z": psutil.STATUS_ZOMBIE, "T": psutil.STATUS_STOPPED, "t": psutil.STATUS_TRACING_STOP,
+    "X": psutil.STATUS_DEAD, "I": "idle", "W": "waking", "K": "wake-kill", "P": "parked"
+}
+
+class ProcessEntry:
+    """Per-process state that survives between ticks"""
+    __slots__ = ("key", "pid", "name", "username", "create_time", "comm", "cpu_time", "row")
+
+    def __init__(self, key, pid, name, username, create_time, comm=None):
+        self.key = key
+        self.pid = pid
+        self.name = name
+        self.username = username
+        self.create_time = create_time
+        # Raw /proc comm the name was resolved from; it changes on exec
+        self.comm = comm
+        self.cpu_time = None
+        self.row = None
+
+PROCESS_NUMERIC_FIELDS = {
+    "cpu_percent": np.float64, "memory_percent": np.float64, "rss": np.int64,
+    "num_threads": np.int64, "pid": np.int64, "ppid": np.int64
+}
+PROCESS_TEXT_FIELDS = {"name", "username", "status"}
+PROCESS_FILTER_OPS = {
+    "=": operator.eq, "!=": operator.ne, ">": operator.gt, ">=": operator.ge,
+    "<": operator.lt, "<=": operator.le
+}
+PROCESS_FILTER_CLAUSE = re.compile(r"^\s*([a-z_]+)\s*(!=|>=|<=|=|>|<|~)\s*(.*?)\s*$")
+
+def parse_process_filter(expression: str) -> List[tuple]:
+    """Parse 'cpu_percent>5,name~java,username=root' into (field, op, value) clauses (AND-ed)"""
+    clauses = []
+    for part in expression.split(","):
+        if not part.strip():
+            continue
+        match = PROCESS_FILTER_CLAUSE.match(part)
+        if not match:
+            raise HTTPException(status_code=400, detail=f"Invalid filter clause: {part.strip()}")
+        field, op, value = match.groups()
+        if field in PROCESS_NUMERIC_FIELDS:
+            if op == "~":
+                raise HTTPException(status_code=400, detail=f"Operator ~ is not supported for {field}")
+            try:
+                value = float(value)
+            except ValueError:
+                raise HTTPException(status_code=400, detail=f"Filter value for {field} must be numeric")
+        elif field in PROCESS_TEXT_FIELDS:
+            if op not in ("=", "!=", "~"):
+                raise HTTPException(status_code=400, detail=f"Operator {op} is not supported for {field}")
+            value = value.lower()
+        else:
+            raise HTTPException(status_code=400, detail=f"Unknown filter field: {field}")
+        clauses.append((field, op, value))
+    return clauses
+
+class ProcessSnapshot:
+    """Immutable view of the process table at one tick.
+
+    Numeric columns are materialised as NumPy arrays on first use so filters
+    are vectorised and top-N queries use argpartition instead of full sorts.
+    """
+
+    def __init__(self, generation: int, rows: List[dict], keys: List[tuple], name_order: List[tuple],
+                 new: List[dict], exited: List[dict], changed: List[dict]):
+        self.generation = generation
+        self.taken_at = time.monotonic()
+        self.timestamp = datetime.now().isoformat()
+        self.rows = rows
+        self.keys = keys
+        self.new = new
+        self.exited = exited
+        self.changed = changed
+        self._name_order_keys = name_order
+        self._name_order = None
+        self._columns: Dict[str, Any] = {}
+        self._tree = None
+
+    def column(self, field: str):
+        column = self._columns.get(field)
+        if column is None:
+            if field in PROCESS_NUMERIC_FIELDS:
+                column = np.fromiter((row[field] or 0 for row in self.rows),
+                                     dtype=PROCESS_NUMERIC_FIELDS[field], count=len(self.rows))
+            else:
+                column = [(row[field] or "").lower() for row in self.rows]
+            self._columns[field] = column
+        return column
+
+    def name_order(self) -> np.ndarray:
+        """Row indices in name order, mapped from the table's incrementally maintained index"""
+        if self._name_order is None:
+            position = {key: index for index, key in enumerate(self.keys)}
+            self._name_order = np.fromiter((position[key] for key in self._name_order_keys),
+                                           dtype=np.int64, count=len(self._name_order_keys))
+        return self._name_order
+
+    def mask(self, clauses: List[tuple]) -> Optional[np.ndarray]:
+        mask = None
+        for field, op, value in clauses:
+            column = self.column(field)
+            if field in PROCESS_NUMERIC_FIELDS:
+                clause_mask = PROCESS_FILTER_OPS[op](column, value)
+            elif op == "~":
+                clause_mask = np.fromiter((value in text for text in column), dtype=bool, count=len(column))
+            elif op == "in":
+                clause_mask = np.fromiter((text in value for text in column), dtype=bool, count=len(column))
+            else:
+                clause_mask = np.fromiter((text == value for text in column), dtype=bool, count=len(column))
+                if op == "!=":
+                    clause_mask = ~clause_mask
+            mask = clause_mask if mask is None else mask & clause_mask
+        return mask
+
+    def select(self, clauses: List[tuple], sort_by: str, reverse: bool, offset: int, limit: int):
+        """Return (matching count, rows[offset:offset+limit]) in the requested order"""
+        mask = self.mask(clauses)
+        candidates = np.arange(len(self.rows)) if mask is None else np.flatnonzero(mask)
+        total = len(candidates)
+        end = min(offset + limit, total)
+        if offset >= end:
+            return total, []
+        
+        if sort_by in PROCESS_NUMERIC_FIELDS:
+            values = self.column(sort_by)[candidates]
+            sort_keys = -values if reverse else values
+            if end < total:
+                # Only the first `end` rows matter: find the kth key, then sort every row
+                # up to and including its ties so pages agree on the order within a tie
+                kth = sort_keys[np.argpartition(sort_keys, end - 1)[end - 1]]
+                head = np.flatnonzero(sort_keys <= kth)
+                order = head[np.argsort(sort_keys[head], kind="stable")]
+            else:
+                order = np.argsort(sort_keys, kind="stable")
+            picked = candidates[order[offset:end]]
         elif sort_by == "name":
-            processes.sort(key=lambda x: x.get('name', '').lower(), reverse=reverse)
-        elif sort_by == "pid":
-            processes.sort(key=lambda x: x.get('pid', 0), reverse=reverse)
-        
-        # Pagination
-        total = len(processes)
-        start_idx = (page - 1) * limit
-        end_idx = start_idx + limit
-        paginated_processes = processes[start_idx:end_idx]
-        
-        result = {
-            "timestamp": datetime.now().isoformat(),
-            "processes": paginated_processes,
-            "pagination": {
-                "page": page,
-                "limit": limit,
-                "total": total,
-                "pages": (total + limit - 1) // limit
-            }
-        }
-        
-        await set_cached_data(cache_key, result)
-        return result
-    except Exception as e:
-        logger.error(f"Error fetching processes: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+            order = self.name_order()
+            if reverse:
+                order = order[::-1]
+            if mask is not None:
+                order = order[mask[order]]
+            picked = order[offset:end]
+        else:
+            picked = candidates[offset:end]
+        return total, [self.rows[index] for index in picked]
 
-# Real-time terminal with WebSocket support
-@app.websocket("/ws/terminal/{session_id}")
-async def terminal_websocket(websocket: WebSocket, session_id: str):
-    logger.info(f"Terminal WebSocket connection attempt for session: {session_id}")
-    await manager.connect(websocket)
-    
-    if session_id not in manager.terminal_sessions:
-        manager.terminal_sessions[session_id] = {
-            "process": None,
-            "history": [],
-            "connected": True,
-            "current_directory": os.getcwd(),
-            "environment": dict(os.environ)
-        }
-        logger.info(f"Created new terminal session: {session_id}")
-    
-    try:
-        # Send welcome message
-        welcome_msg = {
-            "type": "system",
-            "message": f"Terminal session {session_id} established. Ready for commands.",
-            "current_directory": manager.terminal_sessions[session_id]["current_directory"]
+    def top_indices(self, field: str, count: int) -> np.ndarray:
+        """Row indices of the `count` largest values of a numeric column (unordered)"""
+        values = self.column(field)
+        if count <= 0:
+            return np.arange(0)
+        if count >= len(values):
+            return np.arange(len(values))
+        return np.argpartition(-values, count - 1)[:count]
+
+    def tree(self) -> "ProcessTree":
+        if self._tree is None:
+            self._tree = ProcessTree(self)
+        return self._tree
+
+class ProcessTree:
+    """Parent/child index over one snapshot with per-subtree resource totals.
+
+    Children are stored CSR-style (row indices grouped by parent) and subtree
+    totals are accumulated level by level from the leaves up with np.add.at,
+    so building the whole tree is a handful of vectorised passes.
+    """
+
+    def __init__(self, snapshot: ProcessSnapshot):
+        self.snapshot = snapshot
+        count = len(snapshot.rows)
+        pids = snapshot.column("pid").tolist()
+        self.index_of = {pid: index for index, pid in enumerate(pids)}
+        parent = np.fromiter((self.index_of.get(ppid, -1) for ppid in snapshot.column("ppid").tolist()),
+                             dtype=np.int64, count=count)
+        parent[parent == np.arange(count)] = -1  # pid 0 / self-parented kernel threads are roots
+        self.parent = parent
+        
+        order = np.argsort(parent, kind="stable")
+        sorted_parents = parent[order]
+        self.child_order = order
+        self.child_start = np.searchsorted(sorted_parents, np.arange(count), side="left")
+        self.child_end = np.searchsorted(sorted_parents, np.arange(count), side="right")
+        self.roots = order[:np.searchsorted(sorted_parents, -1, side="right")]
+        
+        # Breadth-first levels; anything unreachable (a parent cycle) is left out
+        levels = []
+        frontier = self.roots
+        while frontier.size and len(levels) < count:
+            levels.append(frontier)
+            frontier = np.flatnonzero(np.isin(parent, frontier))
+        
+        self.cpu_percent = snapshot.column("cpu_percent").astype(np.float64)
+        self.memory_percent = snapshot.column("memory_percent").astype(np.float64)
+        self.rss = snapshot.column("rss").astype(np.int64)
+        self.process_count = np.ones(count, dtype=np.int64)
+        for level in reversed(levels[1:]):
+            level_parents = parent[level]
+            np.add.at(self.cpu_percent, level_parents, self.cpu_percent[level])
+            np.add.at(self.memory_percent, level_parents, self.memory_percent[level])
+            np.add.at(self.rss, level_parents, self.rss[level])
+            np.add.at(self.process_count, level_parents, self.process_count[level])
+
+    def children(self, index: int) -> np.ndarray:
+        return self.child_order[self.child_start[index]:self.child_end[index]]
+
+    def subtree(self, indices) -> dict:
+        return {
+            "cpu_percent": round(float(self.cpu_percent[indices].sum()), 1),
+            "memory_percent": round(float(self.memory_percent[indices].sum()), 2),
+            "rss": int(self.rss[indices].sum()),
+            "process_count": int(self.process_count[indices].sum())
         }
-        await websocket.send_text(json.dumps(welcome_msg))
-        logger.info(f"Sent welcome message to session: {session_id}")
+
+    def build_nodes(self, indices: np.ndarray, depth: int, expand: set, group_threshold: int,
+                    max_children: int, sort_by: str) -> dict:
+        """Render one level of nodes, descending `depth` more levels (or into `expand`ed pids)"""
+        sort_values = self.rss if sort_by == "rss" else self.cpu_percent
+        indices = indices[np.argsort(-sort_values[indices], kind="stable")]
+        rows = self.snapshot.rows
+        
+        grouped: Dict[str, List[int]] = {}
+        if group_threshold > 0 and len(indices) > group_threshold:
+            by_name: Dict[str, List[int]] = {}
+            for index in indices.tolist():
+                by_name.setdefault(rows[index]["name"], []).append(index)
+            grouped = {name: members for name, members in by_name.items() if len(members) > group_threshold}
+        
+        nodes = []
+        emitted_groups = set()
+        for index in indices.tolist():
+            name = rows[index]["name"]
+            if name in grouped:
+                # Collapse many identical siblings (e.g. worker pools) into one summary node
+                if name not in emitted_groups:
+                    emitted_groups.add(name)
+                    members = grouped[name]
+                    nodes.append({
+                        "type": "group",
+                        "name": name,
+                        "count": len(members),
+                        "pids": [rows[member]["pid"] for member in members[:20]],
+                        "subtree": self.subtree(members)
+                    })
+            else:
+                nodes.append(self.build_node(index, depth, expand, group_threshold, max_children, sort_by))
+            if len(nodes) >= max_children:
+                break
         
-        # Add a timeout for receiving messages to prevent hanging
-        while True:
+        return {"nodes": nodes, "total": len(indices), "truncated": len(nodes) >= max_children and len(indices) > max_children}
+
+    def build_node(self, index: int, depth: int, expand: set, group_threshold: int,
+                   max_children: int, sort_by: str) -> dict:
+        row = self.snapshot.rows[index]
+        children = self.children(index)
+        node = {
+            "type": "process",
+            "pid": row["pid"],
+            "ppid": row["ppid"],
+            "name": row["name"],
+            "username": row["username"],
+            "status": row["status"],
+            "cpu_percent": row["cpu_percent"],
+            "memory_percent": row["memory_percent"],
+            "rss": row["rss"],
+            "num_threads": row["num_threads"],
+            "subtree": self.subtree([index]),
+            "child_count": len(children),
+            "children": None
+        }
+        if len(children) and (depth > 0 or row["pid"] in expand):
+            level = self.build_nodes(children, depth - 1, expand, group_threshold, max_children, sort_by)
+            node["children"] = level["nodes"]
+            node["children_truncated"] = level["truncated"]
+        return node
+
+class ProcessTable:
+    def __init__(self):
+        self.entries: Dict[tuple, ProcessEntry] = {}
+        self.snapshot: Optional[ProcessSnapshot] = None
+        self.generation = 0
+        self._last_refresh = None
+        self._refresh_lock = threading.Lock()
+        # (lower-cased name, pid, key) kept sorted across ticks; only new and
+        # exited processes are inserted or removed
+        self._name_index: List[tuple] = []
+        self._uid_names: Dict[int, str] = {}
+        self._use_procfs = platform.system() == "Linux" and os.path.isdir("/proc")
+        if self._use_procfs:
+            self._clock_ticks = os.sysconf("SC_CLK_TCK")
+            self._page_size = os.sysconf("SC_PAGE_SIZE")
+            self._boot_time = psutil.boot_time()
+
+    def _username(self, uid: int) -> Optional[str]:
+        name = self._uid_names.get(uid)
+        if name is None:
             try:
-                # Use asyncio.wait_for to add a timeout to receive_text
-                data = await asyncio.wait_for(websocket.receive_text(), timeout=300.0)  # 5 minute timeout
-                message = json.loads(data)
-                
-                if message["type"] == "command":
-                    command = message["command"]
-                    logger.info(f"Received command in session {session_id}: {command}")
-                    
-                    # Enhanced security check with more comprehensive dangerous command detection
-                    dangerous_patterns = [
-                        # File system destruction
-                        r'rm\s+-rf', r'del\s+/s\s+/q', r'format\s+[c-z]:', r'mkfs\..*',
-                        # System commands
-                        r'shutdown', r'reboot', r'halt', r'poweroff',
-                        # Disk operations
-                        r'fdisk', r'parted', r'dd\s+if=/dev/zero', r'dd\s+if=/dev/urandom',
-                        # Network manipulation
-                        r'iptables\s+-F', r'ipconfig\s+/release', r'ipconfig\s+/renew',
-                        # User management
-                        r'net\s+user\s+add', r'net\s+user\s+delete', r'useradd', r'userdel',
-                        # Service manipulation
-                        r'sc\s+delete', r'systemctl\s+disable', r'chkconfig\s+--del',
-                        # Registry/configuration
-                        r'reg\s+delete', r'reg\s+add', r'reg\s+export',
-                        # Process manipulation
-                        r'taskkill\s+/f', r'killall', r'pkill\s+-9',
-                        # Package management
-                        r'yum\s+remove', r'apt\s+remove', r'apt\s+purge', r'choco\s+uninstall',
-                        # Network scanning
-                        r'nmap', r'netstat\s+-an', r'arp\s+-a',
-                        # System information gathering
-                        r'wmic\s+process', r'wmic\s+service', r'wmic\s+startup'
-                    ]
-                    
-                    import re
-                    command_lower = command.lower()
-                    if any(re.search(pattern, command_lower) for pattern in dangerous_patterns):
-                        error_msg = {
-                            "type": "error",
-                            "message": "Potentially dangerous command rejected for safety",
-                            "command": command
-                        }
-                        await websocket.send_text(json.dumps(error_msg))
-                        logger.warning(f"Dangerous command rejected in session {session_id}: {command}")
-                        continue
-                    
-                    # Execute command asynchronously with real-time output streaming
-                    try:
-                        logger.info(f"Executing command in session {session_id}: {command}")
-                        
-                        # Update current directory if it's a cd command
-                        if command.strip().startswith('cd '):
-                            new_dir = command.strip()[3:].strip()
-                            if new_dir:
-                                try:
-                                    if new_dir == '~':
-                                        new_dir = os.path.expanduser('~')
-                                    elif not os.path.isabs(new_dir):
-                                        new_dir = os.path.join(manager.terminal_sessions[session_id]["current_directory"], new_dir)
-                                    
-                                    if os.path.exists(new_dir) and os.path.isdir(new_dir):
-                                        manager.terminal_sessions[session_id]["current_directory"] = os.path.abspath(new_dir)
-                                        success_msg = {
-                                            "type": "system",
-                                            "message": f"Changed directory to: {manager.terminal_sessions[session_id]['current_directory']}"
-                                        }
-                                        await websocket.send_text(json.dumps(success_msg))
-                                        continue
-                                    else:
-                                        error_msg = {
-                                            "type": "error",
-                                            "message": f"Directory not found: {new_dir}"
-                                        }
-                                        await websocket.send_text(json.dumps(error_msg))
-                                        continue
-                                except Exception as e:
-                                    error_msg = {
-                                        "type": "error",
-                                        "message": f"Error changing directory: {str(e)}"
-                                    }
-                                    await websocket.send_text(json.dumps(error_msg))
-                                    continue
-                        
-                        # Prepare environment with current directory
-                        env = dict(os.environ)
-                        env['PWD'] = manager.terminal_sessions[session_id]["current_directory"]
-                        
-                        # Use asyncio.create_subprocess_exec for better control
-                        if platform.system() == "Windows":
-                            process = await asyncio.create_subprocess_exec(
-                                'cmd', '/c', command,
-                                stdout=asyncio.subprocess.PIPE,
-                                stderr=asyncio.subprocess.PIPE,
-                                stdin=asyncio.subprocess.PIPE,
-                                cwd=manager.terminal_sessions[session_id]["current_directory"],
-                                env=env
-                            )
-                        else:
-                            # Use the user's default shell, or fallback to /bin/sh (POSIX-compliant, available on all Unix systems)
-                            shell = os.environ.get('SHELL', '/bin/sh')
-                            # Validate that the shell exists, fallback to /bin/sh if not
-                            if not os.path.exists(shell):
-                                shell = '/bin/sh'
-                            
-                            process = await asyncio.create_subprocess_exec(
-                                shell, '-c', command,
-                                stdout=asyncio.subprocess.PIPE,
-                                stderr=asyncio.subprocess.PIPE,
-                                stdin=asyncio.subprocess.PIPE,
-                                cwd=manager.terminal_sessions[session_id]["current_directory"],
-                                env=env
-                            )
-                        
-                        manager.terminal_sessions[session_id]["process"] = process
-                        
-                        # Stream output in real-time
-                        async def stream_output():
-                            try:
-                                # Read stdout and stderr concurrently
-                                stdout_task = asyncio.create_task(process.stdout.read())
-                                stderr_task = asyncio.create_task(process.stderr.read())
-                                
-                                # Wait for both to complete
-                                stdout_data, stderr_data = await asyncio.gather(stdout_task, stderr_task)
-                                
-                                # Send stdout
-                                if stdout_data:
-                                    output_msg = {
-                                        "type": "output",
-                                        "data": stdout_data.decode('utf-8', errors='replace')
-                                    }
-                                    await websocket.send_text(json.dumps(output_msg))
-                                    logger.debug(f"Sent stdout to session {session_id}: {len(stdout_data)} bytes")
-                                
-                                # Send stderr
-                                if stderr_data:
-                                    error_msg = {
-                                        "type": "error",
-                                        "data": stderr_data.decode('utf-8', errors='replace')
-                                    }
-                                    await websocket.send_text(json.dumps(error_msg))
-                                    logger.debug(f"Sent stderr to session {session_id}: {len(stderr_data)} bytes")
-                                
-                                # Wait for process to complete
-                                return_code = await process.wait()
-                                
-                                # Send exit code
-                                exit_msg = {
-                                    "type": "exit",
-                                    "code": return_code
-                                }
-                                await websocket.send_text(json.dumps(exit_msg))
-                                logger.info(f"Command completed in session {session_id} with exit code: {return_code}")
-                                
-                            except Exception as e:
-                                logger.error(f"Error streaming output in session {session_id}: {e}")
-                                error_msg = {
-                                    "type": "error",
-                                    "message": f"Error streaming command output: {str(e)}"
-                                }
-                                await websocket.send_text(json.dumps(error_msg))
-                        
-                        # Start streaming in background
-                        asyncio.create_task(stream_output())
-                        
-                    except Exception as e:
-                        error_msg = {
-                            "type": "error",
-                            "message": f"Command execution failed: {str(e)}"
-                        }
-                        await websocket.send_text(json.dumps(error_msg))
-                        logger.error(f"Command execution failed in session {session_id}: {e}")
-                
-                elif message["type"] == "get_directory":
-                    # Send current directory
-                    dir_msg = {
-                        "type": "directory",
-                        "path": manager.terminal_sessions[session_id]["current_directory"]
-                    }
-                    await websocket.send_text(json.dumps(dir_msg))
+                import pwd
+                name = pwd.getpwuid(uid).pw_name
+            except (KeyError, ImportError):
+                name = str(uid)
+            self._uid_names[uid] = name
+        return name
+
+    def _remove_from_name_index(self, name: Optional[str], pid: int, key: tuple):
+        index_item = ((name or "").lower(), pid, key)
+        position = bisect.bisect_left(self._name_index, index_item)
+        if position < len(self._name_index) and self._name_index[position] == index_item:
+            del self._name_index[position]
+
+    def _read_procfs(self):
+        """Yield (key, pid, stat fields, comm) for every readable /proc/<pid>/stat"""
+        for name in os.listdir("/proc"):
+            if not name.isdigit():
+                continue
+            try:
+                with open(f"/proc/{name}/stat", "rb") as f:
+                    data = f.read()
+            except OSError:
+                continue  # exited between listdir and open
+            # comm may itself contain spaces or parentheses, so split on the last ')'
+            open_paren = data.find(b"(")
+            close_paren = data.rfind(b")")
+            comm = data[open_paren + 1:close_paren].decode("utf-8", "replace")
+            fields = data[close_paren + 2:].split()
+            pid = int(name)
+            yield (pid, int(fields[19])), pid, fields, comm
+
+    def _new_entry_procfs(self, key, pid, comm) -> Optional[ProcessEntry]:
+        try:
+            uid = os.stat(f"/proc/{pid}").st_uid
+        except OSError:
+            return None
+        name = comm
+        if len(comm) >= 15:
+            # comm is truncated to 15 chars; recover the full name from cmdline like psutil does
+            try:
+                with open(f"/proc/{pid}/cmdline", "rb") as f:
+                    argv0 = f.read().split(b"\0", 1)[0].decode("utf-8", "replace")
+                base = os.path.basename(argv0)
+                if base.startswith(comm):
+                    name = base
+            except OSError:
+                pass
+        create_time = datetime.fromtimestamp(self._boot_time + key[1] / self._clock_ticks).isoformat()
+        return ProcessEntry(key, pid, name, self._username(uid), create_time, comm)
+
+    def _scan_procfs(self, total_memory: int):
+        for key, pid, fields, comm in self._read_procfs():
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = self._new_entry_procfs(key, pid, comm)
+                if entry is None:
+                    continue
+            elif entry.comm != comm:
+                # exec() keeps the pid and start time but replaces the program
+                fresh = self._new_entry_procfs(key, pid, comm)
+                if fresh is not None:
+                    fresh.cpu_time, fresh.row = entry.cpu_time, entry.row
+                    entry = fresh
+            cpu_time = (int(fields[11]) + int(fields[12])) / self._clock_ticks
+            rss = int(fields[21]) * self._page_size
+            yield entry, {
+                "status": PROC_STATUS_NAMES.get(fields[0].decode(), fields[0].decode()),
+                "ppid": int(fields[1]),
+                "num_threads": int(fields[17]),
+                "rss": rss,
+                "memory_percent": rss / total_memory * 100 if total_memory else 0.0
+            }, cpu_time
+
+    def _scan_psutil(self, total_memory: int):
+        attrs = ['pid', 'name', 'username', 'status', 'create_time', 'ppid', 'num_threads', 'memory_info', 'cpu_times']
+        for proc in psutil.process_iter(attrs):
+            try:
+                info = proc.info
+                key = (info['pid'], info['create_time'])
+                entry = self.entries.get(key)
+                if entry is None:
+                    create_time = datetime.fromtimestamp(info['create_time']).isoformat() if info['create_time'] else None
+                    entry = ProcessEntry(key, info['pid'], info['name'], info['username'], create_time)
+                else:
+                    # Already fetched this tick; picks up exec() renames
+                    entry.name, entry.username = info['name'], info['username']
+                rss = info['memory_info'].rss if info['memory_info'] else 0
+                cpu_times = info['cpu_times']
+                cpu_time = cpu_times.user + cpu_times.system if cpu_times else 0.0
+                yield entry, {
+                    "status": info['status'],
+                    "ppid": info['ppid'],
+                    "num_threads": info['num_threads'],
+                    "rss": rss,
+                    "memory_percent": rss / total_memory * 100 if total_memory else 0.0
+                }, cpu_time
+            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+                pass
+
+    def refresh(self) -> ProcessSnapshot:
+        """Rescan, diff against the previous tick and publish a new snapshot"""
+        with self._refresh_lock:
+            now = time.monotonic()
+            elapsed = now - self._last_refresh if self._last_refresh else None
+            total_memory = psutil.virtual_memory().total
+            scan = self._scan_procfs if self._use_procfs else self._scan_psutil
+            
+            entries: Dict[tuple, ProcessEntry] = {}
+            rows, keys, new, changed = [], [], [], []
+            for entry, fields, cpu_time in scan(total_memory):
+                previous_cpu_time = entry.cpu_time
+                # Same semantics as Process.cpu_percent(interval=None): 0.0 on first sight
+                cpu_percent = 0.0
+                if previous_cpu_time is not None and elapsed:
+                    cpu_percent = round(max(0.0, cpu_time - previous_cpu_time) / elapsed * 100, 1)
+                entry.cpu_time = cpu_time
+                fields["cpu_percent"] = cpu_percent
                 
-                elif message["type"] == "ping":
-                    # Respond to ping for connection health check
-                    pong_msg = {
-                        "type": "pong",
-                        "timestamp": datetime.now().isoformat()
-                    }
-                    await websocket.send_text(json.dumps(pong_msg))
-                        
-            except asyncio.TimeoutError:
-                # Send a heartbeat to keep the connection alive
-                try:
-                    heartbeat_msg = {
-                        "type": "heartbeat",
-                        "timestamp": datetime.now().isoformat()
-                    }
-                    await websocket.send_text(json.dumps(heartbeat_msg))
-                    logger.debug(f"Sent heartbeat to session {session_id}")
-                except Exception as e:
-                    logger.error(f"Failed to send heartbeat to session {session_id}: {e}")
-                    break
-            except json.JSONDecodeError:
-                error_msg = {
-                    "type": "error",
-                    "message": "Invalid JSON message received"
-                }
-                await websocket.send_text(json.dumps(error_msg))
-                logger.warning(f"Invalid JSON received in session {session_id}")
-            except WebSocketDisconnect:
-                logger.info(f"WebSocket disconnected for session {session_id}")
-                break
-            except Exception as e:
-                logger.error(f"WebSocket receive error in session {session_id}: {e}")
-                # Don't break immediately, try to continue the connection
-                try:
-                    error_msg = {
-                        "type": "error",
-                        "message": f"Connection error: {str(e)}"
+                row = entry.row
+                renamed = row is not None and (row["name"] != entry.name or row["username"] != entry.username)
+                if row is None or renamed or any(row[field] != value for field, value in fields.items()):
+                    # Rows are shared with earlier snapshots, so build a new one instead of mutating
+                    row = {
+                        "pid": entry.pid,
+                        "name": entry.name,
+                        "username": entry.username,
+                        "create_time": entry.create_time,
+                        **fields
                     }
-                    await websocket.send_text(json.dumps(error_msg))
-                except:
-                    # If we can't send error message, then break
-                    logger.error(f"Cannot send error message to session {session_id}, breaking connection")
-                    break
-    
-    except WebSocketDisconnect:
-        logger.info(f"Terminal WebSocket disconnected for session {session_id}")
-    except Exception as e:
-        logger.error(f"Terminal WebSocket error for session {session_id}: {e}")
-    finally:
-        # Mark session as disconnected
-        if session_id in manager.terminal_sessions:
-            manager.terminal_sessions[session_id]["connected"] = False
+                    if entry.row is None:
+                        new.append(row)
+                        bisect.insort(self._name_index, ((entry.name or "").lower(), entry.pid, entry.key))
+                    else:
+                        changed.append(row)
+                        if entry.row["name"] != entry.name:
+                            self._remove_from_name_index(entry.row["name"], entry.pid, entry.key)
+                            bisect.insort(self._name_index, ((entry.name or "").lower(), entry.pid, entry.key))
+                    entry.row = row
+                entries[entry.key] = entry
+                rows.append(row)
+                keys.append(entry.key)
             
-        manager.disconnect(websocket)
-        # Clean up process if still running
-        if session_id in manager.terminal_sessions:
-            process = manager.terminal_sessions[session_id]["process"]
-            if process and process.returncode is None:
-                try:
-                    process.terminate()
-                    logger.info(f"Terminated process for session {session_id}")
-                except:
-                    pass
-            # Clean up session
-            del manager.terminal_sessions[session_id]
-            logger.info(f"Cleaned up terminal session: {session_id}")
+            exited = []
+            for key, entry in self.entries.items():
+                if key not in entries:
+                    exited.append(entry.row)
+                    self._remove_from_name_index(entry.row["name"] if entry.row else entry.name, entry.pid, key)
+            self.entries = entries
+            self._last_refresh = now
+            self.generation += 1
+            name_order = [item[2] for item in self._name_index]
+            self.snapshot = ProcessSnapshot(self.generation, rows, keys, name_order, new, exited, changed)
+            return self.snapshot
 
-@app.post("/api/system/command", response_model=CommandResponse)
-async def execute_command(command_request: CommandRequest, token: str = Depends(verify_token)):
+process_table = ProcessTable()
+process_table_lock = asyncio.Lock()
+
+async def get_process_snapshot() -> ProcessSnapshot:
+    """Current process snapshot, refreshing it if it is older than one tick"""
+    snapshot = process_table.snapshot
+    if snapshot and time.monotonic() - snapshot.taken_at < PROCESS_TABLE_INTERVAL:
+        return snapshot
+    async with process_table_lock:
+        # Another request may have refreshed while we waited
+        snapshot = process_table.snapshot
+        if snapshot and time.monotonic() - snapshot.taken_at < PROCESS_TABLE_INTERVAL:
+            return snapshot
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(metrics_executor, process_table.refresh)
+
+# Processes endpoint with pagination, served from the shared process table
+@app.get("/api/system/processes")
+async def get_processes(
+    page: int = 1, 
+    limit: int = 50, 
+    sort_by: str = "cpu_percent", 
+    sort_order: str = "desc",
+    name: str = "",
+    user: str = "",
+    status: str = "",
+    min_cpu: Optional[float] = None,
+    min_memory: Optional[float] = None,
+    filter: str = "",
+    token: str = Depends(verify_token)
+):
     try:
-        logger.info(f"HTTP command execution: {command_request.command}")
-        
-        # Simple security check for HTTP endpoint
-        dangerous_commands = ['rm -rf', 'shutdown', 'reboot', 'halt', 'poweroff', 'format', 'mkfs', 'dd if=/dev/zero']
-        command_lower = command_request.command.lower()
-        if any(cmd in command_lower for cmd in dangerous_commands):
-            logger.warning(f"Dangerous HTTP command rejected: {command_request.command}")
-            raise HTTPException(status_code=403, detail="Potentially dangerous command rejected")
+        page = max(1, page)
+        limit = max(1, limit)
+        # Convenience parameters are shorthands for filter clauses
+        clauses = parse_process_filter(filter)
+        if name:
+            clauses.append(("name", "~", name.lower()))
+        if user:
+            clauses.append(("username", "=", user.lower()))
+        if min_cpu is not None:
+            clauses.append(("cpu_percent", ">=", min_cpu))
+        if min_memory is not None:
+            clauses.append(("memory_percent", ">=", min_memory))
+        
+        if status:
+            clauses.append(("status", "in", {s.strip().lower() for s in status.split(",") if s.strip()}))
+        
+        snapshot = await get_process_snapshot()
         
-        # Execute the command asynchronously
-        loop = asyncio.get_event_loop()
-        process = await loop.run_in_executor(
-            executor,
-            lambda: subprocess.run(
-                command_request.command,
-                shell=True,
-                capture_output=True,
-                text=True,
-                timeout=30  # 30 second timeout
-            )
+        # Pagination
+        start_idx = (page - 1) * limit
+        total, paginated_processes = snapshot.select(
+            clauses, sort_by, sort_order == "desc", start_idx, limit
         )
         
-        logger.info(f"HTTP command completed with exit code: {process.returncode}")
         return {
-            "output": process.stdout,
-            "error": process.stderr,
-            "exit_code": process.returncode
+            "timestamp": snapshot.timestamp,
+            "processes": paginated_processes,
+            "pagination": {
+                "page": page,
+                "limit": limit,
+                "total": total,
+                "pages": (total + limit - 1) // limit
+            }
         }
-    except subprocess.TimeoutExpired:
-        logger.error(f"HTTP command timed out: {command_request.command}")
-        raise HTTPException(status_code=408, detail="Command execution timed out")
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"HTTP command execution failed: {e}")
+        logger.error(f"Error fetching processes: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-# Optimized file operations with async support
-@app.get("/api/files/list")
-async def list_directory(path: str = ".", token: str = Depends(verify_token)):
+@app.get("/api/system/processes/tree")
+async def get_process_tree(
+    pid: Optional[int] = None,
+    depth: int = 1,
+    expand: str = "",
+    group_threshold: int = 10,
+    max_children: int = 200,
+    sort_by: str = "cpu_percent",
+    token: str = Depends(verify_token)
+):
+    """Process tree with per-subtree CPU and memory totals.
+
+    Only `depth` levels below `pid` (or below the top-level processes) are
+    returned; nodes carry `child_count` so clients expand them lazily with a
+    follow-up request or by listing pids in `expand`.
+    """
     try:
-        # Handle root path and system drives
-        if path == "." or path == "/" or path == "\\" or path == "System Drives":
-            # List system drives on Windows
-            if platform.system() == "Windows":
-                import string
-                drives = []
-                for letter in string.ascii_uppercase:
-                    drive = f"{letter}:\\"
-                    if os.path.exists(drive):
-                        try:
-                            # Use psutil.disk_usage for cross-platform disk space info
-                            disk_usage = psutil.disk_usage(drive)
-                            drives.append({
-                                "name": f"{letter}:",
-                                "path": drive,
-                                "is_directory": True,
-                                "size": None,
-                                "modified": datetime.now().isoformat(),
-                                "is_drive": True,
-                                "free_space": disk_usage.free,
-                                "total_space": disk_usage.total
-                            })
-                        except (PermissionError, OSError):
-                            continue
-                return {
-                    "path": "System Drives",
-                    "items": drives,
-                    "is_root": True
-                }
-            else:
-                # On Unix systems, start from root
-                path = "/"
-        
-        # Convert to absolute path if relative
-        abs_path = os.path.abspath(path)
-        
-        # Security check - prevent access to system critical directories
-        sensitive_paths = [
-            "/System", "/Library", "/usr", "/bin", "/sbin", "/etc", "/var", "/tmp",
-            "C:\\Windows", "C:\\System32", "C:\\Program Files", "C:\\Program Files (x86)"
-        ]
-        
-        for sensitive in sensitive_paths:
-            if abs_path.startswith(sensitive):
-                logger.warning(f"Access attempt to sensitive path: {abs_path}")
-                raise HTTPException(status_code=403, detail="Access to system directories is restricted for security")
-        
-        if not os.path.exists(abs_path):
-            raise HTTPException(status_code=404, detail=f"Path not found: {path}")
-        
-        if not os.path.isdir(abs_path):
-            raise HTTPException(status_code=400, detail=f"Not a directory: {path}")
-        
-        # Cache key for directory listing
-        cache_key = f"dir_list_{hashlib.md5(abs_path.encode()).hexdigest()}"
-        cached = await get_cached_data(cache_key, 10)  # 10 second cache for directory listings
-        if cached:
-            return cached
-        
-        # Use scandir instead of listdir for better performance
-        loop = asyncio.get_event_loop()
-        
-        def scan_directory():
-            items = []
-            try:
-                with os.scandir(abs_path) as entries:
-                    for entry in entries:
-                        try:
-                            is_dir = entry.is_dir()
-                            # Use entry.stat() which is more efficient than os.stat
-                            stats = entry.stat()
-                            
-                            # Get file permissions
-                            permissions = oct(stats.st_mode)[-3:] if hasattr(stats, 'st_mode') else "000"
-                            
-                            items.append({
-                                "name": entry.name,
-                                "path": os.path.join(path, entry.name),
-                                "is_directory": is_dir,
-                                "size": None if is_dir else stats.st_size,
-                                "modified": datetime.fromtimestamp(stats.st_mtime).isoformat(),
-                                "permissions": permissions,
-                                "readable": os.access(entry.path, os.R_OK),
-                                "writable": os.access(entry.path, os.W_OK),
-                                "executable": os.access(entry.path, os.X_OK),
-                                "is_hidden": entry.name.startswith('.') or (platform.system() == "Windows" and bool(stats.st_file_attributes & 2) if hasattr(stats, 'st_file_attributes') else False)
-                            })
-                        except (PermissionError, FileNotFoundError, OSError) as e:
-                            # Log but continue with other files
-                            logger.debug(f"Cannot access {entry.path}: {e}")
-                            continue
-            except PermissionError as e:
-                logger.error(f"Permission denied accessing directory {abs_path}: {e}")
-                raise HTTPException(status_code=403, detail="Permission denied accessing directory")
-            
-            return items
-        
-        items = await loop.run_in_executor(executor, scan_directory)
-        
-        # Sort items: directories first, then files, both alphabetically
-        items.sort(key=lambda x: (not x["is_directory"], x["name"].lower()))
+        snapshot = await get_process_snapshot()
+        tree = snapshot.tree()
+        expand_pids = {int(p) for p in expand.split(",") if p.strip().isdigit()}
+        depth = max(0, min(depth, 64))
+        max_children = max(1, max_children)
+        
+        if pid is None:
+            level = tree.build_nodes(tree.roots, depth - 1, expand_pids, group_threshold, max_children, sort_by)
+            root = None
+        else:
+            index = tree.index_of.get(pid)
+            if index is None:
+                raise HTTPException(status_code=404, detail=f"Process not found: {pid}")
+            root = tree.build_node(index, depth, expand_pids, group_threshold, max_children, sort_by)
+            level = None
         
-        result = {
-            "path": path,
-            "items": items,
-            "parent_path": os.path.dirname(path) if path not in [".", "/", "\\"] else None
+        return {
+            "timestamp": snapshot.timestamp,
+            "generation": snapshot.generation,
+            "root": root,
+            "nodes": level["nodes"] if level else None,
+            "truncated": level["truncated"] if level else False,
+            "total_processes": len(snapshot.rows)
         }
-        
-        await set_cached_data(cache_key, result)
-        return result
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error listing directory {path}: {e}")
+        logger.error(f"Error building process tree: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/files/content")
-async def get_file_content(path: str, token: str = Depends(verify_token)):
+@app.get("/api/system/processes/changes")
+async def get_process_changes(token: str = Depends(verify_token)):
+    """Processes that started, exited or changed during the last tick"""
     try:
-        abs_path = os.path.abspath(path)
-        if not os.path.exists(abs_path):
-            raise HTTPException(status_code=404, detail=f"File not found: {path}")
-        
-        if os.path.isdir(abs_path):
-            raise HTTPException(status_code=400, detail=f"Path is a directory: {path}")
-        
-        # Check file size to prevent loading huge files
-        file_size = os.path.getsize(abs_path)
-        if file_size > 10 * 1024 * 1024:  # 10MB limit
-            raise HTTPException(status_code=413, detail="File too large to display")
-        
-        # Check if it's likely a binary file based on extension and MIME type
-        mime_type = get_file_mime_type(abs_path)
-        file_extension = os.path.splitext(abs_path)[1].lower()
-        
-        # List of known binary file extensions
-        binary_extensions = {
-            '.exe', '.dll', '.so', '.dylib', '.bin', '.dat', '.db', '.sqlite', 
-            '.sqlite3', '.zip', '.rar', '.7z', '.tar', '.gz', '.bz2', '.xz',
-            '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.ico', '.svg',
-            '.mp3', '.mp4', '.avi', '.mov', '.wmv', '.flv', '.mkv', '.wav',
-            '.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx',
-            '.msi', '.pkg', '.deb', '.rpm', '.app', '.dmg'
+        snapshot = await get_process_snapshot()
+        return {
+            "timestamp": snapshot.timestamp,
+            "generation": snapshot.generation,
+            "new": snapshot.new,
+            "exited": snapshot.exited,
+            "changed": snapshot.changed,
+            "total": len(snapshot.rows)
         }
-        
-        # Check if it's a known binary file
-        if file_extension in binary_extensions or not mime_type.startswith('text/'):
-            return {"content": None, "is_binary": True, "mime_type": mime_type}
-        
-        # Try to read as text, but handle binary files gracefully
-        try:
-            async with aiofiles.open(abs_path, 'r', encoding='utf-8') as f:
-                content = await f.read()
-            return {"content": content, "is_binary": False, "mime_type": mime_type}
-        except UnicodeDecodeError:
-            # It's a binary file that wasn't detected by extension/MIME type
-            return {"content": None, "is_binary": True, "mime_type": mime_type}
-        except Exception as e:
-            logger.error(f"Error reading file content for {path}: {e}")
-            raise HTTPException(status_code=500, detail=f"Error reading file content: {str(e)}")
-            
     except HTTPException:
-        # Re-raise HTTP exceptions as-is
         raise
     except Exception as e:
-        logger.error(f"Error reading file {path}: {e}")
-        raise HTTPException(status_code=500, detail=f"Error reading file: {str(e)}")
+        logger.error(f"Error fetching process changes: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/files/update")
-async def update_file_content(file_update: FileUpdateRequest, token: str = Depends(verify_token)):
+# ==================== Process History ====================
+# Every tick the top-K processes by CPU and by RSS (plus anything pinned by a
+# user) get a sample appended to a small fixed-size NumPy ring. Processes that
+# drop out of the top-K are evicted after a grace period; processes that exit
+# move to a bounded "recently exited" list so a spike that ended in an exit can
+# still be inspected.
+
+PROCESS_HISTORY_ENABLED = os.getenv("PROCESS_HISTORY_ENABLED", "true").lower() == "true"
+PROCESS_HISTORY_TOP_K = int(os.getenv("PROCESS_HISTORY_TOP_K", "20"))
+PROCESS_HISTORY_LENGTH = int(os.getenv("PROCESS_HISTORY_LENGTH", "300"))
+PROCESS_HISTORY_GRACE_TICKS = int(os.getenv("PROCESS_HISTORY_GRACE_TICKS", "30"))
+PROCESS_HISTORY_EXITED_KEEP = int(os.getenv("PROCESS_HISTORY_EXITED_KEEP", "64"))
+
+PROCESS_HISTORY_DTYPE = np.dtype([
+    ("timestamp", "<f8"),
+    ("cpu_percent", "<f4"),
+    ("rss", "<i8"),
+    ("read_bytes", "<i8"),
+    ("write_bytes", "<i8"),
+    ("num_threads", "<i4"),
+])
+
+def read_process_io(pid: int) -> Optional[tuple]:
+    """(read_bytes, write_bytes) for a process, or None if not permitted"""
     try:
-        abs_path = os.path.abspath(file_update.path)
-        
-        # Security check - prevent updates to system directories
-        sensitive_paths = [
-            "/System", "/Library", "/usr", "/bin", "/sbin", "/etc", "/var", "/tmp",
-            "C:\\Windows", "C:\\System32", "C:\\Program Files", "C:\\Program Files (x86)"
-        ]
-        
-        for sensitive in sensitive_paths:
-            if abs_path.startswith(sensitive):
-                logger.warning(f"Update attempt to sensitive path: {abs_path}")
-                raise HTTPException(status_code=403, detail="Updates to system directories are restricted for security")
-        
-        # Create parent directories if they don't exist
-        parent_dir = os.path.dirname(abs_path)
-        if parent_dir and not os.path.exists(parent_dir):
+        if platform.system() == "Linux":
+            read_bytes = write_bytes = 0
+            with open(f"/proc/{pid}/io", "rb") as f:
+                for line in f:
+                    if line.startswith(b"read_bytes:"):
+                        read_bytes = int(line.split()[1])
+                    elif line.startswith(b"write_bytes:"):
+                        write_bytes = int(line.split()[1])
+            return read_bytes, write_bytes
+        counters = psutil.Process(pid).io_counters()
+        return counters.read_bytes, counters.write_bytes
+    except (OSError, AttributeError, psutil.Error):
+        return None
+
+class ProcessHistoryRing:
+    __slots__ = ("samples", "written")
+
+    def __init__(self, capacity: int):
+        self.samples = np.zeros(capacity, dtype=PROCESS_HISTORY_DTYPE)
+        self.written = 0
+
+    def append(self, row: tuple):
+        self.samples[self.written % len(self.samples)] = row
+        self.written += 1
+
+    def ordered(self) -> np.ndarray:
+        capacity = len(self.samples)
+        if self.written <= capacity:
+            return self.samples[:self.written].copy()
+        start = self.written % capacity
+        return np.concatenate((self.samples[start:], self.samples[:start]))
+
+class TrackedProcess:
+    __slots__ = ("key", "pid", "name", "username", "ring", "first_seen", "last_ranked_tick", "exited_at")
+
+    def __init__(self, key: tuple, row: dict, tick: int):
+        self.key = key
+        self.pid = row["pid"]
+        self.name = row["name"]
+        self.username = row["username"]
+        self.ring = ProcessHistoryRing(PROCESS_HISTORY_LENGTH)
+        self.first_seen = time.time()
+        self.last_ranked_tick = tick
+        self.exited_at = None
+
+    def to_dict(self, pinned: bool, include_samples: bool = False) -> dict:
+        result = {
+            "pid": self.pid,
+            "name": self.name,
+            "username": self.username,
+            "tracked_since": datetime.fromtimestamp(self.first_seen).isoformat(),
+            "exited_at": datetime.fromtimestamp(self.exited_at).isoformat() if self.exited_at else None,
+            "pinned": pinned,
+            "sample_count": min(self.ring.written, len(self.ring.samples))
+        }
+        if include_samples:
+            samples = self.ring.ordered()
+            result["samples"] = {field: samples[field].tolist() for field in PROCESS_HISTORY_DTYPE.names}
+            # cpu_percent is stored as float32; round away the conversion noise
+            result["samples"]["cpu_percent"] = np.round(samples["cpu_percent"].astype(np.float64), 1).tolist()
+        return result
+
+class ProcessHistoryTracker:
+    def __init__(self):
+        self.active: Dict[tuple, TrackedProcess] = {}
+        self.exited: "OrderedDict[tuple, TrackedProcess]" = OrderedDict()
+        self.pinned: set = set()
+        self.tick = 0
+        self.lock = threading.Lock()
+
+    def record(self, snapshot: ProcessSnapshot):
+        """Append one sample for every ranked or pinned process in the snapshot"""
+        with self.lock:
+            self.tick += 1
+            now = time.time()
+            ranked = set(snapshot.top_indices("cpu_percent", PROCESS_HISTORY_TOP_K).tolist())
+            ranked.update(snapshot.top_indices("rss", PROCESS_HISTORY_TOP_K).tolist())
+            position = {key: index for index, key in enumerate(snapshot.keys)}
+            
+            for index in ranked:
+                key = snapshot.keys[index]
+                tracked = self.active.get(key)
+                if tracked is None:
+                    tracked = self.active[key] = TrackedProcess(key, snapshot.rows[index], self.tick)
+                tracked.last_ranked_tick = self.tick
+            
+            for key, tracked in list(self.active.items()):
+                index = position.get(key)
+                if index is None:
+                    # Exited: keep its history in the bounded recently-exited list
+                    del self.active[key]
+                    self.pinned.discard(key)
+                    tracked.exited_at = now
+                    self.exited[key] = tracked
+                    while len(self.exited) > PROCESS_HISTORY_EXITED_KEEP:
+                        self.exited.popitem(last=False)
+                    continue
+                if key not in self.pinned and self.tick - tracked.last_ranked_tick > PROCESS_HISTORY_GRACE_TICKS:
+                    del self.active[key]
+                    continue
+                row = snapshot.rows[index]
+                io = read_process_io(row["pid"]) or (-1, -1)
+                tracked.ring.append((now, row["cpu_percent"], row["rss"], io[0], io[1], row["num_threads"]))
+
+    def pin(self, snapshot: ProcessSnapshot, pid: int) -> Optional[TrackedProcess]:
+        with self.lock:
+            for index, key in enumerate(snapshot.keys):
+                if key[0] == pid:
+                    tracked = self.active.get(key)
+                    if tracked is None:
+                        tracked = self.active[key] = TrackedProcess(key, snapshot.rows[index], self.tick)
+                    self.pinned.add(key)
+                    return tracked
+        return None
+
+    def unpin(self, pid: int) -> bool:
+        with self.lock:
+            keys = [key for key in self.pinned if key[0] == pid]
+            for key in keys:
+                self.pinned.discard(key)
+                if key in self.active:
+                    # Give it the usual grace period before eviction
+                    self.active[key].last_ranked_tick = self.tick
+            return bool(keys)
+
+    def find(self, pid: int) -> Optional[TrackedProcess]:
+        """The live process with this pid, else the most recently exited one"""
+        with self.lock:
+            for key, tracked in self.active.items():
+                if key[0] == pid:
+                    return tracked
+            for key in reversed(self.exited):
+                if key[0] == pid:
+                    return self.exited[key]
+        return None
+
+    def list(self) -> dict:
+        with self.lock:
+            return {
+                "active": [t.to_dict(t.key in self.pinned) for t in self.active.values()],
+                "exited": [t.to_dict(False) for t in reversed(self.exited.values())]
+            }
+
+process_history = ProcessHistoryTracker()
+
+async def process_history_loop():
+    """Background tick: refresh the process table and record history"""
+    loop = asyncio.get_event_loop()
+    while True:
+        try:
+            snapshot = await get_process_snapshot()
+            await loop.run_in_executor(metrics_executor, process_history.record, snapshot)
+        except Exception as e:
+            logger.error(f"Process history tick failed: {e}")
+        await asyncio.sleep(PROCESS_TABLE_INTERVAL)
+
+@app.on_event("startup")
+async def start_process_history():
+    if PROCESS_HISTORY_ENABLED:
+        asyncio.create_task(process_history_loop())
+
+@app.get("/api/system/processes/history")
+async def list_process_history(token: str = Depends(verify_token)):
+    """Processes currently tracked (top-K and pinned) plus recently exited ones"""
+    return {"timestamp": datetime.now().isoformat(), **process_history.list()}
+
+@app.get("/api/system/processes/{pid}/history")
+async def get_process_history(pid: int, token: str = Depends(verify_token)):
+    """CPU, RSS, I/O and thread history of one tracked process"""
+    tracked = process_history.find(pid)
+    if tracked is None:
+        raise HTTPException(status_code=404, detail=f"No history recorded for process {pid}; pin it to start tracking")
+    return tracked.to_dict(tracked.key in process_history.pinned, include_samples=True)
+
+@app.post("/api/system/processes/{pid}/pin")
+async def pin_process(pid: int, token: str = Depends(verify_token)):
+    """Track a process's history regardless of its rank"""
+    snapshot = await get_process_snapshot()
+    tracked = process_history.pin(snapshot, pid)
+    if tracked is None:
+        raise HTTPException(status_code=404, detail=f"Process not found: {pid}")
+    return {"success": True, "pid": pid, "name": tracked.name}
+
+@app.delete("/api/system/processes/{pid}/pin")
+async def unpin_process(pid: int, token: str = Depends(verify_token)):
+    if not process_history.unpin(pid):
+        raise HTTPException(status_code=404, detail=f"Process {pid} is not pinned")
+    return {"success": True, "pid": pid}
+
+# ==================== Process Disk I/O ====================
+# iotop-style view built from /proc/<pid>/io deltas. The sampler keeps the
+# /proc/<pid>/io file descriptors open between ticks and re-reads them with
+# pread, and processes that showed no I/O are polled with exponential
+# back-off, so a tick stays cheap on hosts with tens of thousands of PIDs.
+# It only runs while someone is watching.
+
+PROCESS_IO_MAX_FDS = int(os.getenv("PROCESS_IO_MAX_FDS", "4096"))
+PROCESS_IO_MAX_BACKOFF = int(os.getenv("PROCESS_IO_MAX_BACKOFF", "16"))  # ticks between reads of idle processes
+PROCESS_IO_IDLE_TIMEOUT = float(os.getenv("PROCESS_IO_IDLE_TIMEOUT", "60"))  # stop sampling after this long unwatched
+
+class ProcessIOState:
+    __slots__ = ("fd", "counters", "read_at", "next_tick", "backoff", "rates")
+
+    def __init__(self):
+        self.fd = None
+        self.counters = None
+        self.read_at = None
+        self.next_tick = 0
+        self.backoff = 1
+        self.rates = None
+
+class ProcessIOSampler:
+    # Order of the values in /proc/<pid>/io
+    FIELDS = ("rchar", "wchar", "syscr", "syscw", "read_bytes", "write_bytes", "cancelled_write_bytes")
+
+    def __init__(self):
+        self.states: Dict[tuple, ProcessIOState] = {}
+        self.denied: set = set()
+        self.tick = 0
+        self.open_fds = 0
+        self.snapshot: Optional[ProcessSnapshot] = None
+        self.timestamp = None
+        self.lock = threading.Lock()
+        try:
+            import resource
+            soft_limit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+            # Leave most descriptors for sockets and files
+            self.max_fds = min(PROCESS_IO_MAX_FDS, max(0, soft_limit // 2))
+        except (ImportError, ValueError, OSError):
+            self.max_fds = PROCESS_IO_MAX_FDS
+
+    def _read(self, pid: int, state: ProcessIOState) -> Optional[tuple]:
+        if state.fd is None and self.open_fds < self.max_fds:
+            state.fd = os.open(f"/proc/{pid}/io", os.O_RDONLY)
+            self.open_fds += 1
+        if state.fd is not None:
+            data = os.pread(state.fd, 512, 0)
+        else:
+            with open(f"/proc/{pid}/io", "rb") as f:
+                data = f.read()
+        return tuple(int(value) for value in data.split()[1::2])
+
+    def _close(self, state: ProcessIOState):
+        if state.fd is not None:
             try:
-                os.makedirs(parent_dir, exist_ok=True)
-            except PermissionError:
-                raise HTTPException(status_code=403, detail="Permission denied creating directory")
-        
-        # Check if we have write permission
-        if os.path.exists(abs_path) and not os.access(abs_path, os.W_OK):
-            raise HTTPException(status_code=403, detail="Permission denied writing to file")
-        
-        async with aiofiles.open(abs_path, 'w', encoding='utf-8') as f:
-            await f.write(file_update.content)
-        
-        # Clear directory cache for the parent directory
-        cache_key = f"dir_list_{hashlib.md5(parent_dir.encode()).hexdigest()}"
-        async with cache_lock:
-            if cache_key in system_cache:
-                del system_cache[cache_key]
-        
-        logger.info(f"File updated: {file_update.path}")
-        return {"success": True, "message": f"File updated: {file_update.path}"}
+                os.close(state.fd)
+            except OSError:
+                pass
+            state.fd = None
+            self.open_fds -= 1
+
+    def sample(self, snapshot: ProcessSnapshot):
+        with self.lock:
+            self.tick += 1
+            now = time.monotonic()
+            live = set(snapshot.keys)
+            for key in snapshot.keys:
+                if key in self.denied:
+                    continue
+                state = self.states.get(key)
+                if state is None:
+                    state = self.states[key] = ProcessIOState()
+                if state.next_tick > self.tick:
+                    continue  # idle process, skipped this tick
+                try:
+                    counters = self._read(key[0], state)
+                except PermissionError:
+                    self._close(state)
+                    del self.states[key]
+                    self.denied.add(key)
+                    continue
+                except OSError:
+                    continue  # exited; dropped below once it leaves the table
+
+                if state.counters is not None:
+                    elapsed = now - state.read_at
+                    deltas = [max(0, current - previous) for current, previous in zip(counters, state.counters)]
+                    state.rates = {field: delta / elapsed for field, delta in zip(self.FIELDS, deltas)} if elapsed > 0 else None
+                    if deltas[0] or deltas[1] or deltas[4] or deltas[5]:
+                        state.backoff = 1
+                    else:
+                        state.backoff = min(state.backoff * 2, PROCESS_IO_MAX_BACKOFF)
+                        # Whatever it did before is over; don't keep reporting the old rate
+                        if state.rates:
+                            state.rates = None
+                state.counters = counters
+                state.read_at = now
+                state.next_tick = self.tick + state.backoff
+
+            for key in [key for key in self.states if key not in live]:
+                self._close(self.states.pop(key))
+            self.denied &= live
+            self.snapshot = snapshot
+            self.timestamp = datetime.now().isoformat()
+
+    def close_all(self):
+        with self.lock:
+            for state in self.states.values():
+                self._close(state)
+            self.states.clear()
+            self.denied.clear()
+            self.snapshot = None
+
+    def top(self, limit: int, sort_by: str) -> List[dict]:
+        with self.lock:
+            snapshot = self.snapshot
+            if snapshot is None:
+                return []
+            position = {key: index for index, key in enumerate(snapshot.keys)}
+
+            def sort_value(item):
+                # Ties on block I/O (often all zero) fall back to syscall-level bytes
+                rates = item[1].rates
+                if sort_by == "read":
+                    return (rates["read_bytes"], rates["rchar"])
+                if sort_by == "write":
+                    return (rates["write_bytes"], rates["wchar"])
+                return (rates["read_bytes"] + rates["write_bytes"], rates["rchar"] + rates["wchar"])
+
+            active = [(key, state) for key, state in self.states.items() if state.rates and key in position]
+            result = []
+            for key, state in heapq.nlargest(limit, active, key=sort_value):
+                row = snapshot.rows[position[key]]
+                counters = dict(zip(self.FIELDS, state.counters))
+                result.append({
+                    "pid": row["pid"],
+                    "name": row["name"],
+                    "username": row["username"],
+                    "read_bytes_per_sec": state.rates["read_bytes"],
+                    "write_bytes_per_sec": state.rates["write_bytes"],
+                    "rchar_per_sec": state.rates["rchar"],
+                    "wchar_per_sec": state.rates["wchar"],
+                    "read_bytes": counters["read_bytes"],
+                    "write_bytes": counters["write_bytes"],
+                    "cancelled_write_bytes": counters["cancelled_write_bytes"]
+                })
+            return result
+
+    def stats(self) -> dict:
+        return {"tracked": len(self.states), "open_fds": self.open_fds, "denied": len(self.denied)}
+
+process_io_sampler = ProcessIOSampler()
+process_io_task = None
+process_io_last_used = 0.0
+
+async def process_io_loop():
+    loop = asyncio.get_event_loop()
+    try:
+        while time.monotonic() - process_io_last_used < PROCESS_IO_IDLE_TIMEOUT:
+            try:
+                snapshot = await get_process_snapshot()
+                await loop.run_in_executor(metrics_executor, process_io_sampler.sample, snapshot)
+            except Exception as e:
+                logger.error(f"Process I/O sampling failed: {e}")
+            await asyncio.sleep(PROCESS_TABLE_INTERVAL)
+    finally:
+        # Nobody is watching any more: release the descriptors
+        process_io_sampler.close_all()
+
+def touch_process_io_sampler():
+    """Mark the sampler as in use, starting it if needed"""
+    global process_io_task, process_io_last_used
+    process_io_last_used = time.monotonic()
+    if process_io_task is None or process_io_task.done():
+        process_io_task = asyncio.create_task(process_io_loop())
+
+def process_io_payload(limit: int, sort_by: str) -> dict:
+    return {
+        "timestamp": process_io_sampler.timestamp or datetime.now().isoformat(),
+        "warming_up": process_io_sampler.tick < 2,
+        "processes": process_io_sampler.top(limit, sort_by),
+        "sampler": process_io_sampler.stats()
+    }
+
+@app.get("/api/system/processes/io")
+async def get_process_io(limit: int = 20, sort_by: str = "total", token: str = Depends(verify_token)):
+    """Processes ranked by disk I/O rate (iotop-style)"""
+    if platform.system() != "Linux":
+        raise HTTPException(status_code=501, detail="Per-process I/O rates require /proc (Linux)")
+    if sort_by not in ("total", "read", "write"):
+        raise HTTPException(status_code=400, detail="sort_by must be one of: total, read, write")
+    touch_process_io_sampler()
+    return process_io_payload(max(1, limit), sort_by)
+
+@app.websocket("/ws/processes/io")
+async def process_io_websocket(websocket: WebSocket, limit: int = 20, sort_by: str = "total"):
+    """Push the per-process I/O ranking every tick"""
+    await manager.connect(websocket)
+    try:
+        if platform.system() != "Linux":
+            await websocket.send_text(json.dumps({"type": "error", "message": "Per-process I/O rates require /proc (Linux)"}))
+            return
+        while True:
+            touch_process_io_sampler()
+            await websocket.send_text(json.dumps({"type": "process_io", **process_io_payload(max(1, limit), sort_by)}))
+            await asyncio.sleep(PROCESS_TABLE_INTERVAL)
+    except WebSocketDisconnect:
+        logger.info("Process I/O WebSocket disconnected")
     except Exception as e:
-        logger.error(f"Error updating file {file_update.path}: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        logger.error(f"Process I/O WebSocket error: {e}")
+    finally:
+        manager.disconnect(websocket)
 
-@app.get("/api/files/download")
-async def download_file(path: str, token: str = Depends(verify_token)):
+# ==================== Process Memory Accounting ====================
+# RSS counts every shared page in full for each process that maps it, so a
+# host with many forked workers looks like it uses far more memory than it
+# does. PSS (shared pages split between their users) and USS (private pages
+# only) come from /proc/<pid>/smaps_rollup, which is expensive for the
+# kernel to produce, so it is read for the top processes by RSS only, in a
+# separate process pool at a slow cadence. Requests just read the last
+# published result.
+
+PROCESS_MEMORY_ENABLED = os.getenv("PROCESS_MEMORY_ENABLED", "true").lower() == "true"
+PROCESS_MEMORY_INTERVAL = float(os.getenv("PROCESS_MEMORY_INTERVAL", "30"))
+PROCESS_MEMORY_TOP_N = int(os.getenv("PROCESS_MEMORY_TOP_N", "50"))
+PROCESS_MEMORY_WORKERS = int(os.getenv("PROCESS_MEMORY_WORKERS", "2"))
+
+SMAPS_FIELDS = {
+    b"Rss:": "rss",
+    b"Pss:": "pss",
+    b"Pss_Anon:": "pss_anon",
+    b"Pss_File:": "pss_file",
+    b"Pss_Shmem:": "pss_shmem",
+    b"Shared_Clean:": "shared_clean",
+    b"Shared_Dirty:": "shared_dirty",
+    b"Private_Clean:": "private_clean",
+    b"Private_Dirty:": "private_dirty",
+    b"Swap:": "swap",
+    b"SwapPss:": "swap_pss"
+}
+
+def read_smaps_rollup(key: tuple) -> Optional[dict]:
+    """PSS/USS/swap totals in bytes for one (pid, starttime), or None if unreadable"""
+    pid, starttime = key
+    data = None
+    # smaps_rollup needs Linux 4.14+; older kernels get the per-mapping file summed
+    for path in (f"/proc/{pid}/smaps_rollup", f"/proc/{pid}/smaps"):
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            break
+        except FileNotFoundError:
+            continue
+        except OSError:
+            return None
+    if data is None:
+        return None
+    
+    totals = dict.fromkeys(SMAPS_FIELDS.values(), 0)
+    for line in data.splitlines():
+        parts = line.split()
+        if len(parts) >= 2:
+            field = SMAPS_FIELDS.get(parts[0])
+            if field is not None:
+                totals[field] += int(parts[1]) * 1024
+    
+    # The pid may have been reused since the snapshot was taken
     try:
-        abs_path = os.path.abspath(path)
-        if not os.path.exists(abs_path):
-            raise HTTPException(status_code=404, detail=f"File not found: {path}")
-        
-        if os.path.isdir(abs_path):
-            raise HTTPException(status_code=400, detail=f"Path is a directory: {path}")
-        
-        # Security check - prevent downloads from system directories
-        sensitive_paths = [
-            "/System", "/Library", "/usr", "/bin", "/sbin", "/etc", "/var", "/tmp",
-            "C:\\Windows", "C:\\System32", "C:\\Program Files", "C:\\Program Files (x86)"
-        ]
-        
-        for sensitive in sensitive_paths:
-            if abs_path.startswith(sensitive):
-                logger.warning(f"Download attempt from sensitive path: {abs_path}")
-                raise HTTPException(status_code=403, detail="Downloads from system directories are restricted for security")
-        
-        # Get MIME type for proper content type
-        mime_type = get_file_mime_type(abs_path)
-        filename = os.path.basename(abs_path)
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            stat = f.read()
+        if int(stat[stat.rfind(b")") + 2:].split()[19]) != starttime:
+            return None
+    except (OSError, ValueError, IndexError):
+        return None
+    
+    totals["uss"] = totals["private_clean"] + totals["private_dirty"]
+    return totals
+
+def read_smaps_rollups(keys: List[tuple]) -> List[Optional[dict]]:
+    """Batch form of read_smaps_rollup, run inside the process pool"""
+    return [read_smaps_rollup(key) for key in keys]
+
+process_memory_executor = WorkloadExecutor("process_memory", workers=PROCESS_MEMORY_WORKERS, max_queue=PROCESS_MEMORY_WORKERS,
+                                           processes=True)
+process_memory_result = None
+
+async def process_memory_loop():
+    """Background job: PSS/USS for the top processes by RSS"""
+    global process_memory_result
+    loop = asyncio.get_event_loop()
+    workers = process_memory_executor.max_workers
+    while True:
+        try:
+            started = time.perf_counter()
+            snapshot = await get_process_snapshot()
+            indices = snapshot.top_indices("rss", PROCESS_MEMORY_TOP_N).tolist()
+            keys = [snapshot.keys[index] for index in indices]
+            chunk = -(-len(keys) // workers) or 1
+            batches = await asyncio.gather(*(
+                loop.run_in_executor(process_memory_executor, read_smaps_rollups, keys[start:start + chunk])
+                for start in range(0, len(keys), chunk)
+            ))
+            
+            processes = []
+            for index, totals in zip(indices, itertools.chain.from_iterable(batches)):
+                if totals is None:
+                    continue
+                row = snapshot.rows[index]
+                processes.append({"pid": row["pid"], "name": row["name"], "username": row["username"], **totals})
+            # Swapped in whole, so readers never see a partial update
+            process_memory_result = {
+                "timestamp": datetime.now().isoformat(),
+                "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+                "processes": processes
+            }
+        except Exception as e:
+            logger.error(f"Process memory accounting failed: {e}")
+        await asyncio.sleep(PROCESS_MEMORY_INTERVAL)
+
+@app.on_event("startup")
+async def start_process_memory():
+    if PROCESS_MEMORY_ENABLED and platform.system() == "Linux":
+        asyncio.create_task(process_memory_loop())
+
+@app.get("/api/system/processes/memory")
+async def get_process_memory(limit: int = 20, sort_by: str = "pss", token: str = Depends(verify_token)):
+    """PSS/USS/swap of the top processes by RSS, from the last background pass"""
+    if sort_by not in ("pss", "uss", "rss", "swap", "swap_pss"):
+        raise HTTPException(status_code=400, detail="sort_by must be one of: pss, uss, rss, swap, swap_pss")
+    result = process_memory_result
+    if result is None:
+        return {
+            "timestamp": None,
+            "pending": PROCESS_MEMORY_ENABLED and platform.system() == "Linux",
+            "interval": PROCESS_MEMORY_INTERVAL,
+            "processes": []
+        }
+    processes = heapq.nlargest(max(1, limit), result["processes"], key=operator.itemgetter(sort_by))
+    return {
+        "timestamp": result["timestamp"],
+        "pending": False,
+        "interval": PROCESS_MEMORY_INTERVAL,
+        "duration_ms": result["duration_ms"],
+        "totals": {
+            field: sum(process[field] for process in result["processes"])
+            for field in ("rss", "pss", "uss", "swap")
+        },
+        "processes": processes
+    }
+
+# ==================== Process Details ====================
+# Per-process drill-down. Attribute reads are batched under Process.oneshot()
+# and expensive fields (open files, connections, environment, ...) are only
+# collected when asked for via ?fields=. Results are cached briefly per field.
+
+PROCESS_DETAIL_CACHE_TTL = float(os.getenv("PROCESS_DETAIL_CACHE_TTL", "2"))
+PROCESS_DETAIL_DEFAULT_FIELDS = [
+    "exe", "cmdline", "cwd", "memory_info", "cpu_times", "num_threads", "nice", "terminal"
+]
+PROCESS_DETAIL_OPTIONAL_FIELDS = [
+    "open_files", "connections", "environ", "threads", "io_counters", "num_fds",
+    "memory_full_info", "children"
+]
+
+def _serialize_process_value(value):
+    if hasattr(value, "_asdict"):
+        return {key: _serialize_process_value(item) for key, item in value._asdict().items()}
+    if isinstance(value, (list, tuple)):
+        return [_serialize_process_value(item) for item in value]
+    if isinstance(value, psutil.Process):
+        return {"pid": value.pid}
+    if isinstance(value, enum.Enum):
+        return str(value)
+    return value
+
+def collect_process_details(pid: int, fields: List[str]) -> dict:
+    """Read the requested attributes of one process in a single oneshot() batch"""
+    proc = psutil.Process(pid)
+    details, unavailable = {}, {}
+    with proc.oneshot():
+        identity = proc.as_dict(["pid", "ppid", "name", "username", "status", "create_time"])
+        for field in fields:
+            if field == "connections":
+                # Renamed to net_connections in newer psutil releases
+                getter = getattr(proc, "net_connections", None) or proc.connections
+            elif field == "children":
+                getter = lambda: proc.children(recursive=False)
+            else:
+                getter = getattr(proc, field, None)
+            if getter is None:
+                unavailable[field] = "not supported on this platform"
+                continue
+            try:
+                details[field] = _serialize_process_value(getter())
+            except psutil.AccessDenied:
+                unavailable[field] = "access denied"
+            except (psutil.ZombieProcess, NotImplementedError, OSError) as e:
+                unavailable[field] = str(e) or e.__class__.__name__
+    identity["create_time"] = datetime.fromtimestamp(identity["create_time"]).isoformat() if identity["create_time"] else None
+    return {"identity": identity, "details": details, "unavailable": unavailable}
+
+@app.get("/api/system/processes/{pid}")
+async def get_process_details(pid: int, fields: str = "", token: str = Depends(verify_token)):
+    """Drill-down for one process.
+
+    `fields` is a comma-separated list of attributes to collect (default: a
+    cheap set); `fields=all` adds open files, connections, environment,
+    threads, I/O counters, fd count, USS/PSS and children.
+    """
+    try:
+        allowed = PROCESS_DETAIL_DEFAULT_FIELDS + PROCESS_DETAIL_OPTIONAL_FIELDS
+        if not fields:
+            requested = list(PROCESS_DETAIL_DEFAULT_FIELDS)
+        elif fields == "all":
+            requested = allowed
+        else:
+            requested = [field.strip() for field in fields.split(",") if field.strip()]
+            unknown = [field for field in requested if field not in allowed]
+            if unknown:
+                raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+        
+        # Live figures come from the process table; it is refreshed once per tick anyway
+        snapshot = await get_process_snapshot()
+        tree = snapshot.tree()
+        index = tree.index_of.get(pid)
+        row = snapshot.rows[index] if index is not None else None
+        create_time = row["create_time"] if row else None
+        
+        # Cache per field, keyed by create time so a recycled pid never sees stale data
+        result = {}
+        missing = []
+        for field in requested:
+            cached = await get_cached_data(f"process_detail_{pid}_{create_time}_{field}", PROCESS_DETAIL_CACHE_TTL)
+            if cached is not None:
+                result[field] = cached
+            else:
+                missing.append(field)
+        
+        unavailable = {}
+        identity = None
+        if missing or row is None:
+            loop = asyncio.get_event_loop()
+            # Keys embed pid and create time, so entries for exited processes would otherwise linger forever
+            await prune_cached_data("process_detail_", PROCESS_DETAIL_CACHE_TTL)
+            collected = await loop.run_in_executor(metrics_executor, collect_process_details, pid, missing)
+            identity = collected["identity"]
+            unavailable = collected["unavailable"]
+            for field, value in collected["details"].items():
+                result[field] = value
+                await set_cached_data(f"process_detail_{pid}_{create_time}_{field}", value)
         
-        logger.info(f"File download requested: {path}")
-        return FileResponse(
-            abs_path, 
-            filename=filename,
-            media_type=mime_type
-        )
+        return {
+            "timestamp": datetime.now().isoformat(),
+            "pid": pid,
+            "process": row or identity,
+            "details": result,
+            "unavailable": unavailable
+        }
+    except psutil.NoSuchProcess:
+        raise HTTPException(status_code=404, detail=f"Process not found: {pid}")
+    except psutil.AccessDenied:
+        raise HTTPException(status_code=403, detail=f"Access denied to process {pid}")
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error downloading file {path}: {e}")
+        logger.error(f"Error fetching details for process {pid}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/files/upload")
-async def upload_file(path: str, file: UploadFile = File(...), token: str = Depends(verify_token)):
+# ==================== cgroup Resources ====================
+# Per systemd unit / container usage straight from cgroup v2 accounting files.
+# cgroup v2 counters are hierarchical (a slice includes its children), so one
+# read per group replaces summing thousands of per-process reads.
+
+CGROUP_ROOT = os.getenv("CGROUP_ROOT", "")
+CGROUP_INTERVAL = float(os.getenv("CGROUP_INTERVAL", "2.0"))
+CGROUP_MAX_DEPTH = int(os.getenv("CGROUP_MAX_DEPTH", "8"))
+CGROUP_MAX_GROUPS = int(os.getenv("CGROUP_MAX_GROUPS", "5000"))
+CGROUP_WARMUP = float(os.getenv("CGROUP_WARMUP", "0.5"))  # gap between the two samples taken on a cold cache
+CGROUP_IDLE_TIMEOUT = float(os.getenv("CGROUP_IDLE_TIMEOUT", "60"))  # stop sampling after this long unwatched
+CONTAINER_ID_PATTERN = re.compile(r"(?:^|[-/])([0-9a-f]{64})(?:\.scope)?$")
+
+def find_cgroup2_root() -> Optional[str]:
+    """Unified hierarchy mount point (plain v2 or the hybrid 'unified' mount)"""
+    candidates = [CGROUP_ROOT] if CGROUP_ROOT else ["/sys/fs/cgroup", "/sys/fs/cgroup/unified"]
+    for candidate in candidates:
+        if os.path.exists(os.path.join(candidate, "cgroup.controllers")):
+            return candidate
+    return None
+
+def _read_cgroup_int(path: str) -> Optional[int]:
     try:
-        abs_path = os.path.abspath(path)
-        
-        # Security check - prevent uploads to system directories
-        sensitive_paths = [
-            "/System", "/Library", "/usr", "/bin", "/sbin", "/etc", "/var", "/tmp",
-            "C:\\Windows", "C:\\System32", "C:\\Program Files", "C:\\Program Files (x86)"
-        ]
-        
-        for sensitive in sensitive_paths:
-            if abs_path.startswith(sensitive):
-                logger.warning(f"Upload attempt to sensitive path: {abs_path}")
-                raise HTTPException(status_code=403, detail="Upload to system directories is restricted for security")
-        
-        # Create parent directories if they don't exist
-        parent_dir = os.path.dirname(abs_path)
-        if parent_dir and not os.path.exists(parent_dir):
+        with open(path, "rb") as f:
+            value = f.read().strip()
+    except OSError:
+        return None
+    if value == b"max":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+def _read_cgroup_keyed(path: str) -> Optional[Dict[str, int]]:
+    """Flat 'key value' files such as cpu.stat"""
+    try:
+        with open(path, "rb") as f:
+            return {key.decode(): int(value) for key, value in (line.split() for line in f if line.strip())}
+    except (OSError, ValueError):
+        return None
+
+def _read_cgroup_io(path: str) -> Optional[tuple]:
+    """Sum rbytes/wbytes over all devices in io.stat"""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    read_bytes = write_bytes = 0
+    for token in data.split():
+        if token.startswith(b"rbytes="):
+            read_bytes += int(token[7:])
+        elif token.startswith(b"wbytes="):
+            write_bytes += int(token[7:])
+    return read_bytes, write_bytes
+
+def classify_cgroup(relative_path: str) -> dict:
+    name = os.path.basename(relative_path) or "/"
+    match = CONTAINER_ID_PATTERN.search(relative_path)
+    if match:
+        return {"kind": "container", "container_id": match.group(1)[:12]}
+    for suffix in (".service", ".scope", ".slice", ".socket", ".mount"):
+        if name.endswith(suffix):
+            return {"kind": suffix[1:], "unit": name}
+    return {"kind": "cgroup"}
+
+class CgroupCollector:
+    def __init__(self):
+        self.root = find_cgroup2_root()
+        self.previous: Dict[str, tuple] = {}
+        self.groups: Dict[str, dict] = {}
+        self.taken_at = 0.0
+        self.timestamp = None
+        self.truncated = False
+        self.lock = threading.Lock()
+
+    def _walk(self):
+        """Yield (relative path, absolute path, inode) for every group up to the depth/size limits"""
+        stack = [("/", self.root, 0)]
+        count = 0
+        while stack:
+            relative, absolute, depth = stack.pop()
             try:
-                os.makedirs(parent_dir, exist_ok=True)
-            except PermissionError:
-                raise HTTPException(status_code=403, detail="Permission denied creating directory")
-        
-        # Check if we have write permission
-        if os.path.exists(abs_path) and not os.access(abs_path, os.W_OK):
-            raise HTTPException(status_code=403, detail="Permission denied writing to file")
-        
-        # Use aiofiles for async file writing
-        async with aiofiles.open(abs_path, "wb") as buffer:
-            content = await file.read()
-            await buffer.write(content)
-        
-        # Clear directory cache for the parent directory
-        cache_key = f"dir_list_{hashlib.md5(parent_dir.encode()).hexdigest()}"
-        async with cache_lock:
-            if cache_key in system_cache:
-                del system_cache[cache_key]
-        
-        logger.info(f"File uploaded: {path}")
-        return {"success": True, "message": f"File uploaded to: {path}"}
-    except Exception as e:
-        logger.error(f"Error uploading file to {path}: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-
-@app.post("/api/files/create-directory")
-async def create_directory(request: CreateDirectoryRequest, token: str = Depends(verify_token)):
-    """Create a new directory"""
-    try:
-        abs_path = os.path.abspath(request.path)
-        
-        # Security check - prevent creation in system directories
-        sensitive_paths = [
-            "/System", "/Library", "/usr", "/bin", "/sbin", "/etc", "/var", "/tmp",
-            "C:\\Windows", "C:\\System32", "C:\\Program Files", "C:\\Program Files (x86)"
-        ]
-        
-        for sensitive in sensitive_paths:
-            if abs_path.startswith(sensitive):
-                logger.warning(f"Directory creation attempt in sensitive path: {abs_path}")
-                raise HTTPException(status_code=403, detail="Creation in system directories is restricted for security")
-        
-        # Create parent directories if they don't exist
-        parent_dir = os.path.dirname(abs_path)
-        if parent_dir and not os.path.exists(parent_dir):
+                inode = os.stat(absolute).st_ino
+            except OSError:
+                continue
+            yield relative, absolute, inode
+            count += 1
+            if count >= CGROUP_MAX_GROUPS:
+                self.truncated = True
+                return
+            if depth >= CGROUP_MAX_DEPTH:
+                continue
             try:
-                os.makedirs(parent_dir, exist_ok=True)
-            except PermissionError:
-                raise HTTPException(status_code=403, detail="Permission denied creating parent directory")
-        
-        # Create the directory
+                with os.scandir(absolute) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append((os.path.join(relative, entry.name), entry.path, depth + 1))
+            except OSError:
+                continue
+
+    def refresh(self):
+        with self.lock:
+            now = time.monotonic()
+            self.truncated = False
+            groups, previous = {}, {}
+            for relative, absolute, inode in self._walk():
+                cpu_stat = _read_cgroup_keyed(os.path.join(absolute, "cpu.stat"))
+                io = _read_cgroup_io(os.path.join(absolute, "io.stat"))
+                usage_usec = cpu_stat.get("usage_usec") if cpu_stat else None
+                group = {
+                    "path": relative,
+                    "name": os.path.basename(relative) or "/",
+                    **classify_cgroup(relative),
+                    "cpu_usage_usec": usage_usec,
+                    "cpu_throttled_usec": cpu_stat.get("throttled_usec") if cpu_stat else None,
+                    "cpu_percent": None,
+                    "memory_current": _read_cgroup_int(os.path.join(absolute, "memory.current")),
+                    "memory_max": _read_cgroup_int(os.path.join(absolute, "memory.max")),
+                    "pids_current": _read_cgroup_int(os.path.join(absolute, "pids.current")),
+                    "io_read_bytes": io[0] if io else None,
+                    "io_write_bytes": io[1] if io else None,
+                    "io_read_bytes_per_sec": None,
+                    "io_write_bytes_per_sec": None
+                }
+                last = self.previous.get(relative)
+                # A recreated group (same path, new inode) starts its counters again
+                if last and last[1] == inode:
+                    elapsed = now - last[0]
+                    if elapsed > 0:
+                        if usage_usec is not None and last[2] is not None:
+                            group["cpu_percent"] = round(max(0, usage_usec - last[2]) / (elapsed * 1e6) * 100, 2)
+                        if io and last[3] is not None:
+                            group["io_read_bytes_per_sec"] = max(0, io[0] - last[3]) / elapsed
+                            group["io_write_bytes_per_sec"] = max(0, io[1] - last[4]) / elapsed
+                previous[relative] = (now, inode, usage_usec,
+                                      io[0] if io else None, io[1] if io else None)
+                groups[relative] = group
+            self.previous = previous
+            self.groups = groups
+            self.taken_at = now
+            self.timestamp = datetime.now().isoformat()
+
+    def build_node(self, path: str, depth: int, sort_by: str, limit: int, children_index: Dict[str, List[str]]) -> dict:
+        node = dict(self.groups[path])
+        children = children_index.get(path, [])
+        node["child_count"] = len(children)
+        node["children"] = None
+        if depth > 0 and children:
+            ordered = sorted(children, key=lambda child: self.groups[child].get(sort_by) or 0, reverse=True)
+            node["children"] = [self.build_node(child, depth - 1, sort_by, limit, children_index)
+                                for child in ordered[:limit]]
+        return node
+
+cgroup_collector = CgroupCollector()
+cgroup_lock = asyncio.Lock()
+cgroup_task = None
+cgroup_last_used = 0.0
+
+async def cgroup_loop():
+    """Keep sampling every interval while someone is asking, so rates always span one tick"""
+    loop = asyncio.get_event_loop()
+    while time.monotonic() - cgroup_last_used < CGROUP_IDLE_TIMEOUT:
         try:
-            os.makedirs(abs_path, exist_ok=True)
-        except PermissionError:
-            raise HTTPException(status_code=403, detail="Permission denied creating directory")
-        
-        # Clear directory cache for the parent directory
-        cache_key = f"dir_list_{hashlib.md5(parent_dir.encode()).hexdigest()}"
-        async with cache_lock:
-            if cache_key in system_cache:
-                del system_cache[cache_key]
+            async with cgroup_lock:
+                await loop.run_in_executor(metrics_executor, cgroup_collector.refresh)
+        except Exception as e:
+            logger.error(f"cgroup sampling failed: {e}")
+        await asyncio.sleep(CGROUP_INTERVAL)
+
+def touch_cgroup_sampler():
+    """Mark the sampler as in use, starting it if needed"""
+    global cgroup_task, cgroup_last_used
+    cgroup_last_used = time.monotonic()
+    if cgroup_task is None or cgroup_task.done():
+        cgroup_task = asyncio.create_task(cgroup_loop())
+
+@app.get("/api/system/cgroups")
+async def get_cgroups(
+    path: str = "/",
+    depth: int = 2,
+    sort_by: str = "cpu_percent",
+    limit: int = 50,
+    token: str = Depends(verify_token)
+):
+    """Hierarchical cgroup v2 usage (systemd units, containers) with rates between ticks.
+
+    The first request takes two samples CGROUP_WARMUP apart; after that a
+    background sampler refreshes every CGROUP_INTERVAL until the endpoint has
+    been unused for CGROUP_IDLE_TIMEOUT.
+    """
+    try:
+        if cgroup_collector.root is None:
+            raise HTTPException(status_code=503, detail="cgroup v2 unified hierarchy not available on this host")
+        
+        async with cgroup_lock:
+            # Cold or idle cache: the last sample is too old for a meaningful rate, so take two now
+            if time.monotonic() - cgroup_collector.taken_at >= 2 * CGROUP_INTERVAL:
+                loop = asyncio.get_event_loop()
+                await loop.run_in_executor(metrics_executor, cgroup_collector.refresh)
+                await asyncio.sleep(CGROUP_WARMUP)
+                await loop.run_in_executor(metrics_executor, cgroup_collector.refresh)
+        touch_cgroup_sampler()
+        
+        groups = cgroup_collector.groups
+        path = "/" + path.strip("/") if path.strip("/") else "/"
+        if path not in groups:
+            raise HTTPException(status_code=404, detail=f"cgroup not found: {path}")
+        
+        children_index: Dict[str, List[str]] = {}
+        for group_path in groups:
+            if group_path != "/":
+                children_index.setdefault(os.path.dirname(group_path), []).append(group_path)
         
-        logger.info(f"Directory created: {request.path}")
-        return {"success": True, "message": f"Directory created: {request.path}"}
+        return {
+            "timestamp": cgroup_collector.timestamp,
+            "root": cgroup_collector.root,
+            "interval": CGROUP_INTERVAL,
+            "group_count": len(groups),
+            "truncated": cgroup_collector.truncated,
+            "cgroup": cgroup_collector.build_node(path, max(0, depth), sort_by, max(1, limit), children_index)
+        }
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error creating directory {request.path}: {e}")
+        logger.error(f"Error reading cgroups: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.delete("/api/files/delete")
-async def delete_file_or_directory(path: str, token: str = Depends(verify_token)):
-    """Delete a file or directory"""
+# ==================== Terminal Sessions ====================
+# Each terminal session owns one long-lived shell on a pseudo-terminal. Output
+# is read as the shell produces it and coalesced into small chunks, so long
+# commands stream instead of arriving at exit, and interactive programs,
+# resize and Ctrl-C behave as in a real terminal. The shell prompt is replaced
+# by an invisible OSC marker carrying the exit status and working directory;
+# that is how command completion and directory changes reach the line-based
+# frontend. Without pty support (Windows) each command runs in its own piped
+# process instead.
+
+try:
+    import pty
+    import termios
+    import fcntl
+except ImportError:
+    pty = None
+
+TERMINAL_SHELL = os.getenv("TERMINAL_SHELL", "")
+TERMINAL_TERM = os.getenv("TERMINAL_TERM", "dumb")
+TERMINAL_COALESCE_MS = float(os.getenv("TERMINAL_COALESCE_MS", "5"))
+TERMINAL_COALESCE_BYTES = int(os.getenv("TERMINAL_COALESCE_BYTES", str(16 * 1024)))
+# Output a slow client may have queued before the overflow policy kicks in:
+# "pause" stops reading the pty until it drains (the program blocks on write),
+# "truncate" keeps the program running and drops output with a notice
+TERMINAL_OUTPUT_BUFFER = int(os.getenv("TERMINAL_OUTPUT_BUFFER", str(1024 * 1024)))
+TERMINAL_OVERFLOW_POLICY = os.getenv("TERMINAL_OVERFLOW_POLICY", "pause").lower()
+TERMINAL_READY_TIMEOUT = 5.0
+# Sessions outlive their WebSocket for this long so a dropped connection can reattach
+TERMINAL_DETACH_GRACE = float(os.getenv("TERMINAL_DETACH_GRACE", "300"))
+TERMINAL_SCROLLBACK_BYTES = int(os.getenv("TERMINAL_SCROLLBACK_BYTES", str(256 * 1024)))
+# Session recordings (asciicast v2, gzip) for audits and postmortems
+TERMINAL_RECORDING_ENABLED = os.getenv("TERMINAL_RECORDING_ENABLED", "false").lower() == "true"
+TERMINAL_RECORDING_DIR = os.getenv("TERMINAL_RECORDING_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "recordings"))
+TERMINAL_RECORDING_INDEX_INTERVAL = float(os.getenv("TERMINAL_RECORDING_INDEX_INTERVAL", "30"))
+TERMINAL_RECORDING_MEMBER_BYTES = int(os.getenv("TERMINAL_RECORDING_MEMBER_BYTES", str(1024 * 1024)))
+TERMINAL_RECORDING_QUEUE = 10000
+
+TERMINAL_DANGEROUS_PATTERNS = [
+    # File system destruction
+    r'rm\s+-rf', r'del\s+/s\s+/q', r'format\s+[c-z]:', r'mkfs\..*',
+    # System commands
+    r'shutdown', r'reboot', r'halt', r'poweroff',
+    # Disk operations
+    r'fdisk', r'parted', r'dd\s+if=/dev/zero', r'dd\s+if=/dev/urandom',
+    # Network manipulation
+    r'iptables\s+-F', r'ipconfig\s+/release', r'ipconfig\s+/renew',
+    # User management
+    r'net\s+user\s+add', r'net\s+user\s+delete', r'useradd', r'userdel',
+    # Service manipulation
+    r'sc\s+delete', r'systemctl\s+disable', r'chkconfig\s+--del',
+    # Registry/configuration
+    r'reg\s+delete', r'reg\s+add', r'reg\s+export',
+    # Process manipulation
+    r'taskkill\s+/f', r'killall', r'pkill\s+-9',
+    # Package management
+    r'yum\s+remove', r'apt\s+remove', r'apt\s+purge', r'choco\s+uninstall',
+    # Network scanning
+    r'nmap', r'netstat\s+-an', r'arp\s+-a',
+    # System information gathering
+    r'wmic\s+process', r'wmic\s+service', r'wmic\s+startup'
+]
+
+# ESC ] 777 ; sg ; <exit status> ; <cwd> BEL, expanded by the shell at every prompt
+TERMINAL_PROMPT = "\x1b]777;sg;$?;$PWD\x07"
+TERMINAL_MARKER_PREFIX = b"\x1b]777;sg;"
+TERMINAL_MARKER_RE = re.compile(rb"\x1b\]777;sg;(\d*);([^\x07]*)\x07")
+
+def is_dangerous_terminal_command(command: str) -> bool:
+    command_lower = command.lower()
+    return any(re.search(pattern, command_lower) for pattern in TERMINAL_DANGEROUS_PATTERNS)
+
+def resolve_terminal_shell() -> str:
+    if TERMINAL_SHELL and os.path.exists(TERMINAL_SHELL):
+        return TERMINAL_SHELL
+    # bash without rc files gives a predictable prompt; anything POSIX works
+    return shutil.which("bash") or "/bin/sh"
+
+# The child leads a new session (setsid); the first tty a session leader opens
+# becomes its controlling terminal, so Ctrl-C and window size changes reach the
+# foreground job. Opening the slave from a tiny sh wrapper does that without a
+# preexec_fn, which is not safe to run between fork and exec in a threaded server.
+TERMINAL_TTY_WRAPPER = ["/bin/sh", "-c", 'exec "$@" <>"$0" >&0 2>&0']
+
+def kill_terminal_session_processes(session_id: int):
+    """SIGKILL the shell's process group and every job in its session.
+
+    With job control each job runs in its own process group, so killing the
+    shell's group alone would leave jobs that ignored SIGHUP behind.
+    """
     try:
-        abs_path = os.path.abspath(path)
-        
-        # Security check - prevent deletion in system directories
-        sensitive_paths = [
-            "/System", "/Library", "/usr", "/bin", "/sbin", "/etc", "/var", "/tmp",
-            "C:\\Windows", "C:\\System32", "C:\\Program Files", "C:\\Program Files (x86)"
-        ]
-        
-        for sensitive in sensitive_paths:
-            if abs_path.startswith(sensitive):
-                logger.warning(f"Deletion attempt in sensitive path: {abs_path}")
-                raise HTTPException(status_code=403, detail="Deletion in system directories is restricted for security")
-        
-        if not os.path.exists(abs_path):
-            raise HTTPException(status_code=404, detail="File or directory not found")
-        
-        # Check permissions
-        if not os.access(abs_path, os.W_OK):
-            raise HTTPException(status_code=403, detail="Permission denied deleting file/directory")
-        
-        # Delete file or directory
+        os.killpg(session_id, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+    for process in psutil.process_iter():
         try:
-            if os.path.isdir(abs_path):
-                shutil.rmtree(abs_path)
-            else:
-                os.remove(abs_path)
-        except PermissionError:
-            raise HTTPException(status_code=403, detail="Permission denied deleting file/directory")
-        
-        # Clear directory cache for the parent directory
-        parent_dir = os.path.dirname(abs_path)
-        cache_key = f"dir_list_{hashlib.md5(parent_dir.encode()).hexdigest()}"
-        async with cache_lock:
-            if cache_key in system_cache:
-                del system_cache[cache_key]
-        
-        logger.info(f"Deleted: {path}")
-        return {"success": True, "message": f"Deleted: {path}"}
-    except Exception as e:
-        logger.error(f"Error deleting {path}: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+            if os.getsid(process.pid) == session_id:
+                os.killpg(os.getpgid(process.pid), signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            continue
 
-@app.get("/api/files/binary-info")
-async def get_binary_file_info(path: str, token: str = Depends(verify_token)):
-    """Get information about a binary file for display"""
+class ScrollbackBuffer:
+    """Fixed-size byte ring holding the most recent terminal output"""
+
+    def __init__(self, capacity: int = TERMINAL_SCROLLBACK_BYTES):
+        self.buffer = bytearray(capacity)
+        self.capacity = capacity
+        self.position = 0
+        self.written = 0
+
+    def append(self, data: bytes):
+        if not self.capacity:
+            return
+        self.written += len(data)
+        if len(data) >= self.capacity:
+            self.buffer[:] = data[-self.capacity:]
+            self.position = 0
+            return
+        end = self.position + len(data)
+        if end <= self.capacity:
+            self.buffer[self.position:end] = data
+        else:
+            split = self.capacity - self.position
+            self.buffer[self.position:] = data[:split]
+            self.buffer[:end - self.capacity] = data[split:]
+        self.position = end % self.capacity
+
+    def read(self) -> bytes:
+        if self.written < self.capacity:
+            return bytes(self.buffer[:self.position])
+        return bytes(self.buffer[self.position:] + self.buffer[:self.position])
+
+    def text(self) -> str:
+        data = self.read()
+        if self.written > self.capacity:
+            # The ring may have cut a UTF-8 sequence in half; skip its tail bytes
+            start = 0
+            while start < min(3, len(data)) and 0x80 <= data[start] < 0xC0:
+                start += 1
+            data = data[start:]
+        return data.decode("utf-8", errors="replace")
+
+class TerminalOutbox:
+    """One subscriber's outgoing messages, bounded by the output bytes they hold"""
+
+    def __init__(self, session: "TerminalSession", limit: int = TERMINAL_OUTPUT_BUFFER):
+        self.session = session
+        self.limit = limit
+        self.events = deque()
+        self.bytes = 0
+        self.dropped = 0
+        self._gap = None  # notice marking where output is currently being dropped
+        self._available = asyncio.Event()
+
+    def put(self, event: dict, size: int = 0):
+        if size and TERMINAL_OVERFLOW_POLICY == "truncate":
+            if self._gap is not None and self.bytes > self.limit // 2:
+                self._gap["dropped_bytes"] += size
+                self.dropped += size
+                return
+            if self._gap is None and self.bytes + size > self.limit:
+                self._gap = {"type": "system", "dropped_bytes": size}
+                self.dropped += size
+                self.events.append((self._gap, 0))
+                self._available.set()
+                return
+            self._gap = None
+        self.events.append((event, size))
+        self.bytes += size
+        self._available.set()
+        if self.bytes > self.limit and TERMINAL_OVERFLOW_POLICY == "pause":
+            self.session.pause_reading()
+
+    # Control messages (pong, errors) are queued the same way as output
+    put_nowait = put
+
+    async def get(self) -> dict:
+        while not self.events:
+            self._available.clear()
+            await self._available.wait()
+        event, size = self.events.popleft()
+        self.bytes -= size
+        if "dropped_bytes" in event:
+            if event is self._gap:
+                self._gap = None
+            event["message"] = f"Output truncated: {event['dropped_bytes']} bytes dropped because the client fell behind"
+        if self.session.paused and self.bytes <= self.limit // 2:
+            self.session.resume_reading()
+        return event
+
+class TerminalRecorder:
+    """Records a session as gzip-compressed asciicast v2 with a seek index.
+
+    The file is a series of gzip members (so `zcat` still yields a plain
+    .cast file); a new member starts every TERMINAL_RECORDING_INDEX_INTERVAL
+    seconds or TERMINAL_RECORDING_MEMBER_BYTES of events, and its start time
+    and byte offset are appended to a sidecar .idx file. Playback seeks to the
+    member covering the requested time and decompresses only from there.
+    Events are queued in memory and written once a second from the filesystem
+    pool, so recording never waits on disk; if the queue overflows events are
+    dropped and a marker notes how many.
+    """
+
+    def __init__(self, session_id: str, cols: int = 80, rows: int = 24):
+        os.makedirs(TERMINAL_RECORDING_DIR, exist_ok=True)
+        safe_id = re.sub(r"[^A-Za-z0-9_.-]", "_", session_id)[:64]
+        name = f"{safe_id}-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{secrets.token_hex(3)}.cast.gz"
+        self.path = os.path.join(TERMINAL_RECORDING_DIR, name)
+        self.index_path = self.path + ".idx"
+        self.started = time.monotonic()
+        self.header = {
+            "version": 2,
+            "width": cols,
+            "height": rows,
+            "timestamp": int(time.time()),
+            "title": session_id,
+            "env": {"SHELL": resolve_terminal_shell(), "TERM": TERMINAL_TERM}
+        }
+        self.events = deque()
+        self.dropped = 0
+        self.closed = False
+        self._file = None
+        self._compressor = None
+        self._member_started = 0.0
+        self._member_bytes = 0
+        self._task = asyncio.create_task(self._writer())
+
+    def record(self, kind: str, data: str):
+        if self.closed:
+            return
+        if len(self.events) >= TERMINAL_RECORDING_QUEUE:
+            self.dropped += 1
+            return
+        self.events.append((time.monotonic() - self.started, kind, data))
+
+    async def _writer(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while not self.closed:
+                await asyncio.sleep(1.0)
+                await self._write_pending(loop)
+        finally:
+            await self._write_pending(loop, finish=True)
+
+    async def _write_pending(self, loop, finish: bool = False):
+        batch = list(self.events)
+        self.events.clear()
+        if self.dropped:
+            batch.append((time.monotonic() - self.started, "m", f"recording dropped {self.dropped} events"))
+            self.dropped = 0
+        if batch or finish:
+            try:
+                await loop.run_in_executor(filesystem_executor, self._write_batch, batch, finish)
+            except Exception as e:
+                logger.error(f"Failed to write terminal recording {self.path}: {e}")
+
+    def _start_member(self, t: float):
+        self._finish_member()
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+        self._member_started = t
+        self._member_bytes = 0
+        with open(self.index_path, "a") as index:
+            index.write(json.dumps({"t": round(t, 6), "offset": self._file.tell()}) + "\n")
+
+    def _finish_member(self):
+        if self._compressor is not None:
+            self._file.write(self._compressor.flush())
+            self._compressor = None
+
+    def _write_batch(self, batch: list, finish: bool):
+        if self._file is None:
+            self._file = open(self.path, "ab")
+            self._start_member(0.0)
+            line = (json.dumps(self.header) + "\n").encode()
+            self._file.write(self._compressor.compress(line))
+        out = []
+        for t, kind, data in batch:
+            if (t - self._member_started >= TERMINAL_RECORDING_INDEX_INTERVAL
+                    or self._member_bytes >= TERMINAL_RECORDING_MEMBER_BYTES):
+                self._file.write(b"".join(out))
+                out = []
+                self._start_member(t)
+            line = (json.dumps([round(t, 6), kind, data]) + "\n").encode()
+            self._member_bytes += len(line)
+            out.append(self._compressor.compress(line))
+        if finish:
+            self._file.write(b"".join(out))
+            self._finish_member()
+            self._file.close()
+            self._file = None
+            return
+        # Sync flush: everything up to here is decodable even if the server dies
+        out.append(self._compressor.flush(zlib.Z_SYNC_FLUSH))
+        self._file.write(b"".join(out))
+        self._file.flush()
+
+    async def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        await self._task
+
+def load_recording_index(path: str) -> List[dict]:
     try:
-        abs_path = os.path.abspath(path)
-        if not os.path.exists(abs_path):
-            raise HTTPException(status_code=404, detail=f"File not found: {path}")
-        
-        if os.path.isdir(abs_path):
-            raise HTTPException(status_code=400, detail=f"Path is a directory: {path}")
-        
-        # Get file stats
-        stats = os.stat(abs_path)
-        mime_type = get_file_mime_type(abs_path)
-        
-        # Determine file type category
-        file_category = "unknown"
-        if mime_type.startswith('image/'):
-            file_category = "image"
-        elif mime_type.startswith('video/'):
-            file_category = "video"
-        elif mime_type.startswith('audio/'):
-            file_category = "audio"
-        elif mime_type == 'application/pdf':
-            file_category = "pdf"
-        elif mime_type.startswith('text/'):
-            file_category = "text"
-        
+        with open(path + ".idx") as index:
+            return [json.loads(line) for line in index if line.strip()]
+    except FileNotFoundError:
+        return [{"t": 0.0, "offset": 0}]
+
+def read_recording_member(path: str, offset: int, end: Optional[int]) -> List[str]:
+    """Decompressed lines of the gzip member(s) between two byte offsets"""
+    with open(path, "rb") as f:
+        f.seek(offset)
+        raw = f.read(end - offset) if end is not None else f.read()
+    lines = []
+    pending = b""
+    while raw:
+        decompressor = zlib.decompressobj(31)
+        try:
+            pending += decompressor.decompress(raw)
+        except zlib.error:
+            break  # torn write at the end of a live recording
+        raw = decompressor.unused_data
+    for line in pending.split(b"\n"):
+        if line:
+            lines.append(line.decode("utf-8", errors="replace"))
+    return lines
+
+class TerminalSession:
+    """A shell on a pseudo-terminal that outlives individual commands"""
+
+    def __init__(self, session_id: str, cwd: str):
+        self.session_id = session_id
+        self.cwd = cwd
+        self.process = None
+        self.master_fd = None
+        self.created_at = time.time()
+        self.detached_at = None
+        self.scrollback = ScrollbackBuffer()
+        self.recorder: Optional[TerminalRecorder] = None
+        self._expiry = None
+        self.subscribers: List[TerminalOutbox] = []
+        self.paused = False
+        self._can_read = asyncio.Event()
+        self._can_read.set()
+        self._loop = None
+        self._pending = bytearray()
+        self._flush_handle = None
+        self._input = bytearray()
+        self._line = ""
+        self._piped_line = ""
+        self._writing = False
+        self._ready = asyncio.Event()
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    def subscribe(self, replay: bool = False) -> TerminalOutbox:
+        outbox = TerminalOutbox(self)
+        if replay and self.scrollback.written:
+            # Queued before any live output: nothing can be published in between
+            text = self.scrollback.text()
+            outbox.put({"type": "output", "data": text, "replay": True}, len(text))
+        self.subscribers.append(outbox)
+        if self._expiry is not None:
+            self._expiry.cancel()
+            self._expiry = None
+        self.detached_at = None
+        return outbox
+
+    def unsubscribe(self, outbox: TerminalOutbox):
+        if outbox in self.subscribers:
+            self.subscribers.remove(outbox)
+        self.resume_reading()
+
+    def detach(self, outbox: TerminalOutbox, on_expire):
+        """Drop a subscriber; with none left, expire the session after the grace period"""
+        self.unsubscribe(outbox)
+        if self.subscribers:
+            return
+        self.detached_at = time.time()
+        self._expiry = self._loop.call_later(TERMINAL_DETACH_GRACE, lambda: asyncio.ensure_future(on_expire(self)))
+
+    def to_dict(self) -> dict:
         return {
-            "path": path,
-            "name": os.path.basename(abs_path),
-            "size": stats.st_size,
-            "mime_type": mime_type,
-            "file_category": file_category,
-            "modified": datetime.fromtimestamp(stats.st_mtime).isoformat(),
-            "readable": os.access(abs_path, os.R_OK)
+            "session_id": self.session_id,
+            "alive": self.alive,
+            "pid": self.process.pid if self.process else None,
+            "current_directory": self.cwd,
+            "created_at": datetime.fromtimestamp(self.created_at).isoformat(),
+            "attached": len(self.subscribers),
+            "detached_at": datetime.fromtimestamp(self.detached_at).isoformat() if self.detached_at else None,
+            "scrollback_bytes": min(self.scrollback.written, self.scrollback.capacity),
+            "output_bytes": self.scrollback.written
         }
-    except Exception as e:
-        logger.error(f"Error getting binary file info {path}: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/files/create-share-link", response_model=ShareableLinkResponse)
-async def create_shareable_link(request: ShareableLinkRequest, token: str = Depends(verify_token)):
-    """Create a shareable link for a file with expiry"""
-    try:
-        abs_path = os.path.abspath(request.path)
-        if not os.path.exists(abs_path):
-            raise HTTPException(status_code=404, detail=f"File not found: {request.path}")
-        
-        if os.path.isdir(abs_path):
-            raise HTTPException(status_code=400, detail=f"Cannot create shareable link for directory: {request.path}")
-        
-        # Security check - prevent sharing from system directories
-        sensitive_paths = [
-            "/System", "/Library", "/usr", "/bin", "/sbin", "/etc", "/var", "/tmp",
-            "C:\\Windows", "C:\\System32", "C:\\Program Files", "C:\\Program Files (x86)"
-        ]
-        
-        for sensitive in sensitive_paths:
-            if abs_path.startswith(sensitive):
-                logger.warning(f"Share link creation attempt for sensitive path: {abs_path}")
-                raise HTTPException(status_code=403, detail="Cannot create shareable links for system files")
+    def publish(self, event: dict, size: int = 0):
+        for outbox in self.subscribers:
+            outbox.put(event, size)
+
+    def pause_reading(self):
+        """Stop reading output; once the pty buffer fills the program blocks on write"""
+        if self.paused:
+            return
+        self.paused = True
+        self._can_read.clear()
+        if self.master_fd is not None:
+            self._loop.remove_reader(self.master_fd)
+
+    def resume_reading(self):
+        """Resume once every subscriber has drained below half its limit"""
+        if not self.paused or any(outbox.bytes > outbox.limit // 2 for outbox in self.subscribers):
+            return
+        self.paused = False
+        self._can_read.set()
+        if self.master_fd is not None:
+            self._loop.add_reader(self.master_fd, self._on_readable)
+
+    async def start(self):
+        """Start the shell (no-op in pipe mode) and wait for its first prompt"""
+        self._loop = asyncio.get_running_loop()
+        if TERMINAL_RECORDING_ENABLED and self.recorder is None:
+            try:
+                self.recorder = TerminalRecorder(self.session_id)
+            except OSError as e:
+                logger.error(f"Cannot record terminal session {self.session_id}: {e}")
+        if pty is None or self.alive:
+            return
+        shell = resolve_terminal_shell()
+        master_fd, slave_fd = pty.openpty()
+        try:
+            # The client already shows what it sent, and expects plain \n line endings
+            attrs = termios.tcgetattr(slave_fd)
+            attrs[1] &= ~termios.ONLCR
+            attrs[3] &= ~termios.ECHO
+            termios.tcsetattr(slave_fd, termios.TCSANOW, attrs)
+            env = dict(os.environ, TERM=TERMINAL_TERM, PS1=TERMINAL_PROMPT, PS2="", PROMPT_COMMAND="")
+            if TERMINAL_TERM == "dumb":
+                env.update(PAGER="cat", GIT_PAGER="cat")
+            if os.path.basename(shell) == "bash":
+                args = [shell, "--norc", "--noprofile", "--noediting", "-i"]
+            else:
+                args = [shell, "-i"]
+            self.process = await asyncio.create_subprocess_exec(
+                *TERMINAL_TTY_WRAPPER, os.ttyname(slave_fd), *args,
+                stdin=slave_fd,
+                stdout=slave_fd,
+                stderr=slave_fd,
+                cwd=self.cwd if os.path.isdir(self.cwd) else None,
+                env=env,
+                start_new_session=True
+            )
+        except Exception:
+            os.close(master_fd)
+            raise
+        finally:
+            os.close(slave_fd)
+        os.set_blocking(master_fd, False)
+        self.master_fd = master_fd
+        self._ready.clear()
+        if not self.paused:
+            self._loop.add_reader(master_fd, self._on_readable)
+        logger.info(f"Started shell {shell} for terminal session {self.session_id} (pid {self.process.pid})")
+        try:
+            await asyncio.wait_for(self._ready.wait(), TERMINAL_READY_TIMEOUT)
+        except asyncio.TimeoutError:
+            # Shell never printed our prompt (custom shell?); stream what it has
+            logger.warning(f"No prompt marker from shell in terminal session {self.session_id}")
+            self._ready.set()
+
+    def _on_readable(self):
+        try:
+            data = os.read(self.master_fd, 65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            # EIO: the shell and everything it started have closed the pty
+            data = b""
+        if not data:
+            self._close_pty()
+            return
+        self._pending += data
+        if len(self._pending) >= TERMINAL_COALESCE_BYTES:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = self._loop.call_later(TERMINAL_COALESCE_MS / 1000, self._flush)
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        data = bytes(self._pending)
+        self._pending.clear()
+        # Hold back a prompt marker that is split across reads
+        start = data.rfind(b"\x1b")
+        if start != -1 and b"\x07" not in data[start:] and len(data) - start < 4096:
+            if TERMINAL_MARKER_PREFIX.startswith(data[start:start + len(TERMINAL_MARKER_PREFIX)]):
+                self._pending += data[start:]
+                data = data[:start]
+        position = 0
+        for match in TERMINAL_MARKER_RE.finditer(data):
+            self._emit_output(data[position:match.start()])
+            self._on_prompt(int(match.group(1) or 0), os.fsdecode(match.group(2)))
+            position = match.end()
+        self._emit_output(data[position:])
+
+    def _emit_output(self, data: bytes):
+        # Anything before the first prompt is shell start-up noise
+        if not data or not self._ready.is_set():
+            return
+        self.scrollback.append(data)
+        text = self._decoder.decode(data)
+        if text:
+            if self.recorder is not None:
+                self.recorder.record("o", text)
+            self.publish({"type": "output", "data": text}, len(data))
+
+    def _on_prompt(self, status: int, cwd: str):
+        if self._ready.is_set():
+            self.publish({"type": "exit", "code": status})
+        first = not self._ready.is_set()
+        self._ready.set()
+        if cwd and (first or cwd != self.cwd):
+            self.cwd = cwd
+            self.publish({"type": "directory", "path": cwd})
+
+    def _close_pty(self):
+        if self.master_fd is None:
+            return
+        self._flush()
+        self._loop.remove_reader(self.master_fd)
+        if self._writing:
+            self._loop.remove_writer(self.master_fd)
+            self._writing = False
+        os.close(self.master_fd)
+        self.master_fd = None
+        self._input.clear()
+        asyncio.ensure_future(self._report_shell_exit(self.process))
+
+    async def _report_shell_exit(self, process):
+        code = await process.wait()
+        self.publish({"type": "system", "message": f"Shell exited with code {code}; the next command starts a new one"})
+
+    def write(self, data: bytes):
+        if self.master_fd is None:
+            return
+        self._input += data
+        self._drain_input()
+
+    def _drain_input(self):
+        try:
+            written = os.write(self.master_fd, self._input)
+        except BlockingIOError:
+            written = 0
+        except OSError:
+            self._input.clear()
+            written = 0
+        del self._input[:written]
+        # A large paste can fill the pty's input queue; finish it when there is room
+        if self._input and not self._writing:
+            self._loop.add_writer(self.master_fd, self._drain_input)
+            self._writing = True
+        elif not self._input and self._writing:
+            self._loop.remove_writer(self.master_fd)
+            self._writing = False
+
+    async def run_command(self, command: str):
+        if self.recorder is not None:
+            self.recorder.record("i", command + "\n")
+        if pty is None:
+            asyncio.create_task(self._run_piped(command))
+            return
+        if not self.alive:
+            await self.start()
+        self.write(command.encode() + b"\n")
+
+    def _line_mode(self) -> bool:
+        """Whether the foreground program reads whole lines (the shell prompt, `read`, ...)"""
+        if pty is None:
+            return True
+        try:
+            return bool(termios.tcgetattr(self.master_fd)[3] & termios.ICANON)
+        except (termios.error, TypeError):
+            return False
+
+    def send_input(self, data: str) -> Optional[str]:
+        """Forward keystrokes; returns the line instead of running it if it is a dangerous command.
+
+        Lines typed into a line-mode reader are screened like the "command"
+        message. Keystrokes pass straight through and a rejected line is
+        discarded with the tty's kill character instead of being submitted.
+        Programs in raw mode (editors, readline REPLs) are not screened.
+        """
+        rejected = None
+        if self._line_mode():
+            for index, char in enumerate(data):
+                if char in "\r\n":
+                    line, self._line = self._line, ""
+                    if is_dangerous_terminal_command(line):
+                        # Drop the newline and everything after it; ^U clears the pending line
+                        data, rejected = data[:index] + "\x15", line
+                        break
+                elif char in "\x7f\x08":
+                    self._line = self._line[:-1]
+                elif char in "\x03\x15":
+                    self._line = ""
+                else:
+                    self._line += char
+        else:
+            self._line = ""
+        if self.recorder is not None:
+            self.recorder.record("i", data)
+        if pty is None:
+            # A pipe cannot take bytes back, so only whole screened lines are written
+            if rejected is not None:
+                self._piped_line = ""
+                return rejected
+            pending = self._piped_line + data
+            end = max(pending.rfind("\n"), pending.rfind("\r")) + 1
+            self._piped_line = pending[end:]
+            if end and self.alive and self.process.stdin:
+                self.process.stdin.write(pending[:end].encode())
+            return None
+        self.write(data.encode())
+        return rejected
+
+    def interrupt(self):
+        if pty is None:
+            if self.alive:
+                self.process.terminate()
+            return
+        # ^C through the line discipline: SIGINT to the foreground job, not the shell
+        self.write(b"\x03")
+
+    def resize(self, rows: int, cols: int):
+        if self.recorder is not None:
+            self.recorder.record("r", f"{cols}x{rows}")
+        if self.master_fd is not None:
+            fcntl.ioctl(self.master_fd, termios.TIOCSWINSZ, struct.pack("HHHH", rows, cols, 0, 0))
+
+    async def _run_piped(self, command: str):
+        """Pipe-mode fallback: one process per command, output streamed as it comes"""
+        stripped = command.strip()
+        if stripped == "cd" or stripped.startswith("cd "):
+            target = os.path.expanduser(stripped[2:].strip() or "~")
+            target = os.path.abspath(os.path.join(self.cwd, target))
+            if os.path.isdir(target):
+                self.cwd = target
+                self.publish({"type": "directory", "path": target})
+                self.publish({"type": "exit", "code": 0})
+            else:
+                self.publish({"type": "error", "message": f"Directory not found: {target}"})
+            return
+        if platform.system() == "Windows":
+            args = ["cmd", "/c", command]
+        else:
+            args = [resolve_terminal_shell(), "-c", command]
+        try:
+            self.process = await asyncio.create_subprocess_exec(
+                *args,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+                cwd=self.cwd
+            )
+            self._ready.set()
+            while True:
+                await self._can_read.wait()
+                data = await self.process.stdout.read(TERMINAL_COALESCE_BYTES)
+                if not data:
+                    break
+                self._emit_output(data)
+            self.publish({"type": "exit", "code": await self.process.wait()})
+        except Exception as e:
+            logger.error(f"Command execution failed in session {self.session_id}: {e}")
+            self.publish({"type": "error", "message": f"Command execution failed: {str(e)}"})
+
+    async def close(self):
+        """Hang up the terminal and make sure the shell and its jobs are gone"""
+        if self._expiry is not None:
+            self._expiry.cancel()
+            self._expiry = None
+        if self.recorder is not None:
+            await self.recorder.close()
+        process = self.process
+        if self.master_fd is not None:
+            self._loop.remove_reader(self.master_fd)
+            if self._writing:
+                self._loop.remove_writer(self.master_fd)
+                self._writing = False
+            os.close(self.master_fd)
+            self.master_fd = None
+        if process is None or process.returncode is not None:
+            return
+        try:
+            if pty is not None:
+                # The shell leads its own session; SIGHUP it like a closed terminal would
+                os.killpg(process.pid, signal.SIGHUP)
+            else:
+                process.terminate()
+            await asyncio.wait_for(process.wait(), 2.0)
+        except asyncio.TimeoutError:
+            if pty is not None:
+                # Jobs that ignored the hangup go with the shell
+                kill_terminal_session_processes(process.pid)
+            else:
+                process.kill()
+        except (ProcessLookupError, PermissionError):
+            pass
+        logger.info(f"Terminated shell for terminal session {self.session_id}")
+
+async def expire_terminal_session(session: TerminalSession):
+    if session.subscribers:
+        return
+    if manager.terminal_sessions.get(session.session_id) is session:
+        del manager.terminal_sessions[session.session_id]
+    await session.close()
+    logger.info(f"Expired detached terminal session: {session.session_id}")
+
+def attach_terminal_session(session_id: str):
+    """Find or create a session and subscribe to it; returns (session, outbox, reattached)"""
+    session = manager.terminal_sessions.get(session_id)
+    reattached = session is not None
+    if session is None:
+        session = manager.terminal_sessions[session_id] = TerminalSession(session_id, os.getcwd())
+        logger.info(f"Created new terminal session: {session_id}")
+    # A reattaching client first gets the scrollback, then the live stream
+    outbox = session.subscribe(replay=reattached)
+    return session, outbox, reattached
+
+async def release_terminal_session(session: TerminalSession, outbox: TerminalOutbox, terminate: bool = False):
+    if TERMINAL_DETACH_GRACE > 0 and not terminate:
+        # Keep the shell running so the client can reattach
+        session.detach(outbox, expire_terminal_session)
+        logger.info(f"Detached terminal session: {session.session_id}")
+    else:
+        session.unsubscribe(outbox)
+        if not session.subscribers:
+            await expire_terminal_session(session)
+
+async def handle_terminal_message(session: TerminalSession, outbox: TerminalOutbox, message: dict) -> bool:
+    """Apply one client message to a session; False if it isn't a session message"""
+    message_type = message.get("type")
+    if message_type == "command":
+        command = message["command"]
+        logger.info(f"Received command in session {session.session_id}: {command}")
+        
+        if is_dangerous_terminal_command(command):
+            outbox.put_nowait({
+                "type": "error",
+                "message": "Potentially dangerous command rejected for safety",
+                "command": command
+            })
+            logger.warning(f"Dangerous command rejected in session {session.session_id}: {command}")
+            return True
+        
+        try:
+            await session.run_command(command)
+        except Exception as e:
+            outbox.put_nowait({
+                "type": "error",
+                "message": f"Command execution failed: {str(e)}"
+            })
+            logger.error(f"Command execution failed in session {session.session_id}: {e}")
+    
+    elif message_type == "input":
+        # Raw keystrokes for interactive programs
+        rejected = session.send_input(message.get("data", ""))
+        if rejected is not None:
+            outbox.put_nowait({
+                "type": "error",
+                "message": "Potentially dangerous command rejected for safety",
+                "command": rejected
+            })
+            logger.warning(f"Dangerous input line rejected in session {session.session_id}: {rejected}")
+    
+    elif message_type == "interrupt":
+        session.interrupt()
+    
+    elif message_type == "resize":
+        session.resize(int(message["rows"]), int(message["cols"]))
+    
+    elif message_type == "get_directory":
+        # Send current directory
+        outbox.put_nowait({
+            "type": "directory",
+            "path": session.cwd
+        })
+    
+    else:
+        return False
+    return True
+
+@app.on_event("shutdown")
+async def close_terminal_sessions():
+    sessions = list(manager.terminal_sessions.values())
+    manager.terminal_sessions.clear()
+    for session in sessions:
+        await session.close()
+
+@app.get("/api/terminal/sessions")
+async def list_terminal_sessions(token: str = Depends(verify_token)):
+    """Terminal sessions, including detached ones waiting to be reattached"""
+    return {
+        "grace_period": TERMINAL_DETACH_GRACE,
+        "sessions": [session.to_dict() for session in manager.terminal_sessions.values()]
+    }
+
+def _recording_path(name: str) -> str:
+    if os.path.basename(name) != name or not name.endswith(".cast.gz"):
+        raise HTTPException(status_code=400, detail="Invalid recording name")
+    path = os.path.join(TERMINAL_RECORDING_DIR, name)
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail=f"Recording not found: {name}")
+    return path
+
+@app.get("/api/terminal/recordings")
+async def list_terminal_recordings(token: str = Depends(verify_token)):
+    """Recorded terminal sessions, newest first"""
+    def scan():
+        recordings = []
+        try:
+            entries = list(os.scandir(TERMINAL_RECORDING_DIR))
+        except FileNotFoundError:
+            return recordings
+        for entry in entries:
+            if not entry.name.endswith(".cast.gz"):
+                continue
+            index = load_recording_index(entry.path)
+            stat = entry.stat()
+            recordings.append({
+                "name": entry.name,
+                "size": stat.st_size,
+                "modified": datetime.fromtimestamp(stat.st_mtime).isoformat(),
+                "seek_points": len(index),
+                "last_seek_point": index[-1]["t"] if index else 0.0
+            })
+        recordings.sort(key=lambda recording: recording["modified"], reverse=True)
+        return recordings
+    
+    loop = asyncio.get_event_loop()
+    return {
+        "enabled": TERMINAL_RECORDING_ENABLED,
+        "recordings": await loop.run_in_executor(filesystem_executor, scan)
+    }
+
+@app.get("/api/terminal/recordings/{name}")
+async def play_terminal_recording(name: str, start: float = 0.0, end: Optional[float] = None,
+                                  token: str = Depends(verify_token)):
+    """Stream a recording (asciicast v2) from `start` to `end` seconds.
+
+    Only the gzip members overlapping the window are read and decompressed,
+    one at a time, so seeking into a multi-hour session is cheap.
+    """
+    path = _recording_path(name)
+    loop = asyncio.get_event_loop()
+    index = await loop.run_in_executor(filesystem_executor, load_recording_index, path)
+    seek_times = [entry["t"] for entry in index]
+    first = max(0, bisect.bisect_right(seek_times, start) - 1)
+    
+    async def events():
+        # The header lives in the first member
+        if first > 0:
+            header = await loop.run_in_executor(filesystem_executor, read_recording_member, path, 0,
+                                                index[1]["offset"] if len(index) > 1 else None)
+            if header:
+                yield header[0] + "\n"
+        for position in range(first, len(index)):
+            if end is not None and index[position]["t"] > end:
+                break
+            member_end = index[position + 1]["offset"] if position + 1 < len(index) else None
+            lines = await loop.run_in_executor(filesystem_executor, read_recording_member, path,
+                                               index[position]["offset"], member_end)
+            chunk = []
+            for line in lines:
+                if line.startswith("{"):
+                    chunk.append(line)  # header
+                    continue
+                t = json.loads(line)[0]
+                if t < start or (end is not None and t > end):
+                    continue
+                chunk.append(line)
+            if chunk:
+                yield "\n".join(chunk) + "\n"
+    
+    return StreamingResponse(events(), media_type="application/x-asciicast")
+
+# Real-time terminal with WebSocket support
+@app.websocket("/ws/terminal/{session_id}")
+async def terminal_websocket(websocket: WebSocket, session_id: str):
+    logger.info(f"Terminal WebSocket connection attempt for session: {session_id}")
+    await manager.connect(websocket)
+    
+    # Every outgoing message goes through this queue, so one task writes to the socket
+    session, outbox, reattached = attach_terminal_session(session_id)
+    
+    async def forward_output():
+        while True:
+            event = await outbox.get()
+            await websocket.send_text(json.dumps(event))
+    
+    sender = asyncio.create_task(forward_output())
+    
+    try:
+        await session.start()
+        # Send welcome message
+        if reattached:
+            message = f"Reattached to terminal session {session_id}."
+        else:
+            message = f"Terminal session {session_id} established. Ready for commands."
+        welcome_msg = {
+            "type": "system",
+            "message": message,
+            "current_directory": session.cwd,
+            "reattached": reattached
+        }
+        outbox.put_nowait(welcome_msg)
+        logger.info(f"Sent welcome message to session: {session_id}")
+        
+        # Add a timeout for receiving messages to prevent hanging
+        while True:
+            try:
+                # Use asyncio.wait_for to add a timeout to receive_text
+                data = await asyncio.wait_for(websocket.receive_text(), timeout=300.0)  # 5 minute timeout
+                message = json.loads(data)
+                
+                if message["type"] == "ping":
+                    # Respond to ping for connection health check
+                    outbox.put_nowait({
+                        "type": "pong",
+                        "timestamp": datetime.now().isoformat()
+                    })
+                else:
+                    await handle_terminal_message(session, outbox, message)
+                        
+            except asyncio.TimeoutError:
+                # Send a heartbeat to keep the connection alive
+                if sender.done():
+                    logger.error(f"Failed to send heartbeat to session {session_id}")
+                    break
+                outbox.put_nowait({
+                    "type": "heartbeat",
+                    "timestamp": datetime.now().isoformat()
+                })
+                logger.debug(f"Sent heartbeat to session {session_id}")
+            except json.JSONDecodeError:
+                outbox.put_nowait({
+                    "type": "error",
+                    "message": "Invalid JSON message received"
+                })
+                logger.warning(f"Invalid JSON received in session {session_id}")
+            except WebSocketDisconnect:
+                logger.info(f"WebSocket disconnected for session {session_id}")
+                break
+            except Exception as e:
+                logger.error(f"WebSocket receive error in session {session_id}: {e}")
+                if sender.done():
+                    # If we can't send error message, then break
+                    logger.error(f"Cannot send error message to session {session_id}, breaking connection")
+                    break
+                # Don't break immediately, try to continue the connection
+                outbox.put_nowait({
+                    "type": "error",
+                    "message": f"Connection error: {str(e)}"
+                })
+    
+    except WebSocketDisconnect:
+        logger.info(f"Terminal WebSocket disconnected for session {session_id}")
+    except Exception as e:
+        logger.error(f"Terminal WebSocket error for session {session_id}: {e}")
+    finally:
+        sender.cancel()
+        manager.disconnect(websocket)
+        await release_terminal_session(session, outbox)
+
+# Multiplexed terminal channel: one socket carries any number of sessions.
+# Output travels as binary frames (2-byte big-endian channel id + UTF-8 text),
+# everything else as JSON text frames with a "channel" field. Each channel is
+# sent at most its credit in output bytes (frames are split to fit, possibly
+# mid-character); the client returns credit with
+# {"type": "credit", "channel": c, "bytes": n} as it renders. A channel out of
+# credit simply stops being drained (its session's overflow policy applies)
+# while the other channels carry on.
+TERMINAL_MUX_WINDOW = int(os.getenv("TERMINAL_MUX_WINDOW", str(256 * 1024)))
+TERMINAL_MUX_MAX_CHANNELS = int(os.getenv("TERMINAL_MUX_MAX_CHANNELS", "32"))
+
+class TerminalChannel:
+    """One session carried over a multiplexed terminal socket"""
+
+    def __init__(self, channel_id: int, session: TerminalSession, outbox: TerminalOutbox, window: int):
+        self.id = channel_id
+        self.session = session
+        self.outbox = outbox
+        self.credit = window
+        self.credit_available = asyncio.Event()
+        self.task = None
+
+    def grant(self, amount: int):
+        self.credit += amount
+        if self.credit > 0:
+            self.credit_available.set()
+
+@app.websocket("/ws/terminals")
+async def terminal_mux_websocket(websocket: WebSocket):
+    """Many terminal sessions over one WebSocket with per-session flow control"""
+    await manager.connect(websocket)
+    channels: Dict[int, TerminalChannel] = {}
+    send_lock = asyncio.Lock()
+    
+    async def send_json(payload: dict):
+        async with send_lock:
+            await websocket.send_text(json.dumps(payload))
+    
+    async def forward(channel: TerminalChannel):
+        header = channel.id.to_bytes(2, "big")
+        while True:
+            event = await channel.outbox.get()
+            if event["type"] != "output" or event.get("replay"):
+                await send_json({**event, "channel": channel.id})
+                continue
+            payload = event["data"].encode("utf-8")
+            while payload:
+                while channel.credit <= 0:
+                    channel.credit_available.clear()
+                    await channel.credit_available.wait()
+                # Split to fit the window exactly; clients decode UTF-8 incrementally
+                part = payload[:channel.credit]
+                payload = payload[len(part):]
+                channel.credit -= len(part)
+                async with send_lock:
+                    await websocket.send_bytes(header + part)
+    
+    async def open_channel(message: dict):
+        session_id = str(message.get("session") or "")
+        if not session_id:
+            await send_json({"type": "error", "message": "open requires a session id"})
+            return
+        if any(channel.session.session_id == session_id for channel in channels.values()):
+            await send_json({"type": "error", "message": f"Session {session_id} is already open on this connection"})
+            return
+        if len(channels) >= TERMINAL_MUX_MAX_CHANNELS:
+            await send_json({"type": "error", "message": f"At most {TERMINAL_MUX_MAX_CHANNELS} sessions per connection"})
+            return
+        # Lowest free id: frames carry it in two bytes, so ids must never collide with an open channel
+        channel_id = next((candidate for candidate in range(1, 0x10000) if candidate not in channels), None)
+        if channel_id is None:
+            await send_json({"type": "error", "message": "No free channel ids on this connection"})
+            return
+        session, outbox, reattached = attach_terminal_session(session_id)
+        channel = TerminalChannel(channel_id, session, outbox,
+                                  max(1, int(message.get("window", TERMINAL_MUX_WINDOW))))
+        try:
+            await session.start()
+        except Exception as e:
+            await release_terminal_session(session, outbox)
+            await send_json({"type": "error", "message": f"Failed to start session {session_id}: {str(e)}"})
+            return
+        channels[channel.id] = channel
+        # Sent before any output so the client can map the channel id first
+        await send_json({
+            "type": "opened",
+            "channel": channel.id,
+            "session": session_id,
+            "reattached": reattached,
+            "current_directory": session.cwd,
+            "window": channel.credit
+        })
+        channel.task = asyncio.create_task(forward(channel))
+    
+    async def close_channel(channel: TerminalChannel, terminate: bool = False):
+        channels.pop(channel.id, None)
+        if channel.task is not None:
+            channel.task.cancel()
+        await release_terminal_session(channel.session, channel.outbox, terminate)
+    
+    try:
+        while True:
+            try:
+                data = await asyncio.wait_for(websocket.receive_text(), timeout=300.0)
+            except asyncio.TimeoutError:
+                # One heartbeat for all sessions on this socket
+                await send_json({"type": "heartbeat", "timestamp": datetime.now().isoformat()})
+                continue
+            try:
+                message = json.loads(data)
+                message_type = message.get("type")
+                if message_type == "ping":
+                    await send_json({"type": "pong", "timestamp": datetime.now().isoformat()})
+                elif message_type == "open":
+                    await open_channel(message)
+                else:
+                    channel = channels.get(message.get("channel"))
+                    if channel is None:
+                        await send_json({"type": "error", "message": f"Unknown channel: {message.get('channel')}"})
+                    elif message_type == "credit":
+                        channel.grant(int(message.get("bytes", 0)))
+                    elif message_type == "close":
+                        await close_channel(channel, bool(message.get("terminate")))
+                        await send_json({"type": "closed", "channel": channel.id})
+                    elif not await handle_terminal_message(channel.session, channel.outbox, message):
+                        await send_json({"type": "error", "channel": channel.id,
+                                         "message": f"Unknown message type: {message_type}"})
+            except (json.JSONDecodeError, AttributeError):
+                await send_json({"type": "error", "message": "Invalid JSON message received"})
+            except (KeyError, ValueError, TypeError) as e:
+                await send_json({"type": "error", "message": f"Invalid message: {str(e)}"})
+    except WebSocketDisconnect:
+        logger.info("Multiplexed terminal WebSocket disconnected")
+    except Exception as e:
+        logger.error(f"Multiplexed terminal WebSocket error: {e}")
+    finally:
+        manager.disconnect(websocket)
+        for channel in list(channels.values()):
+            await close_channel(channel)
+
+# One-shot commands run as asyncio subprocesses: no pool thread is held while
+# they run, output can be streamed as it arrives, and the process group is
+# killed on timeout or when a streaming client goes away.
+COMMAND_TIMEOUT = float(os.getenv("COMMAND_TIMEOUT", "30"))
+COMMAND_MAX_TIMEOUT = float(os.getenv("COMMAND_MAX_TIMEOUT", "600"))
+COMMAND_MAX_OUTPUT = int(os.getenv("COMMAND_MAX_OUTPUT", str(10 * 1024 * 1024)))  # characters per stream, buffered responses only
+
+def _kill_process_tree(process):
+    try:
+        if platform.system() == "Windows":
+            process.kill()
+        else:
+            # Started in its own session, so this reaches whatever the shell spawned
+            os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+async def run_shell_command(command: str, timeout: float):
+    """Run a shell command, yielding stdout/stderr chunks as they arrive, then how it ended"""
+    loop = asyncio.get_running_loop()
+    started = time.monotonic()
+    deadline = loop.time() + timeout
+    process = await asyncio.create_subprocess_shell(
+        command,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        **({} if platform.system() == "Windows" else {"start_new_session": True})
+    )
+    # Bounded, so a slow reader stops the pumps and the command blocks on its pipe
+    chunks = asyncio.Queue(maxsize=16)
+    
+    async def pump(stream, name: str):
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        while True:
+            data = await stream.read(65536)
+            text = decoder.decode(data, final=not data)
+            if text:
+                await chunks.put({"type": name, "data": text})
+            if not data:
+                break
+        await chunks.put(None)
+    
+    pumps = [asyncio.create_task(pump(process.stdout, "stdout")), asyncio.create_task(pump(process.stderr, "stderr"))]
+    try:
+        open_streams = len(pumps)
+        while open_streams:
+            chunk = await asyncio.wait_for(chunks.get(), deadline - loop.time())
+            if chunk is None:
+                open_streams -= 1
+                continue
+            yield chunk
+        # Both pipes are closed; the shell has exited or is about to
+        exit_code = await asyncio.wait_for(process.wait(), max(0.1, deadline - loop.time()))
+        yield {"type": "exit", "code": exit_code, "duration_ms": round((time.monotonic() - started) * 1000, 1)}
+    except asyncio.TimeoutError:
+        logger.error(f"HTTP command timed out: {command}")
+        yield {"type": "timeout", "timeout": timeout, "duration_ms": round((time.monotonic() - started) * 1000, 1)}
+    finally:
+        # Also reached when a streaming client disconnects and the generator is closed
+        for task in pumps:
+            task.cancel()
+        if process.returncode is None:
+            _kill_process_tree(process)
+
+@app.post("/api/system/command", response_model=CommandResponse)
+async def execute_command(command_request: CommandRequest, token: str = Depends(verify_token)):
+    """Run a shell command; with "stream": true the output is sent as NDJSON while it runs"""
+    try:
+        logger.info(f"HTTP command execution: {command_request.command}")
+        
+        # Simple security check for HTTP endpoint
+        dangerous_commands = ['rm -rf', 'shutdown', 'reboot', 'halt', 'poweroff', 'format', 'mkfs', 'dd if=/dev/zero']
+        command_lower = command_request.command.lower()
+        if any(cmd in command_lower for cmd in dangerous_commands):
+            logger.warning(f"Dangerous HTTP command rejected: {command_request.command}")
+            raise HTTPException(status_code=403, detail="Potentially dangerous command rejected")
+        
+        timeout = max(0.1, min(command_request.timeout or COMMAND_TIMEOUT, COMMAND_MAX_TIMEOUT))
+        events = run_shell_command(command_request.command, timeout)
+        
+        if command_request.stream:
+            async def ndjson():
+                async for event in events:
+                    yield json.dumps(event) + "\n"
+            return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+        
+        output = {"stdout": [], "stderr": []}
+        size = {"stdout": 0, "stderr": 0}
+        truncated = False
+        async for event in events:
+            if event["type"] == "timeout":
+                raise HTTPException(status_code=408, detail="Command execution timed out")
+            if event["type"] == "exit":
+                exit_code = event["code"]
+                continue
+            # Keep draining past the limit so the command isn't blocked on a full pipe
+            data = event["data"]
+            remaining = COMMAND_MAX_OUTPUT - size[event["type"]]
+            if len(data) > remaining:
+                truncated = True
+                data = data[:max(0, remaining)]
+            if data:
+                output[event["type"]].append(data)
+                size[event["type"]] += len(data)
+        
+        logger.info(f"HTTP command completed with exit code: {exit_code}")
+        error = "".join(output["stderr"])
+        if truncated:
+            error += f"\n[output truncated at {COMMAND_MAX_OUTPUT} characters]"
+        return {
+            "output": "".join(output["stdout"]),
+            "error": error,
+            "exit_code": exit_code
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"HTTP command execution failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# ============================================================================
+# Directory Listing
+# ============================================================================
+# Huge directories are scanned once (names and d_type only, no stat) into a
+# sorted order that is cached per path; pages are then sliced out of that
+# order and only the entries on the page are stat'ed. Cursors carry the sort
+# key of the last entry returned, so paging stays correct if files are added
+# or removed between requests.
+
+DIRECTORY_ORDER_TTL = float(os.getenv("DIRECTORY_ORDER_TTL", "10"))
+DIRECTORY_ORDER_CACHE_SIZE = int(os.getenv("DIRECTORY_ORDER_CACHE_SIZE", "64"))
+DIRECTORY_PAGE_MAX = int(os.getenv("DIRECTORY_PAGE_MAX", "5000"))
+DIRECTORY_STREAM_BATCH = 1000
+
+# abs_path -> (created_at, directory mtime_ns, sorted [(not is_dir, name.lower(), name)])
+directory_order_cache: "OrderedDict[str, tuple]" = OrderedDict()
+directory_order_lock = threading.Lock()
+# Bumped on every invalidation so a scan racing with a change isn't cached
+directory_generation: Dict[str, int] = {}
+
+def load_directory_order(abs_path: str) -> List[tuple]:
+    """Sorted sort keys for a directory (directories first, then by name)"""
+    with directory_order_lock:
+        cached = directory_order_cache.get(abs_path)
+        generation = directory_generation.get(abs_path, 0)
+    # Watched directories are kept current by inotify and never expire
+    if cached and directory_watcher.is_watching(abs_path):
+        with directory_order_lock:
+            directory_order_cache.move_to_end(abs_path)
+        return cached[2]
+    mtime_ns = os.stat(abs_path).st_mtime_ns
+    if cached and time.time() - cached[0] < DIRECTORY_ORDER_TTL and cached[1] == mtime_ns:
+        with directory_order_lock:
+            directory_order_cache.move_to_end(abs_path)
+        return cached[2]
+    
+    order = []
+    with os.scandir(abs_path) as entries:
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            order.append((not is_dir, entry.name.lower(), entry.name))
+    order.sort()
+    
+    with directory_order_lock:
+        if directory_generation.get(abs_path, 0) != generation:
+            return order
+        directory_order_cache[abs_path] = (time.time(), mtime_ns, order)
+        directory_order_cache.move_to_end(abs_path)
+        while len(directory_order_cache) > DIRECTORY_ORDER_CACHE_SIZE:
+            directory_order_cache.popitem(last=False)
+    return order
+
+def invalidate_directory_cache(abs_path: str):
+    with directory_order_lock:
+        directory_order_cache.pop(abs_path, None)
+        directory_generation[abs_path] = directory_generation.get(abs_path, 0) + 1
+    system_cache.pop(f"dir_list_{hashlib.md5(abs_path.encode()).hexdigest()}", None)
+
+def patch_directory_order(abs_path: str, name: str, added: bool):
+    """Apply a single create/delete to a cached order instead of rescanning"""
+    # Keyed like the scan, which follows symlinks (is_dir()); the inotify mask does not
+    is_dir = added and os.path.isdir(os.path.join(abs_path, name))
+    with directory_order_lock:
+        directory_generation[abs_path] = directory_generation.get(abs_path, 0) + 1
+        cached = directory_order_cache.get(abs_path)
+        if cached is not None:
+            order = cached[2]
+            # Drop the name under either key first: a rename can replace a file with a directory
+            # and a deleted entry can no longer be stat'ed
+            for key in ((False, name.lower(), name), (True, name.lower(), name)):
+                position = bisect.bisect_left(order, key)
+                if position < len(order) and order[position] == key:
+                    del order[position]
+            if added:
+                key = (not is_dir, name.lower(), name)
+                order.insert(bisect.bisect_left(order, key), key)
+    system_cache.pop(f"dir_list_{hashlib.md5(abs_path.encode()).hexdigest()}", None)
+
+def encode_directory_cursor(key: tuple) -> str:
+    return base64.urlsafe_b64encode(json.dumps([not key[0], key[2]]).encode()).decode()
+
+def decode_directory_cursor(cursor: str) -> tuple:
+    try:
+        is_dir, name = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return (not is_dir, name.lower(), name)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def mode_access(stats: os.stat_result, is_dir: bool, groups: set) -> tuple:
+    """(readable, writable, executable) for this process, from st_mode alone"""
+    mode = stats.st_mode
+    if not hasattr(os, "geteuid"):
+        return True, bool(mode & 0o200), bool(mode & 0o100)
+    uid = os.geteuid()
+    if uid == 0:
+        return True, True, is_dir or bool(mode & 0o111)
+    if stats.st_uid == uid:
+        bits = mode >> 6
+    elif stats.st_gid in groups:
+        bits = mode >> 3
+    else:
+        bits = mode
+    return bool(bits & 4), bool(bits & 2), bool(bits & 1)
+
+def describe_directory_entries(abs_path: str, path: str, keys: List[tuple], names_only: bool) -> List[dict]:
+    """Listing items for the given sort keys; stats them unless names_only"""
+    groups = set(os.getgroups()) | {os.getegid()} if hasattr(os, "getegid") else set()
+    items = []
+    for not_dir, _, name in keys:
+        is_dir = not not_dir
+        item = {
+            "name": name,
+            "path": os.path.join(path, name),
+            "is_directory": is_dir,
+            "is_hidden": name.startswith('.')
+        }
+        if not names_only:
+            try:
+                stats = os.stat(os.path.join(abs_path, name))
+            except OSError as e:
+                # Log but continue with other files
+                logger.debug(f"Cannot access {os.path.join(abs_path, name)}: {e}")
+                continue
+            readable, writable, executable = mode_access(stats, is_dir, groups)
+            item.update({
+                "size": None if is_dir else stats.st_size,
+                "modified": datetime.fromtimestamp(stats.st_mtime).isoformat(),
+                "permissions": oct(stats.st_mode)[-3:],
+                "readable": readable,
+                "writable": writable,
+                "executable": executable
+            })
+            if getattr(stats, "st_file_attributes", 0) & 2:
+                item["is_hidden"] = True
+        items.append(item)
+    return items
+
+# Directories viewed recently are watched with inotify so their cached order
+# and listing stay valid until something actually changes, instead of being
+# rescanned every DIRECTORY_ORDER_TTL seconds. The watch set is an LRU
+# bounded by DIRECTORY_WATCH_MAX; evicted directories fall back to the TTL.
+DIRECTORY_WATCH_ENABLED = os.getenv("DIRECTORY_WATCH_ENABLED", "true").lower() == "true"
+DIRECTORY_WATCH_MAX = int(os.getenv("DIRECTORY_WATCH_MAX", "256"))
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct("iIII")
+DIRECTORY_WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+                        | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+class InotifyWatcher:
+    """inotify watches on a set of directories (Linux only).
+
+    Subclasses react to events through on_change / on_forgotten / on_overflow.
+    With evict=True the watch set is an LRU capped at max_watches; otherwise
+    watch() refuses new directories once the cap is reached.
+    """
+
+    def __init__(self, max_watches: int, mask: int, enabled: bool = True, evict: bool = True):
+        self.max_watches = max_watches
+        self.mask = mask
+        self.evict = evict
+        self.fd: Optional[int] = None
+        self.available = enabled and platform.system() == "Linux"
+        self.watches: "OrderedDict[str, int]" = OrderedDict()
+        self.paths: Dict[int, str] = {}
+        self.events = 0
+        self.evictions = 0
+        self._libc = None
+        self._loop = None
+
+    def _open(self) -> bool:
+        try:
+            self._libc = ctypes.CDLL(None, use_errno=True)
+            fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        except (OSError, AttributeError) as e:
+            logger.warning(f"inotify unavailable for {self.__class__.__name__}: {e}")
+            self.available = False
+            return False
+        self.fd = fd
+        self._loop = asyncio.get_running_loop()
+        self._loop.add_reader(fd, self._on_readable)
+        return True
+
+    def is_watching(self, abs_path: str) -> bool:
+        return abs_path in self.watches
+
+    def watch(self, abs_path: str) -> bool:
+        """Watch a directory (or refresh its LRU position); call from the event loop"""
+        if not self.available:
+            return False
+        if abs_path in self.watches:
+            self.watches.move_to_end(abs_path)
+            return True
+        if not self.evict and len(self.watches) >= self.max_watches:
+            return False
+        if self.fd is None and not self._open():
+            return False
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(abs_path), self.mask)
+        if wd < 0:
+            logger.debug(f"Cannot watch {abs_path}: {os.strerror(ctypes.get_errno())}")
+            return False
+        self.on_watched(abs_path)
+        self.watches[abs_path] = wd
+        self.paths[wd] = abs_path
+        while len(self.watches) > self.max_watches:
+            evicted, evicted_wd = self.watches.popitem(last=False)
+            self.paths.pop(evicted_wd, None)
+            self._libc.inotify_rm_watch(self.fd, evicted_wd)
+            self.evictions += 1
+        return True
+
+    def _forget(self, wd: int):
+        abs_path = self.paths.pop(wd, None)
+        if abs_path is not None:
+            self.watches.pop(abs_path, None)
+            self.on_forgotten(abs_path)
+
+    def _on_readable(self):
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset + INOTIFY_EVENT.size <= len(data):
+            wd, mask, _, name_length = INOTIFY_EVENT.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + name_length].rstrip(b"\0"))
+            offset += INOTIFY_EVENT.size + name_length
+            self.events += 1
+            if mask & IN_Q_OVERFLOW:
+                self.on_overflow()
+                continue
+            if mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+                self._forget(wd)
+                continue
+            abs_path = self.paths.get(wd)
+            if abs_path is not None:
+                self.on_change(abs_path, mask, name)
+
+    def on_watched(self, abs_path: str):
+        pass
+
+    def on_forgotten(self, abs_path: str):
+        pass
+
+    def on_overflow(self):
+        pass
+
+    def on_change(self, abs_path: str, mask: int, name: str):
+        pass
+
+    def stats(self) -> dict:
+        return {
+            "available": self.available,
+            "watched": len(self.watches),
+            "max_watches": self.max_watches,
+            "events": self.events,
+            "evictions": self.evictions
+        }
+
+    def close(self):
+        if self.fd is not None:
+            self._loop.remove_reader(self.fd)
+            os.close(self.fd)
+            self.fd = None
+        self.watches.clear()
+        self.paths.clear()
+
+class DirectoryWatcher(InotifyWatcher):
+    """Keeps cached listings of recently listed directories current"""
+
+    def __init__(self):
+        super().__init__(DIRECTORY_WATCH_MAX, DIRECTORY_WATCH_MASK, enabled=DIRECTORY_WATCH_ENABLED)
+
+    def on_watched(self, abs_path: str):
+        # Changes between the scan and the watch going live would be missed
+        invalidate_directory_cache(abs_path)
+
+    def on_forgotten(self, abs_path: str):
+        invalidate_directory_cache(abs_path)
+
+    def on_overflow(self):
+        # Events were lost; nothing we cached can be trusted
+        for abs_path in list(self.watches):
+            invalidate_directory_cache(abs_path)
+
+    def on_change(self, abs_path: str, mask: int, name: str):
+        if name and mask & (IN_CREATE | IN_MOVED_TO):
+            patch_directory_order(abs_path, name, added=True)
+        elif name and mask & (IN_DELETE | IN_MOVED_FROM):
+            patch_directory_order(abs_path, name, added=False)
+        else:
+            # Size/mtime/mode of a child changed; the order is still right
+            system_cache.pop(f"dir_list_{hashlib.md5(abs_path.encode()).hexdigest()}", None)
+
+directory_watcher = DirectoryWatcher()
+
+@app.on_event("shutdown")
+async def close_directory_watcher():
+    directory_watcher.close()
+
+# Optimized file operations with async support
+@app.get("/api/files/list")
+async def list_directory(path: str = ".", cursor: Optional[str] = None, limit: Optional[int] = None,
+                         stream: bool = False, names_only: bool = False,
+                         token: str = Depends(verify_token)):
+    """List a directory.
+
+    Without `cursor`/`limit`/`stream` the whole directory is returned as before.
+    With `limit`, a page is returned along with `next_cursor` to fetch the next
+    one; `stream=true` sends NDJSON records (header, items, end) instead of one
+    JSON document. `names_only=true` skips stat() for a much cheaper listing.
+    """
+    try:
+        # Handle root path and system drives
+        if path == "." or path == "/" or path == "\\" or path == "System Drives":
+            # List system drives on Windows
+            if platform.system() == "Windows":
+                import string
+                drives = []
+                for letter in string.ascii_uppercase:
+                    drive = f"{letter}:\\"
+                    if os.path.exists(drive):
+                        try:
+                            # Use psutil.disk_usage for cross-platform disk space info
+                            disk_usage = psutil.disk_usage(drive)
+                            drives.append({
+                                "name": f"{letter}:",
+                                "path": drive,
+                                "is_directory": True,
+                                "size": None,
+                                "modified": datetime.now().isoformat(),
+                                "is_drive": True,
+                                "free_space": disk_usage.free,
+                                "total_space": disk_usage.total
+                            })
+                        except (PermissionError, OSError):
+                            continue
+                return {
+                    "path": "System Drives",
+                    "items": drives,
+                    "is_root": True
+                }
+            else:
+                # On Unix systems, start from root
+                path = "/"
+        
+        # Convert to absolute path if relative
+        abs_path = os.path.abspath(path)
+        
+        # Security check - prevent access to system critical directories
+        sensitive_paths = [
+            "/System", "/Library", "/usr", "/bin", "/sbin", "/etc", "/var", "/tmp",
+            "C:\\Windows", "C:\\System32", "C:\\Program Files", "C:\\Program Files (x86)"
+        ]
+        
+        for sensitive in sensitive_paths:
+            if abs_path.startswith(sensitive):
+                logger.warning(f"Access attempt to sensitive path: {abs_path}")
+                raise HTTPException(status_code=403, detail="Access to system directories is restricted for security")
+        
+        if not os.path.exists(abs_path):
+            raise HTTPException(status_code=404, detail=f"Path not found: {path}")
+        
+        if not os.path.isdir(abs_path):
+            raise HTTPException(status_code=400, detail=f"Not a directory: {path}")
+        
+        paginated = cursor is not None or limit is not None or stream
+        parent_path = os.path.dirname(path) if path not in [".", "/", "\\"] else None
+        
+        # Cache key for directory listing
+        cache_key = f"dir_list_{hashlib.md5(abs_path.encode()).hexdigest()}"
+        # Watch before scanning so changes made during the scan are not lost
+        directory_watcher.watch(abs_path)
+        generation = directory_generation.get(abs_path, 0)
+        if not paginated and not names_only:
+            # 10 second cache for directory listings, unbounded while inotify watches the directory
+            ttl = 10 if not directory_watcher.is_watching(abs_path) else float("inf")
+            cached = await get_cached_data(cache_key, ttl)
+            if cached:
+                return cached
+        
+        loop = asyncio.get_event_loop()
+        try:
+            order = await loop.run_in_executor(filesystem_executor, load_directory_order, abs_path)
+        except PermissionError as e:
+            logger.error(f"Permission denied accessing directory {abs_path}: {e}")
+            raise HTTPException(status_code=403, detail="Permission denied accessing directory")
+        
+        start = bisect.bisect_right(order, decode_directory_cursor(cursor)) if cursor else 0
+        if limit is not None:
+            limit = max(1, min(limit, DIRECTORY_PAGE_MAX if not stream else len(order)))
+            stop = min(start + limit, len(order))
+        else:
+            stop = len(order)
+        next_cursor = encode_directory_cursor(order[stop - 1]) if start < stop < len(order) else None
+        
+        if stream:
+            async def ndjson():
+                yield json.dumps({"type": "header", "path": path, "parent_path": parent_path, "total": len(order)}) + "\n"
+                for offset in range(start, stop, DIRECTORY_STREAM_BATCH):
+                    keys = order[offset:min(offset + DIRECTORY_STREAM_BATCH, stop)]
+                    items = await loop.run_in_executor(filesystem_executor, describe_directory_entries,
+                                                       abs_path, path, keys, names_only)
+                    yield "".join(json.dumps({"type": "item", **item}) + "\n" for item in items)
+                yield json.dumps({"type": "end", "next_cursor": next_cursor}) + "\n"
+            return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+        
+        items = await loop.run_in_executor(filesystem_executor, describe_directory_entries,
+                                           abs_path, path, order[start:stop], names_only)
+        result = {
+            "path": path,
+            "items": items,
+            "parent_path": parent_path
+        }
+        if paginated:
+            result.update({"total": len(order), "next_cursor": next_cursor})
+        elif not names_only and directory_generation.get(abs_path, 0) == generation:
+            await set_cached_data(cache_key, result)
+        return result
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error listing directory {path}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/files/content")
+async def get_file_content(path: str, token: str = Depends(verify_token)):
+    try:
+        abs_path = os.path.abspath(path)
+        if not os.path.exists(abs_path):
+            raise HTTPException(status_code=404, detail=f"File not found: {path}")
+        
+        if os.path.isdir(abs_path):
+            raise HTTPException(status_code=400, detail=f"Path is a directory: {path}")
+        
+        # Check file size to prevent loading huge files
+        file_size = os.path.getsize(abs_path)
+        if file_size > 10 * 1024 * 1024:  # 10MB limit
+            raise HTTPException(status_code=413, detail="File too large to display")
+        
+        # Check if it's likely a binary file based on extension and MIME type
+        mime_type = get_file_mime_type(abs_path)
+        file_extension = os.path.splitext(abs_path)[1].lower()
+        
+        # List of known binary file extensions
+        binary_extensions = {
+            '.exe', '.dll', '.so', '.dylib', '.bin', '.dat', '.db', '.sqlite', 
+            '.sqlite3', '.zip', '.rar', '.7z', '.tar', '.gz', '.bz2', '.xz',
+            '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.ico', '.svg',
+            '.mp3', '.mp4', '.avi', '.mov', '.wmv', '.flv', '.mkv', '.wav',
+            '.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx',
+            '.msi', '.pkg', '.deb', '.rpm', '.app', '.dmg'
+        }
+        
+        # Check if it's a known binary file
+        if file_extension in binary_extensions or not mime_type.startswith('text/'):
+            return {"content": None, "is_binary": True, "mime_type": mime_type}
+        
+        # Try to read as text, but handle binary files gracefully
+        try:
+            async with aiofiles.open(abs_path, 'r', encoding='utf-8') as f:
+                content = await f.read()
+            return {"content": content, "is_binary": False, "mime_type": mime_type}
+        except UnicodeDecodeError:
+            # It's a binary file that wasn't detected by extension/MIME type
+            return {"content": None, "is_binary": True, "mime_type": mime_type}
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Error reading file content for {path}: {e}")
+            raise HTTPException(status_code=500, detail=f"Error reading file content: {str(e)}")
+            
+    except HTTPException:
+        # Re-raise HTTP exceptions as-is
+        raise
+    except Exception as e:
+        logger.error(f"Error reading file {path}: {e}")
+        raise HTTPException(status_code=500, detail=f"Error reading file: {str(e)}")
+
+@app.post("/api/files/update")
+async def update_file_content(file_update: FileUpdateRequest, token: str = Depends(verify_token)):
+    try:
+        abs_path = os.path.abspath(file_update.path)
+        
+        # Security check - prevent updates to system directories
+        sensitive_paths = [
+            "/System", "/Library", "/usr", "/bin", "/sbin", "/etc", "/var", "/tmp",
+            "C:\\Windows", "C:\\System32", "C:\\Program Files", "C:\\Program Files (x86)"
+        ]
+        
+        for sensitive in sensitive_paths:
+            if abs_path.startswith(sensitive):
+                logger.warning(f"Update attempt to sensitive path: {abs_path}")
+                raise HTTPException(status_code=403, detail="Updates to system directories are restricted for security")
+        
+        # Create parent directories if they don't exist
+        parent_dir = os.path.dirname(abs_path)
+        if parent_dir and not os.path.exists(parent_dir):
+            try:
+                os.makedirs(parent_dir, exist_ok=True)
+            except PermissionError:
+                raise HTTPException(status_code=403, detail="Permission denied creating directory")
+        
+        # Check if we have write permission
+        if os.path.exists(abs_path) and not os.access(abs_path, os.W_OK):
+            raise HTTPException(status_code=403, detail="Permission denied writing to file")
+        
+        async with aiofiles.open(abs_path, 'w', encoding='utf-8') as f:
+            await f.write(file_update.content)
+        
+        # Clear directory cache for the parent directory
+        invalidate_directory_cache(parent_dir)
+        
+        logger.info(f"File updated: {file_update.path}")
+        return {"success": True, "message": f"File updated: {file_update.path}"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error updating file {file_update.path}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/files/download")
+async def download_file(path: str, token: str = Depends(verify_token)):
+    try:
+        abs_path = os.path.abspath(path)
+        if not os.path.exists(abs_path):
+            raise HTTPException(status_code=404, detail=f"File not found: {path}")
+        
+        if os.path.isdir(abs_path):
+            raise HTTPException(status_code=400, detail=f"Path is a directory: {path}")
+        
+        # Security check - prevent downloads from system directories
+        sensitive_paths = [
+            "/System", "/Library", "/usr", "/bin", "/sbin", "/etc", "/var", "/tmp",
+            "C:\\Windows", "C:\\System32", "C:\\Program Files", "C:\\Program Files (x86)"
+        ]
+        
+        for sensitive in sensitive_paths:
+            if abs_path.startswith(sensitive):
+                logger.warning(f"Download attempt from sensitive path: {abs_path}")
+                raise HTTPException(status_code=403, detail="Downloads from system directories are restricted for security")
+        
+        # Get MIME type for proper content type
+        mime_type = get_file_mime_type(abs_path)
+        filename = os.path.basename(abs_path)
+        
+        logger.info(f"File download requested: {path}")
+        return FileResponse(
+            abs_path, 
+            filename=filename,
+            media_type=mime_type
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error downloading file {path}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/files/upload")
+async def upload_file(path: str, file: UploadFile = File(...), token: str = Depends(verify_token)):
+    try:
+        abs_path = os.path.abspath(path)
+        
+        # Security check - prevent uploads to system directories
+        sensitive_paths = [
+            "/System", "/Library", "/usr", "/bin", "/sbin", "/etc", "/var", "/tmp",
+            "C:\\Windows", "C:\\System32", "C:\\Program Files", "C:\\Program Files (x86)"
+        ]
+        
+        for sensitive in sensitive_paths:
+            if abs_path.startswith(sensitive):
+                logger.warning(f"Upload attempt to sensitive path: {abs_path}")
+                raise HTTPException(status_code=403, detail="Upload to system directories is restricted for security")
+        
+        # Create parent directories if they don't exist
+        parent_dir = os.path.dirname(abs_path)
+        if parent_dir and not os.path.exists(parent_dir):
+            try:
+                os.makedirs(parent_dir, exist_ok=True)
+            except PermissionError:
+                raise HTTPException(status_code=403, detail="Permission denied creating directory")
+        
+        # Check if we have write permission
+        if os.path.exists(abs_path) and not os.access(abs_path, os.W_OK):
+            raise HTTPException(status_code=403, detail="Permission denied writing to file")
+        
+        # Use aiofiles for async file writing
+        async with aiofiles.open(abs_path, "wb") as buffer:
+            content = await file.read()
+            await buffer.write(content)
+        
+        # Clear directory cache for the parent directory
+        invalidate_directory_cache(parent_dir)
+        
+        logger.info(f"File uploaded: {path}")
+        return {"success": True, "message": f"File uploaded to: {path}"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error uploading file to {path}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/files/create-directory")
+async def create_directory(request: CreateDirectoryRequest, token: str = Depends(verify_token)):
+    """Create a new directory"""
+    try:
+        abs_path = os.path.abspath(request.path)
+        
+        # Security check - prevent creation in system directories
+        sensitive_paths = [
+            "/System", "/Library", "/usr", "/bin", "/sbin", "/etc", "/var", "/tmp",
+            "C:\\Windows", "C:\\System32", "C:\\Program Files", "C:\\Program Files (x86)"
+        ]
+        
+        for sensitive in sensitive_paths:
+            if abs_path.startswith(sensitive):
+                logger.warning(f"Directory creation attempt in sensitive path: {abs_path}")
+                raise HTTPException(status_code=403, detail="Creation in system directories is restricted for security")
+        
+        # Create parent directories if they don't exist
+        parent_dir = os.path.dirname(abs_path)
+        if parent_dir and not os.path.exists(parent_dir):
+            try:
+                os.makedirs(parent_dir, exist_ok=True)
+            except PermissionError:
+                raise HTTPException(status_code=403, detail="Permission denied creating parent directory")
+        
+        # Create the directory
+        try:
+            os.makedirs(abs_path, exist_ok=True)
+        except PermissionError:
+            raise HTTPException(status_code=403, detail="Permission denied creating directory")
+        
+        # Clear directory cache for the parent directory
+        invalidate_directory_cache(parent_dir)
+        
+        logger.info(f"Directory created: {request.path}")
+        return {"success": True, "message": f"Directory created: {request.path}"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error creating directory {request.path}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.delete("/api/files/delete")
+async def delete_file_or_directory(path: str, token: str = Depends(verify_token)):
+    """Delete a file or directory"""
+    try:
+        abs_path = os.path.abspath(path)
+        
+        # Security check - prevent deletion in system directories
+        sensitive_paths = [
+            "/System", "/Library", "/usr", "/bin", "/sbin", "/etc", "/var", "/tmp",
+            "C:\\Windows", "C:\\System32", "C:\\Program Files", "C:\\Program Files (x86)"
+        ]
+        
+        for sensitive in sensitive_paths:
+            if abs_path.startswith(sensitive):
+                logger.warning(f"Deletion attempt in sensitive path: {abs_path}")
+                raise HTTPException(status_code=403, detail="Deletion in system directories is restricted for security")
+        
+        if not os.path.exists(abs_path):
+            raise HTTPException(status_code=404, detail="File or directory not found")
+        
+        # Check permissions
+        if not os.access(abs_path, os.W_OK):
+            raise HTTPException(status_code=403, detail="Permission denied deleting file/directory")
+        
+        # Delete file or directory
+        try:
+            if os.path.isdir(abs_path):
+                shutil.rmtree(abs_path)
+            else:
+                os.remove(abs_path)
+        except PermissionError:
+            raise HTTPException(status_code=403, detail="Permission denied deleting file/directory")
+        
+        # Clear directory cache for the parent directory
+        parent_dir = os.path.dirname(abs_path)
+        invalidate_directory_cache(parent_dir)
+        
+        logger.info(f"Deleted: {path}")
+        return {"success": True, "message": f"Deleted: {path}"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error deleting {path}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/files/binary-info")
+async def get_binary_file_info(path: str, token: str = Depends(verify_token)):
+    """Get information about a binary file for display"""
+    try:
+        abs_path = os.path.abspath(path)
+        if not os.path.exists(abs_path):
+            raise HTTPException(status_code=404, detail=f"File not found: {path}")
+        
+        if os.path.isdir(abs_path):
+            raise HTTPException(status_code=400, detail=f"Path is a directory: {path}")
+        
+        # Get file stats
+        stats = os.stat(abs_path)
+        mime_type = get_file_mime_type(abs_path)
+        
+        # Determine file type category
+        file_category = "unknown"
+        if mime_type.startswith('image/'):
+            file_category = "image"
+        elif mime_type.startswith('video/'):
+            file_category = "video"
+        elif mime_type.startswith('audio/'):
+            file_category = "audio"
+        elif mime_type == 'application/pdf':
+            file_category = "pdf"
+        elif mime_type.startswith('text/'):
+            file_category = "text"
+        
+        return {
+            "path": path,
+            "name": os.path.basename(abs_path),
+            "size": stats.st_size,
+            "mime_type": mime_type,
+            "file_category": file_category,
+            "modified": datetime.fromtimestamp(stats.st_mtime).isoformat(),
+            "readable": os.access(abs_path, os.R_OK)
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting binary file info {path}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/files/create-share-link", response_model=ShareableLinkResponse)
+async def create_shareable_link(request: ShareableLinkRequest, token: str = Depends(verify_token)):
+    """Create a shareable link for a file with expiry"""
+    try:
+        abs_path = os.path.abspath(request.path)
+        if not os.path.exists(abs_path):
+            raise HTTPException(status_code=404, detail=f"File not found: {request.path}")
+        
+        if os.path.isdir(abs_path):
+            raise HTTPException(status_code=400, detail=f"Cannot create shareable link for directory: {request.path}")
+        
+        # Security check - prevent sharing from system directories
+        sensitive_paths = [
+            "/System", "/Library", "/usr", "/bin", "/sbin", "/etc", "/var", "/tmp",
+            "C:\\Windows", "C:\\System32", "C:\\Program Files", "C:\\Program Files (x86)"
+        ]
+        
+        for sensitive in sensitive_paths:
+            if abs_path.startswith(sensitive):
+                logger.warning(f"Share link creation attempt for sensitive path: {abs_path}")
+                raise HTTPException(status_code=403, detail="Cannot create shareable links for system files")
         
         # Generate shareable link
         link_data = generate_shareable_link(request.path, request.expires_in)
         
-        logger.info(f"Created shareable link for {request.path}: {link_data['link_id']}")
-        return ShareableLinkResponse(**link_data)
+        logger.info(f"Created shareable link for {request.path}: {link_data['link_id']}")
+        return ShareableLinkResponse(**link_data)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error creating shareable link for {request.path}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/files/share/{link_id}")
+async def access_shareable_link(link_id: str):
+    """Access a file through a shareable link"""
+    try:
+        # Check if link exists and is not expired
+        if link_id not in shareable_links:
+            raise HTTPException(status_code=404, detail="Shareable link not found or expired")
+        
+        link_data = shareable_links[link_id]
+        if link_data["expires_at"] < datetime.now():
+            # Remove expired link
+            del shareable_links[link_id]
+            raise HTTPException(status_code=410, detail="Shareable link has expired")
+        
+        file_path = link_data["file_path"]
+        abs_path = os.path.abspath(file_path)
+        
+        if not os.path.exists(abs_path):
+            raise HTTPException(status_code=404, detail="File not found")
+        
+        if os.path.isdir(abs_path):
+            raise HTTPException(status_code=400, detail="Cannot access directory through shareable link")
+        
+        # Return file for download/streaming
+        mime_type = get_file_mime_type(abs_path)
+        filename = os.path.basename(abs_path)
+        
+        return FileResponse(
+            abs_path,
+            filename=filename,
+            media_type=mime_type
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error accessing shareable link {link_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/files/stream")
+async def stream_file(path: str, token: str = None):
+    """Stream a file directly (for media files)"""
+    # For streaming, accept token as query parameter for browser compatibility
+    if token != "valid-token":
+        raise HTTPException(status_code=403, detail="Invalid token")
+    try:
+        abs_path = os.path.abspath(path)
+        if not os.path.exists(abs_path):
+            raise HTTPException(status_code=404, detail=f"File not found: {path}")
+        
+        if os.path.isdir(abs_path):
+            raise HTTPException(status_code=400, detail=f"Cannot stream directory: {path}")
+        
+        # Get MIME type
+        mime_type = get_file_mime_type(abs_path)
+        
+        # For media files, return streaming response with proper headers
+        if mime_type.startswith(('video/', 'audio/', 'image/')):
+            return FileResponse(
+                abs_path,
+                media_type=mime_type,
+                headers={
+                    "Accept-Ranges": "bytes",
+                    "Cache-Control": "public, max-age=3600",
+                    "Access-Control-Allow-Origin": "*"
+                }
+            )
+        else:
+            # For other files, return as download
+            filename = os.path.basename(abs_path)
+            return FileResponse(
+                abs_path,
+                filename=filename,
+                media_type=mime_type
+            )
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error creating shareable link for {request.path}: {e}")
+        logger.error(f"Error streaming file {path}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/files/stream/{link_id}")
+async def stream_shareable_file(link_id: str):
+    """Stream a file through a shareable link (for media files)"""
+    try:
+        # Check if link exists and is not expired
+        if link_id not in shareable_links:
+            raise HTTPException(status_code=404, detail="Shareable link not found or expired")
+        
+        link_data = shareable_links[link_id]
+        if link_data["expires_at"] < datetime.now():
+            # Remove expired link
+            del shareable_links[link_id]
+            raise HTTPException(status_code=410, detail="Shareable link has expired")
+        
+        file_path = link_data["file_path"]
+        abs_path = os.path.abspath(file_path)
+        
+        if not os.path.exists(abs_path):
+            raise HTTPException(status_code=404, detail="File not found")
+        
+        if os.path.isdir(abs_path):
+            raise HTTPException(status_code=400, detail="Cannot stream directory")
+        
+        # Get MIME type
+        mime_type = get_file_mime_type(abs_path)
+        
+        # For media files, return streaming response
+        if mime_type.startswith(('video/', 'audio/', 'image/')):
+            return FileResponse(
+                abs_path,
+                media_type=mime_type,
+                headers={"Accept-Ranges": "bytes"}
+            )
+        else:
+            # For other files, return as download
+            filename = os.path.basename(abs_path)
+            return FileResponse(
+                abs_path,
+                filename=filename,
+                media_type=mime_type
+            )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error streaming shareable file {link_id}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/files/share/{link_id}")
-async def access_shareable_link(link_id: str):
-    """Access a file through a shareable link"""
-    try:
-        # Check if link exists and is not expired
-        if link_id not in shareable_links:
-            raise HTTPException(status_code=404, detail="Shareable link not found or expired")
-        
-        link_data = shareable_links[link_id]
-        if link_data["expires_at"] < datetime.now():
-            # Remove expired link
-            del shareable_links[link_id]
-            raise HTTPException(status_code=410, detail="Shareable link has expired")
-        
-        file_path = link_data["file_path"]
-        abs_path = os.path.abspath(file_path)
-        
-        if not os.path.exists(abs_path):
-            raise HTTPException(status_code=404, detail="File not found")
-        
-        if os.path.isdir(abs_path):
-            raise HTTPException(status_code=400, detail="Cannot access directory through shareable link")
-        
-        # Return file for download/streaming
-        mime_type = get_file_mime_type(abs_path)
-        filename = os.path.basename(abs_path)
-        
-        return FileResponse(
-            abs_path,
-            filename=filename,
-            media_type=mime_type
-        )
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Error accessing shareable link {link_id}: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+# ============================================================================
+# Disk Usage
+# ============================================================================
+# `du` as a background job: directories are scanned in parallel on the scan
+# pool, one scandir per task, with progress readable while the walk runs.
+# Each directory's own usage (its files, not subdirectories) is cached by
+# (st_dev, st_ino) together with its mtime, so a rescan only re-reads
+# directories whose entries changed and costs a single stat elsewhere.
+# Caveat: a directory's mtime only changes when entries are added, removed or
+# renamed, so files growing in place are missed until `exact` is requested.
+
+DU_CACHE_MAX_DIRS = int(os.getenv("DU_CACHE_MAX_DIRS", "1000000"))
+DU_MAX_JOBS = int(os.getenv("DU_MAX_JOBS", "20"))
+DU_MAX_RUNNING = int(os.getenv("DU_MAX_RUNNING", "4"))
+DU_CONCURRENCY = int(os.getenv("DU_CONCURRENCY", "16"))
+
+scan_executor = WorkloadExecutor("scan", workers=8, max_queue=64)
+
+class DirectoryUsage:
+    """A directory's own usage, excluding its subdirectories"""
+    __slots__ = ("mtime_ns", "bytes", "apparent_bytes", "files", "subdirs", "links")
+
+    def __init__(self, mtime_ns: int, bytes: int, apparent_bytes: int, files: int, subdirs: tuple, links: tuple):
+        self.mtime_ns = mtime_ns
+        self.bytes = bytes
+        self.apparent_bytes = apparent_bytes
+        self.files = files
+        self.subdirs = subdirs
+        # (st_dev, st_ino, bytes, apparent_bytes) of files with other hard links
+        self.links = links
+
+    def counted(self, seen_links: set) -> tuple:
+        """(bytes, apparent_bytes) with hard links already seen in this walk left out, like du"""
+        total, apparent = self.bytes, self.apparent_bytes
+        for dev, ino, link_bytes, link_apparent in self.links:
+            if (dev, ino) in seen_links:
+                total -= link_bytes
+                apparent -= link_apparent
+            else:
+                seen_links.add((dev, ino))
+        return total, apparent
+
+# (st_dev, st_ino) -> DirectoryUsage; written only from the event loop
+directory_usage_cache: Dict[tuple, DirectoryUsage] = {}
+
+def allocated_bytes(stats: os.stat_result) -> int:
+    blocks = getattr(stats, "st_blocks", None)
+    return blocks * 512 if blocks is not None else stats.st_size
+
+def scan_directory_usage(abs_path: str, root_dev: Optional[int], exact: bool):
+    """Own usage of one directory: (key, usage, from_cache, errors), or None if skipped"""
+    stats = os.lstat(abs_path)
+    if root_dev is not None and stats.st_dev != root_dev:
+        return None  # mount point of another filesystem
+    key = (stats.st_dev, stats.st_ino)
+    cached = directory_usage_cache.get(key)
+    if cached is not None and not exact and cached.mtime_ns == stats.st_mtime_ns:
+        return key, cached, True, 0
+    
+    total = allocated_bytes(stats)
+    apparent = stats.st_size
+    files = 0
+    errors = 0
+    subdirs = []
+    links = []
+    with os.scandir(abs_path) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                    continue
+                entry_stats = entry.stat(follow_symlinks=False)
+            except OSError:
+                errors += 1
+                continue
+            total += allocated_bytes(entry_stats)
+            apparent += entry_stats.st_size
+            files += 1
+            if entry_stats.st_nlink > 1:
+                links.append((entry_stats.st_dev, entry_stats.st_ino, allocated_bytes(entry_stats), entry_stats.st_size))
+    usage = DirectoryUsage(stats.st_mtime_ns, total, apparent, files, tuple(subdirs), tuple(links))
+    return key, usage, False, errors
+
+def remember_directory_usage(key: tuple, usage: DirectoryUsage):
+    directory_usage_cache.pop(key, None)
+    directory_usage_cache[key] = usage
+    while len(directory_usage_cache) > DU_CACHE_MAX_DIRS:
+        directory_usage_cache.pop(next(iter(directory_usage_cache)))
+
+class DiskUsageJob:
+    """One recursive size computation, totals broken down by top-level child"""
+
+    def __init__(self, abs_path: str, exact: bool, one_file_system: bool):
+        self.id = secrets.token_hex(8)
+        self.path = abs_path
+        self.exact = exact
+        self.one_file_system = one_file_system
+        self.status = "running"
+        self.error: Optional[str] = None
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.directories = 0
+        self.cached_directories = 0
+        self.pending = 0
+        self.errors = 0
+        self.files = 0
+        self.bytes = 0
+        self.apparent_bytes = 0
+        # name of the root's child subdirectory -> [bytes, apparent_bytes, files, directories]
+        self.children: Dict[str, list] = {}
+        self.seen_links: set = set()
+        self.task: Optional[asyncio.Task] = None
+
+    def _add(self, bucket: Optional[str], usage: DirectoryUsage):
+        total, apparent = usage.counted(self.seen_links)
+        self.directories += 1
+        self.files += usage.files
+        self.bytes += total
+        self.apparent_bytes += apparent
+        if bucket is not None:
+            totals = self.children.setdefault(bucket, [0, 0, 0, 0])
+            totals[0] += total
+            totals[1] += apparent
+            totals[2] += usage.files
+            totals[3] += 1
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        root_dev = os.stat(self.path).st_dev if self.one_file_system else None
+        # Depth-first keeps the pending stack small on wide trees
+        stack = [(self.path, None)]
+        in_flight: Dict[asyncio.Future, tuple] = {}
+        try:
+            while stack or in_flight:
+                while stack and len(in_flight) < DU_CONCURRENCY:
+                    abs_path, bucket = stack.pop()
+                    try:
+                        future = loop.run_in_executor(scan_executor, scan_directory_usage, abs_path, root_dev, self.exact)
+                    except ExecutorSaturated:
+                        # Other scans are using the pool; retry after something finishes
+                        stack.append((abs_path, bucket))
+                        break
+                    in_flight[future] = (abs_path, bucket)
+                self.pending = len(stack) + len(in_flight)
+                if not in_flight:
+                    await asyncio.sleep(0.05)
+                    continue
+                done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    abs_path, bucket = in_flight.pop(future)
+                    try:
+                        result = future.result()
+                    except OSError:
+                        self.errors += 1
+                        continue
+                    if result is None:
+                        continue
+                    key, usage, from_cache, errors = result
+                    self.errors += errors
+                    if from_cache:
+                        self.cached_directories += 1
+                    else:
+                        remember_directory_usage(key, usage)
+                    self._add(bucket, usage)
+                    for name in usage.subdirs:
+                        stack.append((os.path.join(abs_path, name), bucket if bucket is not None else name))
+            self.status = "completed"
+        except asyncio.CancelledError:
+            self.status = "cancelled"
+            for future in in_flight:
+                future.cancel()
+        except Exception as e:
+            logger.error(f"Disk usage job {self.id} for {self.path} failed: {e}")
+            self.status = "failed"
+            self.error = str(e)
+        finally:
+            self.pending = 0
+            self.finished_at = time.time()
+
+    def to_dict(self, top: int = 50) -> dict:
+        children = sorted(self.children.items(), key=lambda item: item[1][0], reverse=True)[:max(0, top)]
+        return {
+            "id": self.id,
+            "path": self.path,
+            "status": self.status,
+            "error": self.error,
+            "exact": self.exact,
+            "one_file_system": self.one_file_system,
+            "started_at": datetime.fromtimestamp(self.started_at).isoformat(),
+            "elapsed_seconds": round((self.finished_at or time.time()) - self.started_at, 3),
+            "progress": {
+                "directories": self.directories,
+                "cached_directories": self.cached_directories,
+                "pending_directories": self.pending,
+                "errors": self.errors
+            },
+            "bytes": self.bytes,
+            "apparent_bytes": self.apparent_bytes,
+            "files": self.files,
+            "children": [
+                {
+                    "name": name,
+                    "path": os.path.join(self.path, name),
+                    "bytes": totals[0],
+                    "apparent_bytes": totals[1],
+                    "files": totals[2],
+                    "directories": totals[3]
+                }
+                for name, totals in children
+            ]
+        }
+
+disk_usage_jobs: "OrderedDict[str, DiskUsageJob]" = OrderedDict()
+
+class DiskUsageRequest(BaseModel):
+    path: str
+    exact: bool = False
+    one_file_system: bool = True
+
+@app.post("/api/files/du")
+async def start_disk_usage(request: DiskUsageRequest, token: str = Depends(verify_token)):
+    """Start a recursive size computation; poll /api/files/du/{job_id} for progress"""
+    abs_path = os.path.abspath(request.path)
+    if not os.path.isdir(abs_path):
+        raise HTTPException(status_code=404, detail=f"Directory not found: {request.path}")
+    
+    if sum(1 for old in disk_usage_jobs.values() if old.status == "running") >= DU_MAX_RUNNING:
+        raise HTTPException(status_code=503, detail=f"Server busy: {DU_MAX_RUNNING} disk usage jobs are already running")
+    
+    job = DiskUsageJob(abs_path, request.exact, request.one_file_system)
+    job.task = asyncio.create_task(job.run())
+    disk_usage_jobs[job.id] = job
+    # Drop the oldest finished jobs beyond the limit
+    for job_id in [job_id for job_id, old in disk_usage_jobs.items() if old.status != "running"]:
+        if len(disk_usage_jobs) <= DU_MAX_JOBS:
+            break
+        del disk_usage_jobs[job_id]
+    return job.to_dict()
+
+@app.get("/api/files/du")
+async def list_disk_usage_jobs(token: str = Depends(verify_token)):
+    return {
+        "jobs": [job.to_dict(top=0) for job in disk_usage_jobs.values()],
+        "cached_directories": len(directory_usage_cache)
+    }
+
+@app.get("/api/files/du/{job_id}")
+async def get_disk_usage(job_id: str, top: int = 50, token: str = Depends(verify_token)):
+    job = disk_usage_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Disk usage job not found: {job_id}")
+    return job.to_dict(top)
+
+@app.delete("/api/files/du/{job_id}")
+async def cancel_disk_usage(job_id: str, token: str = Depends(verify_token)):
+    job = disk_usage_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Disk usage job not found: {job_id}")
+    if job.task is not None and not job.task.done():
+        job.task.cancel()
+        await asyncio.gather(job.task, return_exceptions=True)
+    return job.to_dict()
+
+@app.on_event("shutdown")
+async def cancel_disk_usage_jobs():
+    for job in disk_usage_jobs.values():
+        if job.task is not None and not job.task.done():
+            job.task.cancel()
+
+# Treemap (ncdu-style): a background scanner builds a compact per-root index
+# of directory totals, kept as parallel arrays (parent / first child / next
+# sibling links plus byte and file counters) rather than an object per
+# directory. Totals are propagated up to the root as each directory is read,
+# so a view of a tree still being scanned shows partial sizes, and viewing a
+# subtree that hasn't been reached yet moves it to the front of the scan.
+# Rescans go through the same (inode, mtime) cache as /api/files/du.
+
+TREEMAP_ROOTS = [root for root in os.getenv("TREEMAP_ROOTS", "").split(",") if root.strip()]
+TREEMAP_MAX_INDEXES = int(os.getenv("TREEMAP_MAX_INDEXES", "4"))
+TREEMAP_MAX_SCANNING = int(os.getenv("TREEMAP_MAX_SCANNING", "2"))
+TREEMAP_MAX_DEPTH = 6
+
+class TreemapIndex:
+    """Directory totals for one tree, filled in by a background scan"""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.names: List[str] = []
+        self.parent = array.array("q")
+        self.first_child = array.array("q")
+        self.next_sibling = array.array("q")
+        self.own_bytes = array.array("q")
+        self.own_files = array.array("q")
+        self.total_bytes = array.array("q")
+        self.total_files = array.array("q")
+        self.total_dirs = array.array("q")
+        # Directories in the subtree (including itself) not read yet
+        self.pending = array.array("q")
+        self.seen_links: set = set()
+        self.stack: List[tuple] = []
+        self.errors = 0
+        self.status = "scanning"
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self._add_node(root, -1)
+
+    def _add_node(self, name: str, parent: int) -> int:
+        node = len(self.names)
+        self.names.append(name)
+        self.parent.append(parent)
+        self.first_child.append(-1)
+        self.next_sibling.append(-1)
+        for counters in (self.own_bytes, self.own_files, self.total_bytes, self.total_files, self.total_dirs):
+            counters.append(0)
+        self.pending.append(1)
+        if parent >= 0:
+            self.next_sibling[node] = self.first_child[parent]
+            self.first_child[parent] = node
+            ancestor = parent
+            while ancestor >= 0:
+                self.pending[ancestor] += 1
+                ancestor = self.parent[ancestor]
+        return node
+
+    def _record(self, node: int, usage: Optional[DirectoryUsage]):
+        total = usage.counted(self.seen_links)[0] if usage is not None else 0
+        ancestor = node
+        while ancestor >= 0:
+            self.pending[ancestor] -= 1
+            if usage is not None:
+                self.total_bytes[ancestor] += total
+                self.total_files[ancestor] += usage.files
+                self.total_dirs[ancestor] += 1
+            ancestor = self.parent[ancestor]
+        if usage is not None:
+            self.own_bytes[node] = total
+            self.own_files[node] = usage.files
+
+    def path_of(self, node: int) -> str:
+        parts = []
+        while node > 0:
+            parts.append(self.names[node])
+            node = self.parent[node]
+        return os.path.join(self.root, *reversed(parts))
+
+    def children(self, node: int):
+        child = self.first_child[node]
+        while child >= 0:
+            yield child
+            child = self.next_sibling[child]
+
+    def find(self, abs_path: str) -> Optional[int]:
+        relative = os.path.relpath(abs_path, self.root)
+        node = 0
+        if relative == ".":
+            return node
+        for part in relative.split(os.sep):
+            node = next((child for child in self.children(node) if self.names[child] == part), None)
+            if node is None:
+                return None
+        return node
+
+    def prioritize(self, node: int):
+        """Move queued directories under `node` to the top of the scan stack"""
+        def under(candidate: int) -> bool:
+            while candidate >= 0:
+                if candidate == node:
+                    return True
+                candidate = self.parent[candidate]
+            return False
+        
+        inside = [item for item in self.stack if under(item[0])]
+        if inside:
+            self.stack = [item for item in self.stack if not under(item[0])] + inside
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        root_dev = os.stat(self.root).st_dev
+        self.stack = [(0, self.root)]
+        in_flight: Dict[asyncio.Future, tuple] = {}
+        try:
+            while self.stack or in_flight:
+                while self.stack and len(in_flight) < DU_CONCURRENCY:
+                    node, abs_path = self.stack.pop()
+                    try:
+                        future = loop.run_in_executor(scan_executor, scan_directory_usage, abs_path, root_dev, False)
+                    except ExecutorSaturated:
+                        # Other scans are using the pool; retry after something finishes
+                        self.stack.append((node, abs_path))
+                        break
+                    in_flight[future] = (node, abs_path)
+                if not in_flight:
+                    await asyncio.sleep(0.05)
+                    continue
+                done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    node, abs_path = in_flight.pop(future)
+                    try:
+                        result = future.result()
+                    except OSError:
+                        self.errors += 1
+                        result = None
+                    if result is None:
+                        self._record(node, None)
+                        continue
+                    key, usage, from_cache, errors = result
+                    self.errors += errors
+                    if not from_cache:
+                        remember_directory_usage(key, usage)
+                    for name in usage.subdirs:
+                        self.stack.append((self._add_node(name, node), os.path.join(abs_path, name)))
+                    self._record(node, usage)
+            self.status = "complete"
+        except asyncio.CancelledError:
+            self.status = "cancelled"
+        except Exception as e:
+            logger.error(f"Treemap scan of {self.root} failed: {e}")
+            self.status = "failed"
+        finally:
+            self.stack = []
+            self.finished_at = time.time()
+
+    def view(self, node: int, depth: int, top: int) -> dict:
+        result = {
+            "name": self.names[node] if node else os.path.basename(self.root) or self.root,
+            "path": self.path_of(node),
+            "bytes": self.total_bytes[node],
+            "files": self.total_files[node],
+            "directories": self.total_dirs[node],
+            "own_bytes": self.own_bytes[node],
+            "own_files": self.own_files[node],
+            "complete": self.pending[node] == 0
+        }
+        if depth > 0:
+            children = heapq.nlargest(top, self.children(node), key=lambda child: self.total_bytes[child])
+            shown = sum(self.total_bytes[child] for child in children)
+            result["children"] = [self.view(child, depth - 1, top) for child in children]
+            # Everything not listed: smaller directories plus files directly in this one
+            result["other_bytes"] = self.total_bytes[node] - shown - self.own_bytes[node]
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "root": self.root,
+            "status": self.status,
+            "directories_indexed": len(self.names),
+            "pending_directories": self.pending[0],
+            "errors": self.errors,
+            "bytes": self.total_bytes[0],
+            "files": self.total_files[0],
+            "elapsed_seconds": round((self.finished_at or time.time()) - self.started_at, 3)
+        }
+
+treemap_indexes: "OrderedDict[str, TreemapIndex]" = OrderedDict()
+
+def start_treemap_index(root: str) -> TreemapIndex:
+    previous = treemap_indexes.pop(root, None)
+    if previous is not None and previous.task is not None:
+        previous.task.cancel()
+    index = TreemapIndex(root)
+    index.task = asyncio.create_task(index.run())
+    treemap_indexes[root] = index
+    while len(treemap_indexes) > TREEMAP_MAX_INDEXES:
+        _, evicted = treemap_indexes.popitem(last=False)
+        if evicted.task is not None:
+            evicted.task.cancel()
+    return index
+
+def find_treemap_index(abs_path: str) -> Optional[TreemapIndex]:
+    """The most specific index whose root contains abs_path"""
+    best = None
+    for root, index in treemap_indexes.items():
+        if abs_path == root or abs_path.startswith(root.rstrip(os.sep) + os.sep):
+            if best is None or len(root) > len(best.root):
+                best = index
+    if best is not None:
+        treemap_indexes.move_to_end(best.root)
+    return best
+
+@app.on_event("startup")
+async def start_treemap_scanner():
+    for root in TREEMAP_ROOTS:
+        root = os.path.abspath(root.strip())
+        if os.path.isdir(root):
+            start_treemap_index(root)
+
+@app.on_event("shutdown")
+async def stop_treemap_scanner():
+    for index in treemap_indexes.values():
+        if index.task is not None:
+            index.task.cancel()
+
+@app.get("/api/files/treemap")
+async def get_treemap(path: str, depth: int = 2, top: int = 20, refresh: bool = False,
+                      stream: bool = False, token: str = Depends(verify_token)):
+    """Largest subdirectories of `path`, `depth` levels deep.
+
+    Served from an in-memory index; the first request for a tree starts a
+    background scan. While it runs, nodes report partial sizes with
+    `complete: false`, and `stream=true` sends an updated NDJSON snapshot
+    every second until the requested subtree is complete.
+    """
+    abs_path = os.path.abspath(path)
+    if not os.path.isdir(abs_path):
+        raise HTTPException(status_code=404, detail=f"Directory not found: {path}")
+    depth = max(0, min(depth, TREEMAP_MAX_DEPTH))
+    top = max(1, min(top, 500))
+    
+    index = find_treemap_index(abs_path)
+    if index is not None and index.status != "scanning" and index.find(abs_path) is None:
+        index = None  # created after the scan, or on another filesystem
+    if index is None or refresh:
+        root = abs_path if index is None else index.root
+        scanning = sum(1 for other in treemap_indexes.values() if other.status == "scanning" and other.root != root)
+        if scanning >= TREEMAP_MAX_SCANNING:
+            raise HTTPException(status_code=503, detail=f"Server busy: {TREEMAP_MAX_SCANNING} treemap scans are already running")
+        index = start_treemap_index(root)
+    
+    def snapshot() -> dict:
+        node = index.find(abs_path)
+        if node is None:
+            # Not reached yet: scan towards it first
+            ancestor = os.path.dirname(abs_path)
+            while index.status == "scanning" and ancestor != index.root and index.find(ancestor) is None:
+                ancestor = os.path.dirname(ancestor)
+            if index.status == "scanning":
+                index.prioritize(index.find(ancestor))
+            return {"index": index.stats(), "tree": None}
+        if index.pending[node]:
+            index.prioritize(node)
+        return {"index": index.stats(), "tree": index.view(node, depth, top)}
+    
+    if not stream:
+        return snapshot()
+    
+    async def ndjson():
+        while True:
+            current = snapshot()
+            yield json.dumps(current) + "\n"
+            if index.status != "scanning" or (current["tree"] is not None and current["tree"]["complete"]):
+                break
+            await asyncio.sleep(1.0)
+    
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+@app.get("/api/files/treemap/indexes")
+async def list_treemap_indexes(token: str = Depends(verify_token)):
+    return {"indexes": [index.stats() for index in treemap_indexes.values()]}
+
+# ============================================================================
+# Content Search
+# ============================================================================
+# grep over the file manager. Directories are walked on the scan pool; the
+# files they yield are grouped into small batches and searched in a process
+# pool (the `re` module holds the GIL, so threads would not run in parallel),
+# each file memory-mapped rather than read. Matches are yielded as batches
+# finish; closing the stream, hitting max_results or the timeout cancels
+# everything still queued.
+
+SEARCH_MAX_FILE_SIZE = int(os.getenv("SEARCH_MAX_FILE_SIZE", str(32 * 1024 * 1024)))
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", "10000"))
+SEARCH_TIMEOUT = float(os.getenv("SEARCH_TIMEOUT", "60"))
+SEARCH_MAX_TIMEOUT = float(os.getenv("SEARCH_MAX_TIMEOUT", "600"))
+SEARCH_MATCHES_PER_FILE = 100
+SEARCH_BATCH_FILES = 64
+SEARCH_BATCH_BYTES = 16 * 1024 * 1024
+SEARCH_LINE_LIMIT = 500
+
+search_executor = WorkloadExecutor("search", workers=min(4, os.cpu_count() or 1), max_queue=16, processes=True)
+
+class FileSearchRequest(BaseModel):
+    path: str
+    pattern: str
+    regex: bool = False
+    case_sensitive: bool = True
+    include: List[str] = []      # globs a file name or relative path must match
+    exclude: List[str] = []      # globs pruning files and whole directories
+    max_file_size: Optional[int] = None
+    max_results: int = 1000
+    timeout: Optional[float] = None
+    stream: bool = False
+
+def _glob_match(globs: List[str], name: str, relative: str) -> bool:
+    return any(fnmatch.fnmatch(name, glob) or fnmatch.fnmatch(relative, glob) for glob in globs)
+
+def list_search_directory(abs_path: str, root: str, include: List[str], exclude: List[str], max_file_size: int):
+    """One directory of the walk: (subdirectories, [(file, size)], files skipped as too large)"""
+    subdirs, files, too_large = [], [], 0
+    with os.scandir(abs_path) as entries:
+        for entry in entries:
+            relative = os.path.relpath(entry.path, root)
+            if exclude and _glob_match(exclude, entry.name, relative):
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                    continue
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                if include and not _glob_match(include, entry.name, relative):
+                    continue
+                size = entry.stat(follow_symlinks=False).st_size
+            except OSError:
+                continue
+            if size > max_file_size:
+                too_large += 1
+            elif size > 0:
+                files.append((entry.path, size))
+    return subdirs, files, too_large
+
+def search_files(paths: List[str], pattern: str, regex: bool, case_sensitive: bool) -> dict:
+    """Search a batch of files (runs in the search process pool)"""
+    needle = pattern.encode()
+    literal = not regex and case_sensitive
+    if not literal:
+        flags = re.MULTILINE | (0 if case_sensitive else re.IGNORECASE)
+        compiled = re.compile(needle if regex else re.escape(needle), flags)
+    matches, binary, errors = [], 0, 0
+    for path in paths:
+        try:
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                # Same heuristic as grep: a NUL byte early on means binary
+                if mm.find(b"\0", 0, 8192) != -1:
+                    binary += 1
+                    continue
+                if literal:
+                    def positions():
+                        start = mm.find(needle)
+                        while start != -1:
+                            yield start
+                            start = mm.find(needle, start + max(1, len(needle)))
+                else:
+                    def positions():
+                        for match in compiled.finditer(mm):
+                            yield match.start()
+                line, counted_to, found = 1, 0, 0
+                for start in positions():
+                    line_start = mm.rfind(b"\n", 0, start) + 1
+                    if line_start < counted_to:
+                        continue  # another match on a line already reported
+                    line += mm[counted_to:line_start].count(b"\n")
+                    line_end = mm.find(b"\n", start)
+                    line_end = len(mm) if line_end == -1 else line_end
+                    matches.append({
+                        "path": path,
+                        "line": line,
+                        "column": start - line_start + 1,
+                        "text": mm[line_start:min(line_end, line_start + SEARCH_LINE_LIMIT)].decode("utf-8", errors="replace")
+                    })
+                    counted_to = line_end
+                    found += 1
+                    if found >= SEARCH_MATCHES_PER_FILE:
+                        break
+        except (OSError, ValueError):
+            errors += 1
+    return {"matches": matches, "searched": len(paths) - binary - errors, "binary": binary, "errors": errors}
+
+async def search_file_contents(request: FileSearchRequest, root: str):
+    """Async generator of match records followed by one summary record"""
+    loop = asyncio.get_event_loop()
+    started = loop.time()
+    timeout = max(0.1, min(request.timeout or SEARCH_TIMEOUT, SEARCH_MAX_TIMEOUT))
+    deadline = started + timeout
+    max_results = max(1, min(request.max_results, SEARCH_MAX_RESULTS))
+    max_file_size = min(request.max_file_size or SEARCH_MAX_FILE_SIZE, SEARCH_MAX_FILE_SIZE)
+    max_batches = search_executor.max_workers * 2
+    
+    directories = [root]
+    files = deque()
+    in_flight: Dict[asyncio.Future, str] = {}
+    counts = {"directories": 0, "searched": 0, "binary": 0, "too_large": 0, "errors": 0}
+    reported = 0
+    stopped = None
+    try:
+        while directories or files or in_flight:
+            if loop.time() >= deadline:
+                stopped = "timeout"
+                break
+            # Walk ahead of the searchers, but not unboundedly
+            while directories and len(files) < SEARCH_BATCH_FILES * max_batches * 4 \
+                    and sum(1 for kind in in_flight.values() if kind == "walk") < DU_CONCURRENCY:
+                directory = directories.pop()
+                try:
+                    future = loop.run_in_executor(scan_executor, list_search_directory, directory, root,
+                                                  request.include, request.exclude, max_file_size)
+                except ExecutorSaturated:
+                    # du jobs and treemap scans share the walk pool; retry after something finishes
+                    directories.append(directory)
+                    break
+                in_flight[future] = "walk"
+            while files and sum(1 for kind in in_flight.values() if kind == "search") < max_batches:
+                batch, batch_bytes = [], 0
+                while files and len(batch) < SEARCH_BATCH_FILES and batch_bytes < SEARCH_BATCH_BYTES:
+                    batch.append(files.popleft())
+                    batch_bytes += batch[-1][1]
+                try:
+                    future = loop.run_in_executor(search_executor, search_files, [path for path, _ in batch],
+                                                  request.pattern, request.regex, request.case_sensitive)
+                except ExecutorSaturated:
+                    # Other searches are using the pool; retry after something finishes
+                    files.extendleft(reversed(batch))
+                    break
+                in_flight[future] = "search"
+            if not in_flight:
+                await asyncio.sleep(0.05)
+                continue
+            
+            done, _ = await asyncio.wait(in_flight, timeout=max(0, deadline - loop.time()), return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                kind = in_flight.pop(future)
+                try:
+                    result = future.result()
+                except OSError:
+                    counts["errors"] += 1
+                    continue
+                if kind == "walk":
+                    subdirs, found, too_large = result
+                    counts["directories"] += 1
+                    counts["too_large"] += too_large
+                    directories.extend(subdirs)
+                    files.extend(found)
+                    continue
+                for key in ("searched", "binary", "errors"):
+                    counts[key] += result[key]
+                for match in result["matches"]:
+                    yield {"type": "match", **match}
+                    reported += 1
+                    if reported >= max_results:
+                        stopped = "max_results"
+                        break
+                if stopped:
+                    break
+            if stopped:
+                break
+    finally:
+        # Anything not started yet is dropped, including when the client went away
+        for future in in_flight:
+            future.cancel()
+        if stopped is not None or directories or files or in_flight:
+            logger.info(f"Content search in {root} stopped early ({stopped or 'cancelled'}) after {reported} matches")
+    
+    yield {
+        "type": "summary",
+        "matches": reported,
+        **counts,
+        "stopped": stopped,
+        "elapsed_ms": round((loop.time() - started) * 1000, 1)
+    }
+
+@app.post("/api/files/search")
+async def search_files_content(request: FileSearchRequest, token: str = Depends(verify_token)):
+    """Search file contents under a directory (literal or regex, like grep -rn)"""
+    root = os.path.abspath(request.path)
+    if not os.path.isdir(root):
+        raise HTTPException(status_code=404, detail=f"Directory not found: {request.path}")
+    if not request.pattern:
+        raise HTTPException(status_code=400, detail="Empty search pattern")
+    if request.regex:
+        try:
+            re.compile(request.pattern.encode())
+        except re.error as e:
+            raise HTTPException(status_code=400, detail=f"Invalid regular expression: {e}")
+    
+    records = search_file_contents(request, root)
+    if request.stream:
+        async def ndjson():
+            async for record in records:
+                yield json.dumps(record) + "\n"
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+    
+    matches, summary = [], None
+    async for record in records:
+        if record["type"] == "match":
+            matches.append(record)
+        else:
+            summary = record
+    return {"matches": matches, "summary": summary}
+
+# ============================================================================
+# Filename Index
+# ============================================================================
+# Every path under FILE_INDEX_ROOTS is stored in SQLite with an FTS5 trigram
+# index over the file name, so substring queries ("config", "2024-05") and
+# globs with a few literal characters are answered from the index instead of
+# a walk. The index is persistent, rebuilt in the background on startup and
+# every FILE_INDEX_RESCAN_INTERVAL, and kept current in between by inotify
+# watches on the indexed directories. All writes go through one worker
+# thread; queries use their own WAL readers and never wait on it.
+
+FILE_INDEX_ROOTS = [root.strip() for root in os.getenv("FILE_INDEX_ROOTS", "").split(",") if root.strip()]
+FILE_INDEX_DB = os.getenv("FILE_INDEX_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "file_index.db"))
+FILE_INDEX_RESCAN_INTERVAL = float(os.getenv("FILE_INDEX_RESCAN_INTERVAL", str(6 * 3600)))
+FILE_INDEX_WATCH_MAX = int(os.getenv("FILE_INDEX_WATCH_MAX", "65536"))
+FILE_INDEX_BATCH = 5000
+FILE_INDEX_WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+                         | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+file_index_executor = WorkloadExecutor("file_index", workers=1, max_queue=1024)
+
+FILE_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    is_dir INTEGER NOT NULL,
+    size INTEGER,
+    mtime REAL,
+    scan INTEGER NOT NULL DEFAULT 0
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5(name, content='files', content_rowid='id', tokenize='trigram');
+CREATE TRIGGER IF NOT EXISTS files_ad AFTER DELETE ON files BEGIN
+    INSERT INTO files_fts(files_fts, rowid, name) VALUES ('delete', old.id, old.name);
+END;
+CREATE TRIGGER IF NOT EXISTS files_au AFTER UPDATE OF name ON files BEGIN
+    INSERT INTO files_fts(files_fts, rowid, name) VALUES ('delete', old.id, old.name);
+    INSERT INTO files_fts(rowid, name) VALUES (new.id, new.name);
+END;
+"""
+
+# Dropped while an empty index is bulk-loaded; one FTS 'rebuild' at the end is
+# several times faster than indexing row by row
+FILE_INDEX_INSERT_TRIGGER = """
+CREATE TRIGGER IF NOT EXISTS files_ai AFTER INSERT ON files BEGIN
+    INSERT INTO files_fts(rowid, name) VALUES (new.id, new.name);
+END;
+"""
+
+# Rescans only touch the scan column, so unchanged rows never hit the FTS index
+FILE_INDEX_UPSERT = """
+INSERT INTO files(path, name, is_dir, size, mtime, scan) VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT(path) DO UPDATE SET is_dir = excluded.is_dir, size = excluded.size,
+    mtime = excluded.mtime, scan = excluded.scan
+"""
+
+def path_range(abs_path: str) -> tuple:
+    """Bounds selecting everything strictly below abs_path with path >= ? AND path < ?"""
+    prefix = abs_path.rstrip(os.sep) + os.sep
+    return prefix, prefix[:-1] + chr(ord(os.sep) + 1)
+
+def stat_is_dir(stats: os.stat_result) -> bool:
+    return (stats.st_mode & 0o170000) == 0o040000
+
+def index_row(abs_path: str, stats: os.stat_result, scan: int) -> tuple:
+    is_dir = stat_is_dir(stats)
+    return (abs_path, os.path.basename(abs_path) or abs_path, int(is_dir),
+            None if is_dir else stats.st_size, stats.st_mtime, scan)
+
+def list_index_directory(abs_path: str, root_dev: int, scan: int):
+    """Rows for one directory's entries plus the subdirectories to descend into"""
+    rows, subdirs = [], []
+    with os.scandir(abs_path) as entries:
+        for entry in entries:
+            try:
+                stats = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            rows.append(index_row(entry.path, stats, scan))
+            if stat_is_dir(stats) and stats.st_dev == root_dev:
+                subdirs.append(entry.path)
+    return rows, subdirs
+
+class FileIndexWatcher(InotifyWatcher):
+    """Feeds changes under the indexed roots back into the index"""
+
+    def __init__(self, index: "FileIndex"):
+        super().__init__(FILE_INDEX_WATCH_MAX, FILE_INDEX_WATCH_MASK, evict=False)
+        self.index = index
+
+    def on_overflow(self):
+        self.index.rescan_requested.set()
+
+    def on_change(self, abs_path: str, mask: int, name: str):
+        if not name:
+            return
+        path = os.path.join(abs_path, name)
+        if mask & (IN_DELETE | IN_MOVED_FROM):
+            self.index.queue_change("delete", path)
+        elif mask & (IN_CREATE | IN_MOVED_TO) and mask & IN_ISDIR:
+            # A moved-in directory arrives with contents; new ones may fill before we watch them
+            self.index.queue_change("stat", path)
+            asyncio.create_task(self.index.scan_tree(path, self.index.generation))
+        else:
+            self.index.queue_change("stat", path)
+
+class FileIndex:
+    """Persistent filename index over FILE_INDEX_ROOTS"""
+
+    def __init__(self, db_path: str, roots: List[str]):
+        self.db_path = db_path
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.status = "idle"
+        self.generation = 0
+        self.last_scan: Optional[dict] = None
+        self.watch_limited = False
+        self.rescan_requested = asyncio.Event()
+        self.watcher = FileIndexWatcher(self)
+        self._changes: List[tuple] = []
+        self._flush_scheduled = False
+        self._writer = None
+        self._readers = threading.local()
+        self.task: Optional[asyncio.Task] = None
+
+    # Writer side: only ever called on file_index_executor's single thread
+    def _write_connection(self):
+        if self._writer is None:
+            db = sqlite3.connect(self.db_path)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            interrupted_bulk = db.execute("SELECT count(*) FROM sqlite_master WHERE name IN ('files', 'files_ai')").fetchone()[0] == 1
+            db.executescript(FILE_INDEX_SCHEMA)
+            self._writer = db
+            if interrupted_bulk:
+                self._end_bulk_load()
+            else:
+                db.executescript(FILE_INDEX_INSERT_TRIGGER)
+        return self._writer
+
+    def _begin_bulk_load(self) -> bool:
+        db = self._write_connection()
+        if db.execute("SELECT 1 FROM files LIMIT 1").fetchone() is not None:
+            return False
+        db.execute("DROP TRIGGER IF EXISTS files_ai")
+        return True
+
+    def _end_bulk_load(self):
+        db = self._write_connection()
+        with db:
+            db.execute("INSERT INTO files_fts(files_fts) VALUES ('rebuild')")
+            db.executescript(FILE_INDEX_INSERT_TRIGGER)
+
+    def _write_rows(self, rows: List[tuple]):
+        db = self._write_connection()
+        with db:
+            db.executemany(FILE_INDEX_UPSERT, rows)
+
+    def _apply_changes(self, changes: List[tuple]):
+        db = self._write_connection()
+        with db:
+            for kind, path in changes:
+                if kind == "delete":
+                    db.execute("DELETE FROM files WHERE path = ? OR (path >= ? AND path < ?)", (path, *path_range(path)))
+                    continue
+                try:
+                    stats = os.lstat(path)
+                except OSError:
+                    db.execute("DELETE FROM files WHERE path = ?", (path,))
+                    continue
+                db.execute(FILE_INDEX_UPSERT, index_row(path, stats, self.generation))
+
+    def _drop_stale(self, root: str, scan: int) -> int:
+        db = self._write_connection()
+        with db:
+            return db.execute("DELETE FROM files WHERE path >= ? AND path < ? AND scan < ?",
+                              (*path_range(root), scan)).rowcount
+
+    def count(self) -> int:
+        return self._read_connection().execute("SELECT count(*) FROM files").fetchone()[0]
+
+    async def _write(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(file_index_executor, fn, *args)
+
+    def queue_change(self, kind: str, path: str):
+        """Batch inotify changes; they're written at most twice a second"""
+        self._changes.append((kind, path))
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            asyncio.get_running_loop().call_later(0.5, lambda: asyncio.create_task(self._flush_changes()))
+
+    async def _flush_changes(self):
+        self._flush_scheduled = False
+        changes, self._changes = self._changes, []
+        try:
+            await self._write(self._apply_changes, changes)
+        except Exception as e:
+            logger.error(f"Failed to apply {len(changes)} file index changes: {e}")
+
+    async def scan_tree(self, top: str, scan: int) -> int:
+        """Walk top (on the scan pool), upserting every entry and watching every directory"""
+        loop = asyncio.get_running_loop()
+        try:
+            root_dev = os.stat(top).st_dev
+        except OSError:
+            return 0
+        directories = [top]
+        in_flight: Dict[asyncio.Future, str] = {}
+        rows: List[tuple] = []
+        indexed = 0
+        # One batch is written while the walk carries on producing the next
+        writing = None
+        while directories or in_flight:
+            while directories and len(in_flight) < DU_CONCURRENCY:
+                abs_path = directories.pop()
+                if not self.watcher.watch(abs_path) and self.watcher.available:
+                    self.watch_limited = True
+                try:
+                    future = loop.run_in_executor(scan_executor, list_index_directory, abs_path, root_dev, scan)
+                except ExecutorSaturated:
+                    # Other scans are using the pool; retry after something finishes
+                    directories.append(abs_path)
+                    break
+                in_flight[future] = abs_path
+            if not in_flight:
+                await asyncio.sleep(0.05)
+                continue
+            done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                in_flight.pop(future)
+                try:
+                    found, subdirs = future.result()
+                except OSError:
+                    continue
+                rows.extend(found)
+                directories.extend(subdirs)
+            if len(rows) >= FILE_INDEX_BATCH:
+                if writing is not None:
+                    await writing
+                indexed += len(rows)
+                writing = asyncio.ensure_future(self._write(self._write_rows, rows))
+                rows = []
+        if writing is not None:
+            await writing
+        if rows:
+            indexed += len(rows)
+            await self._write(self._write_rows, rows)
+        return indexed
 
-@app.get("/api/files/stream")
-async def stream_file(path: str, token: str = None):
-    """Stream a file directly (for media files)"""
-    # For streaming, accept token as query parameter for browser compatibility
-    if token != "valid-token":
-        raise HTTPException(status_code=403, detail="Invalid token")
-    try:
-        abs_path = os.path.abspath(path)
-        if not os.path.exists(abs_path):
-            raise HTTPException(status_code=404, detail=f"File not found: {path}")
-        
-        if os.path.isdir(abs_path):
-            raise HTTPException(status_code=400, detail=f"Cannot stream directory: {path}")
-        
-        # Get MIME type
-        mime_type = get_file_mime_type(abs_path)
-        
-        # For media files, return streaming response with proper headers
-        if mime_type.startswith(('video/', 'audio/', 'image/')):
-            return FileResponse(
-                abs_path,
-                media_type=mime_type,
-                headers={
-                    "Accept-Ranges": "bytes",
-                    "Cache-Control": "public, max-age=3600",
-                    "Access-Control-Allow-Origin": "*"
-                }
-            )
+    async def rebuild(self):
+        """Full pass over every root; rows not seen in this pass are removed"""
+        self.status = "scanning"
+        self.generation = int(time.time())
+        started = time.monotonic()
+        indexed, removed = 0, 0
+        bulk = await self._write(self._begin_bulk_load)
+        for root in self.roots:
+            if not os.path.isdir(root):
+                logger.warning(f"File index root does not exist: {root}")
+                continue
+            await self._write(self._write_rows, [index_row(root, os.stat(root), self.generation)])
+            indexed += await self.scan_tree(root, self.generation) + 1
+            removed += await self._write(self._drop_stale, root, self.generation)
+        if bulk:
+            await self._write(self._end_bulk_load)
+        self.status = "ready"
+        self.last_scan = {
+            "finished_at": datetime.now().isoformat(),
+            "elapsed_seconds": round(time.monotonic() - started, 2),
+            "indexed": indexed,
+            "removed": removed
+        }
+        logger.info(f"File index rebuilt: {indexed} paths in {self.last_scan['elapsed_seconds']}s, {removed} removed")
+        if self.watch_limited:
+            logger.warning(f"File index exceeded {FILE_INDEX_WATCH_MAX} inotify watches; "
+                           f"changes in unwatched directories appear after the next rescan")
+
+    async def run(self):
+        # Schema first, so queries can be served from the previous index during the rebuild
+        await self._write(self._write_connection)
+        while True:
+            try:
+                await self.rebuild()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.status = "failed"
+                logger.error(f"File index rebuild failed: {e}")
+            self.rescan_requested.clear()
+            try:
+                await asyncio.wait_for(self.rescan_requested.wait(), FILE_INDEX_RESCAN_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    # Reader side: one connection per filesystem_executor thread
+    def _read_connection(self):
+        db = getattr(self._readers, "db", None)
+        if db is None:
+            db = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+            self._readers.db = db
+        return db
+
+    def find(self, q: str, limit: int, kind: Optional[str], under: Optional[str]) -> tuple:
+        """(mode, rows, truncated) for a substring or glob query.
+
+        Queries containing a slash are matched against the whole path; the
+        index narrows candidates by the name part first.
+        """
+        glob = any(char in q for char in "*?[")
+        name_part = q.rsplit(os.sep, 1)[-1]
+        conditions, params = [], []
+        if glob:
+            mode = "glob"
+            # Without a slash the glob applies to the file name, as in `find -name`
+            conditions.append("files_fts.name GLOB ?")
+            params.append(name_part or "*")
+            if os.sep in q:
+                conditions.append("files.path GLOB ?")
+                params.append(q if q.startswith(os.sep) else "*" + os.sep + q)
         else:
-            # For other files, return as download
-            filename = os.path.basename(abs_path)
-            return FileResponse(
-                abs_path,
-                filename=filename,
-                media_type=mime_type
-            )
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Error streaming file {path}: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+            mode = "substring"
+            if len(name_part) >= 3:
+                conditions.append("files_fts MATCH ?")
+                params.append('"' + name_part.replace('"', '""') + '"')
+            if len(name_part) < 3 or os.sep in q:
+                # Trigrams need three characters; otherwise this is a scan
+                conditions.append(f"files.{'path' if os.sep in q else 'name'} LIKE ? ESCAPE '\\'")
+                params.append("%" + re.sub(r"([%_\\])", r"\\\1", q) + "%")
+        if kind is not None:
+            conditions.append("files.is_dir = ?")
+            params.append(1 if kind == "dir" else 0)
+        if under is not None:
+            conditions.append("files.path >= ? AND files.path < ?")
+            params.extend(path_range(under))
+        cursor = self._read_connection().execute(
+            "SELECT files.path, files.name, files.is_dir, files.size, files.mtime FROM files_fts "
+            "JOIN files ON files.id = files_fts.rowid WHERE " + " AND ".join(conditions), params)
+        rows = []
+        for row in cursor:
+            rows.append(row)
+            if len(rows) > limit:
+                return mode, rows[:limit], True
+        return mode, rows, False
 
-@app.get("/api/files/stream/{link_id}")
-async def stream_shareable_file(link_id: str):
-    """Stream a file through a shareable link (for media files)"""
+    def stats(self) -> dict:
+        return {
+            "roots": self.roots,
+            "status": self.status,
+            "database": self.db_path,
+            "last_scan": self.last_scan,
+            "watches": self.watcher.stats(),
+            "watch_limited": self.watch_limited
+        }
+
+file_index: Optional[FileIndex] = None
+
+@app.on_event("startup")
+async def start_file_index():
+    global file_index
+    if FILE_INDEX_ROOTS:
+        file_index = FileIndex(FILE_INDEX_DB, FILE_INDEX_ROOTS)
+        file_index.task = asyncio.create_task(file_index.run())
+
+@app.on_event("shutdown")
+async def stop_file_index():
+    if file_index is not None:
+        if file_index.task is not None:
+            file_index.task.cancel()
+        file_index.watcher.close()
+
+def require_file_index() -> FileIndex:
+    if file_index is None:
+        raise HTTPException(status_code=503, detail="File index is disabled; set FILE_INDEX_ROOTS to enable it")
+    if not os.path.exists(file_index.db_path):
+        raise HTTPException(status_code=503, detail="File index is still being built")
+    return file_index
+
+@app.get("/api/files/find")
+async def find_files(q: str, limit: int = 100, type: Optional[str] = None, path: Optional[str] = None,
+                     token: str = Depends(verify_token)):
+    """Find files by name: substring (case-insensitive) or glob (`*.log`, `/var/*/access.log`)"""
+    index = require_file_index()
+    if not q:
+        raise HTTPException(status_code=400, detail="Empty query")
+    if type not in (None, "file", "dir"):
+        raise HTTPException(status_code=400, detail="type must be 'file' or 'dir'")
+    limit = max(1, min(limit, 1000))
+    under = os.path.abspath(path) if path else None
+    
+    loop = asyncio.get_event_loop()
+    started = time.perf_counter()
     try:
-        # Check if link exists and is not expired
-        if link_id not in shareable_links:
-            raise HTTPException(status_code=404, detail="Shareable link not found or expired")
-        
-        link_data = shareable_links[link_id]
-        if link_data["expires_at"] < datetime.now():
-            # Remove expired link
-            del shareable_links[link_id]
-            raise HTTPException(status_code=410, detail="Shareable link has expired")
-        
-        file_path = link_data["file_path"]
-        abs_path = os.path.abspath(file_path)
-        
-        if not os.path.exists(abs_path):
-            raise HTTPException(status_code=404, detail="File not found")
-        
-        if os.path.isdir(abs_path):
-            raise HTTPException(status_code=400, detail="Cannot stream directory")
-        
-        # Get MIME type
-        mime_type = get_file_mime_type(abs_path)
-        
-        # For media files, return streaming response
-        if mime_type.startswith(('video/', 'audio/', 'image/')):
-            return FileResponse(
-                abs_path,
-                media_type=mime_type,
-                headers={"Accept-Ranges": "bytes"}
-            )
-        else:
-            # For other files, return as download
-            filename = os.path.basename(abs_path)
-            return FileResponse(
-                abs_path,
-                filename=filename,
-                media_type=mime_type
-            )
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Error streaming shareable file {link_id}: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        mode, rows, truncated = await loop.run_in_executor(filesystem_executor, index.find, q, limit, type, under)
+    except sqlite3.OperationalError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid query: {e}")
+    return {
+        "query": q,
+        "mode": mode,
+        "results": [
+            {
+                "path": row[0],
+                "name": row[1],
+                "is_directory": bool(row[2]),
+                "size": row[3],
+                "modified": datetime.fromtimestamp(row[4]).isoformat() if row[4] is not None else None
+            }
+            for row in rows
+        ],
+        "truncated": truncated,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+        "index_status": index.status
+    }
+
+@app.get("/api/files/index")
+async def get_file_index_status(token: str = Depends(verify_token)):
+    index = require_file_index()
+    loop = asyncio.get_event_loop()
+    return {**index.stats(), "paths": await loop.run_in_executor(filesystem_executor, index.count)}
 
 @app.post("/api/system/clear-cache")
 async def clear_system_cache(token: str = Depends(verify_token)):
@@ -1996,6 +6783,8 @@ async def clear_system_cache(token: str = Depends(verify_token)):
         await clear_cache()
         logger.info("System cache cleared")
         return {"success": True, "message": "Cache cleared successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error clearing cache: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -2141,7 +6930,7 @@ async def screen_websocket(websocket: WebSocket, session_id: str):
                 # Capture screen in executor to avoid blocking
                 session = screen_sessions[session_id]
                 img_base64 = await loop.run_in_executor(
-                    executor,
+                    screen_executor,
                     capture_screen,
                     session["quality"],
                     session["scale"]
@@ -2162,6 +6951,9 @@ async def screen_websocket(websocket: WebSocket, session_id: str):
             except WebSocketDisconnect:
                 logger.info(f"Screen sharing WebSocket disconnected for session: {session_id}")
                 break
+            except ExecutorSaturated:
+                # Encoders are busy with other viewers: skip this frame
+                await asyncio.sleep(1.0 / screen_sessions.get(session_id, {}).get("fps", 10))
             except Exception as e:
                 logger.error(f"Error in screen capture loop for session {session_id}: {e}")
                 error_msg = {
@@ -2210,7 +7002,7 @@ async def screen_control_websocket(websocket: WebSocket, session_id: str):
                     # Execute control command in executor
                     loop = asyncio.get_event_loop()
                     success = await loop.run_in_executor(
-                        executor,
+                        input_executor,
                         execute_control_command,
                         message.get("data", {})
                     )
@@ -2292,6 +7084,8 @@ async def update_screen_settings(
             "success": True,
             "settings": screen_sessions[session_id]
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error updating screen settings: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -2312,8 +7106,10 @@ async def get_screen_info(token: str = Depends(verify_token)):
                     "top": monitor["top"]
                 }
         
-        screen_info = await loop.run_in_executor(executor, get_screen_size)
+        screen_info = await loop.run_in_executor(input_executor, get_screen_size)
         return screen_info
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error getting screen info: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -2359,8 +7155,10 @@ async def ping_host(request: PingRequest, token: str = Depends(verify_token)):
             except subprocess.TimeoutExpired:
                 return {"success": False, "output": "", "error": "Ping command timed out"}
         
-        result = await loop.run_in_executor(executor, execute_ping)
+        result = await loop.run_in_executor(subprocess_executor, execute_ping)
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error pinging host {request.host}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -2392,8 +7190,10 @@ async def traceroute_host(request: TracerouteRequest, token: str = Depends(verif
             except FileNotFoundError:
                 return {"success": False, "output": "", "error": "Traceroute command not found. Please install it."}
         
-        result = await loop.run_in_executor(executor, execute_traceroute)
+        result = await loop.run_in_executor(subprocess_executor, execute_traceroute)
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error tracing route to {request.host}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -2689,10 +7489,10 @@ async def get_network_devices(token: str = Depends(verify_token)):
                 return {"devices": [], "total": 0, "error": str(e)}
         
         # Get network info first
-        local_ips, network_info = await loop.run_in_executor(executor, get_network_info)
+        local_ips, network_info = await loop.run_in_executor(subprocess_executor, get_network_info)
         
         # First get ARP table devices (baseline)
-        result = await loop.run_in_executor(executor, discover_devices)
+        result = await loop.run_in_executor(subprocess_executor, discover_devices)
         device_map = {d["ip"]: d for d in result.get("devices", [])}
         
         # Always perform a network scan to find all devices (including those not in ARP table)
@@ -2930,7 +7730,7 @@ async def get_device_connections(device_ip: str, token: str = Depends(verify_tok
                     "outbound_count": 0
                 }
         
-        result = await loop.run_in_executor(executor, get_connections)
+        result = await loop.run_in_executor(metrics_executor, get_connections)
         return result
     except Exception as e:
         logger.error(f"Error getting device connections for {device_ip}: {e}", exc_info=True)
@@ -3093,7 +7893,7 @@ async def get_network_connections(token: str = Depends(verify_token)):
                 logger.error(f"Error in get_connections: {e}", exc_info=True)
                 return {"connections": [], "total": 0, "error": f"Error retrieving connections: {str(e)}"}
         
-        result = await loop.run_in_executor(executor, get_connections)
+        result = await loop.run_in_executor(metrics_executor, get_connections)
         # If there's an error in the result, return it but don't raise HTTPException
         # so the frontend can display the error message
         return result
@@ -3154,7 +7954,7 @@ async def get_docker_containers(all: bool = False, token: str = Depends(verify_t
                 logger.error(f"Error in get_containers: {e}", exc_info=True)
                 return {"available": False, "error": str(e), "containers": []}
         
-        result = await loop.run_in_executor(executor, get_containers)
+        result = await loop.run_in_executor(subprocess_executor, get_containers)
         return result
     except Exception as e:
         logger.error(f"Error getting Docker containers: {e}", exc_info=True)
@@ -3185,7 +7985,7 @@ async def get_docker_logs(container_id: str, tail: int = 100, token: str = Depen
                 logger.error(f"Error in get_logs: {e}", exc_info=True)
                 return {"success": False, "logs": "", "error": str(e)}
         
-        result = await loop.run_in_executor(executor, get_logs)
+        result = await loop.run_in_executor(subprocess_executor, get_logs)
         return result
     except Exception as e:
         logger.error(f"Error getting Docker logs for {container_id}: {e}", exc_info=True)
@@ -3221,7 +8021,7 @@ async def get_docker_stats(container_id: str, token: str = Depends(verify_token)
                 logger.error(f"Error in get_stats: {e}", exc_info=True)
                 return {"success": False, "stats": None, "error": str(e)}
         
-        result = await loop.run_in_executor(executor, get_stats)
+        result = await loop.run_in_executor(subprocess_executor, get_stats)
         return result
     except Exception as e:
         logger.error(f"Error getting Docker stats for {container_id}: {e}", exc_info=True)
@@ -3252,7 +8052,7 @@ async def start_container(container_id: str, token: str = Depends(verify_token))
                 logger.error(f"Error in start_cont: {e}", exc_info=True)
                 return {"success": False, "error": str(e)}
         
-        result = await loop.run_in_executor(executor, start_cont)
+        result = await loop.run_in_executor(subprocess_executor, start_cont)
         return result
     except Exception as e:
         logger.error(f"Error starting container {container_id}: {e}", exc_info=True)
@@ -3283,7 +8083,7 @@ async def stop_container(container_id: str, token: str = Depends(verify_token)):
                 logger.error(f"Error in stop_cont: {e}", exc_info=True)
                 return {"success": False, "error": str(e)}
         
-        result = await loop.run_in_executor(executor, stop_cont)
+        result = await loop.run_in_executor(subprocess_executor, stop_cont)
         return result
     except Exception as e:
         logger.error(f"Error stopping container {container_id}: {e}", exc_info=True)
@@ -3314,7 +8114,7 @@ async def restart_container(container_id: str, token: str = Depends(verify_token
                 logger.error(f"Error in restart_cont: {e}", exc_info=True)
                 return {"success": False, "error": str(e)}
         
-        result = await loop.run_in_executor(executor, restart_cont)
+        result = await loop.run_in_executor(subprocess_executor, restart_cont)
         return result
     except Exception as e:
         logger.error(f"Error restarting container {container_id}: {e}", exc_info=True)
@@ -3347,7 +8147,7 @@ async def remove_container(container_id: str, force: bool = False, token: str =
                 logger.error(f"Error in remove_cont: {e}", exc_info=True)
                 return {"success": False, "error": str(e)}
         
-        result = await loop.run_in_executor(executor, remove_cont)
+        result = await loop.run_in_executor(subprocess_executor, remove_cont)
         return result
     except Exception as e:
         logger.error(f"Error removing container {container_id}: {e}", exc_info=True)
@@ -3403,7 +8203,7 @@ async def get_docker_images(token: str = Depends(verify_token)):
                 logger.error(f"Error in get_images: {e}", exc_info=True)
                 return {"available": False, "error": str(e), "images": []}
         
-        result = await loop.run_in_executor(executor, get_images)
+        result = await loop.run_in_executor(subprocess_executor, get_images)
         return result
     except Exception as e:
         logger.error(f"Error getting Docker images: {e}", exc_info=True)
@@ -3464,8 +8264,10 @@ async def check_system_updates(token: str = Depends(verify_token)):
             except Exception as e:
                 return {"available": False, "error": str(e)}
         
-        result = await loop.run_in_executor(executor, check_updates)
+        result = await loop.run_in_executor(subprocess_executor, check_updates)
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error checking system updates: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -3542,7 +8344,7 @@ async def list_packages(page: int = 1, limit: int = 50, search: str = "", token:
             
             return packages
         
-        all_packages = await loop.run_in_executor(executor, get_packages)
+        all_packages = await loop.run_in_executor(subprocess_executor, get_packages)
         
         # Filter by search term
         if search:
@@ -3563,6 +8365,8 @@ async def list_packages(page: int = 1, limit: int = 50, search: str = "", token:
                 "pages": (total + limit - 1) // limit
             }
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error listing packages: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -3625,13 +8429,422 @@ async def search_packages(query: str, token: str = Depends(verify_token)):
             
             return results
         
-        results = await loop.run_in_executor(executor, search_pkg)
+        results = await loop.run_in_executor(subprocess_executor, search_pkg)
         return {"query": query, "results": results, "count": len(results)}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error searching packages: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# ==================== Fleet Mode ====================
+# Any ServerGuard can act as an aggregator: agents push gzip-compressed batches
+# of compact samples to /api/fleet/ingest and the aggregator keeps a bounded
+# series per host. Agent mode is enabled by pointing FLEET_AGGREGATOR_URL at
+# the aggregator; the agent keeps serving its own API as usual.
+
+FLEET_AGGREGATOR_URL = os.getenv("FLEET_AGGREGATOR_URL", "").rstrip("/")
+FLEET_AGENT_ID = os.getenv("FLEET_AGENT_ID", socket.gethostname())
+# Base URL the aggregator can use to reach this agent's API
+FLEET_AGENT_URL = os.getenv("FLEET_AGENT_URL", "").rstrip("/")
+FLEET_TOKEN = os.getenv("FLEET_TOKEN", "valid-token")
+FLEET_SAMPLE_INTERVAL = float(os.getenv("FLEET_SAMPLE_INTERVAL", "5"))
+FLEET_PUSH_INTERVAL = float(os.getenv("FLEET_PUSH_INTERVAL", "15"))
+FLEET_BUFFER_SIZE = int(os.getenv("FLEET_BUFFER_SIZE", "720"))  # samples kept while the aggregator is unreachable
+FLEET_BATCH_SIZE = int(os.getenv("FLEET_BATCH_SIZE", "120"))
+FLEET_HOST_HISTORY = int(os.getenv("FLEET_HOST_HISTORY", "720"))  # samples kept per host on the aggregator
+FLEET_MAX_INGEST_BYTES = int(os.getenv("FLEET_MAX_INGEST_BYTES", str(16 * 1024 * 1024)))
+FLEET_MAX_BACKOFF = 300
+
+def compact_fleet_sample(snapshot: dict, history_row) -> dict:
+    """Reduce a collector snapshot to the fields the aggregator keeps"""
+    # History rows are float32 for most fields; round away the conversion noise
+    sample = dict(zip(HISTORY_DTYPE.names, (round(float(value), 3) for value in history_row)))
+    sample["disks"] = [
+        {"mountpoint": usage["mountpoint"], "percent": usage["percent"],
+         "free": usage["free"], "total": usage["total"]}
+        for usage in snapshot["disk"]["partitions"].values()
+    ]
+    return sample
+
+class FleetAgent:
+    """Samples this host and pushes batches to the aggregator with bounded buffering"""
+
+    def __init__(self):
+        self.buffer = deque(maxlen=FLEET_BUFFER_SIZE)
+        self.dropped = 0
+        self.collector = None
+        self.client = None
+
+    def sample(self) -> dict:
+        # Reuse the shared collector when it is running instead of sampling twice
+        if metrics_segment is not None and metrics_segment.age() <= COLLECTOR_STALE_AFTER:
+            result = metrics_segment.read(history_count=1)
+            if result and len(result[2]):
+                return compact_fleet_sample(json.loads(result[1]), result[2][-1].item())
+        if self.collector is None:
+            self.collector = MetricsCollector()
+        snapshot, history_row = self.collector.sample()
+        return compact_fleet_sample(snapshot, history_row)
+
+    async def push(self) -> bool:
+        batch = list(itertools.islice(self.buffer, FLEET_BATCH_SIZE))
+        if not batch:
+            return True
+        payload = {
+            "agent_id": FLEET_AGENT_ID,
+            "agent_url": FLEET_AGENT_URL or None,
+            "hostname": socket.gethostname(),
+            "platform": platform.system(),
+            "dropped": self.dropped,
+            "samples": batch
+        }
+        body = gzip.compress(json.dumps(payload).encode(), compresslevel=6)
+        response = await self.client.post(
+            f"{FLEET_AGGREGATOR_URL}/api/fleet/ingest",
+            content=body,
+            headers={"Content-Encoding": "gzip", "Content-Type": "application/json"}
+        )
+        response.raise_for_status()
+        # Only drop what the aggregator acknowledged; new samples may have arrived meanwhile
+        for _ in range(min(len(batch), len(self.buffer))):
+            self.buffer.popleft()
+        self.dropped = 0
+        return True
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        self.client = httpx.AsyncClient(
+            timeout=10.0,
+            headers={"Authorization": f"Bearer {FLEET_TOKEN}"}
+        )
+        backoff = FLEET_PUSH_INTERVAL
+        next_push = time.monotonic() + FLEET_PUSH_INTERVAL
+        logger.info(f"Fleet agent {FLEET_AGENT_ID} pushing to {FLEET_AGGREGATOR_URL}")
+        try:
+            while True:
+                try:
+                    sample = await loop.run_in_executor(metrics_executor, self.sample)
+                    if len(self.buffer) == self.buffer.maxlen:
+                        self.dropped += 1
+                    self.buffer.append(sample)
+                except Exception as e:
+                    logger.error(f"Fleet agent sampling failed: {e}")
+                
+                if time.monotonic() >= next_push:
+                    try:
+                        # Drain in batches so a backlog after an outage catches up quickly
+                        while len(self.buffer) >= FLEET_BATCH_SIZE:
+                            await self.push()
+                        await self.push()
+                        backoff = FLEET_PUSH_INTERVAL
+                    except Exception as e:
+                        backoff = min(backoff * 2, FLEET_MAX_BACKOFF)
+                        logger.warning(f"Fleet push failed ({e}); {len(self.buffer)} samples buffered, retrying in {backoff:.0f}s")
+                    next_push = time.monotonic() + backoff
+                
+                await asyncio.sleep(FLEET_SAMPLE_INTERVAL)
+        finally:
+            await self.client.aclose()
+
+class FleetHost:
+    """Aggregator-side state for one agent"""
+
+    def __init__(self, agent_id: str):
+        self.agent_id = agent_id
+        self.agent_url = None
+        self.hostname = None
+        self.platform = None
+        self.last_seen = None
+        self.dropped = 0
+        self.samples = deque(maxlen=FLEET_HOST_HISTORY)
+
+    @property
+    def latest(self) -> Optional[dict]:
+        return self.samples[-1] if self.samples else None
+
+    def is_online(self) -> bool:
+        return self.last_seen is not None and time.time() - self.last_seen < FLEET_PUSH_INTERVAL * 3 + FLEET_SAMPLE_INTERVAL
+
+    def to_dict(self) -> dict:
+        return {
+            "agent_id": self.agent_id,
+            "agent_url": self.agent_url,
+            "hostname": self.hostname,
+            "platform": self.platform,
+            "online": self.is_online(),
+            "last_seen": datetime.fromtimestamp(self.last_seen).isoformat() if self.last_seen else None,
+            "dropped_samples": self.dropped,
+            "sample_count": len(self.samples),
+            "latest": self.latest
+        }
+
+fleet_hosts: Dict[str, FleetHost] = {}
+fleet_agent: Optional[FleetAgent] = None
+
+def _decode_fleet_body(body: bytes, encoding: str) -> dict:
+    if encoding == "gzip":
+        # Bound the decompressed size so a bad agent can't exhaust memory
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        body = decompressor.decompress(body, FLEET_MAX_INGEST_BYTES)
+        if decompressor.unconsumed_tail:
+            raise HTTPException(status_code=413, detail="Fleet batch too large")
+    return json.loads(body)
+
+@app.on_event("startup")
+async def start_fleet_agent():
+    global fleet_agent
+    if not FLEET_AGGREGATOR_URL:
+        return
+    fleet_agent = FleetAgent()
+    asyncio.create_task(fleet_agent.run())
+
+@app.post("/api/fleet/ingest")
+async def ingest_fleet_samples(request: Request, token: str = Depends(verify_token)):
+    """Receive a batch of samples from a fleet agent"""
+    try:
+        body = await request.body()
+        if len(body) > FLEET_MAX_INGEST_BYTES:
+            raise HTTPException(status_code=413, detail="Fleet batch too large")
+        payload = _decode_fleet_body(body, request.headers.get("content-encoding", "").lower())
+        agent_id = payload.get("agent_id")
+        if not agent_id:
+            raise HTTPException(status_code=400, detail="agent_id is required")
+        
+        host = fleet_hosts.get(agent_id)
+        if host is None:
+            host = fleet_hosts[agent_id] = FleetHost(agent_id)
+            logger.info(f"Fleet agent registered: {agent_id}")
+        host.agent_url = payload.get("agent_url") or host.agent_url
+        host.hostname = payload.get("hostname") or host.hostname
+        host.platform = payload.get("platform") or host.platform
+        host.dropped += int(payload.get("dropped") or 0)
+        samples = payload.get("samples") or []
+        # Batches can overlap after a retry; keep the series ordered and unique
+        last_timestamp = host.latest["timestamp"] if host.latest else 0
+        accepted = 0
+        for sample in samples:
+            if sample.get("timestamp", 0) > last_timestamp:
+                host.samples.append(sample)
+                last_timestamp = sample["timestamp"]
+                accepted += 1
+        host.last_seen = time.time()
+        return {"success": True, "accepted": accepted}
+    except HTTPException:
+        raise
+    except (ValueError, zlib.error) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid fleet batch: {e}")
+    except Exception as e:
+        logger.error(f"Error ingesting fleet samples: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/fleet/hosts")
+async def get_fleet_hosts(token: str = Depends(verify_token)):
+    """List hosts reporting to this aggregator with their latest sample"""
+    hosts = [host.to_dict() for host in fleet_hosts.values()]
+    hosts.sort(key=lambda h: h["agent_id"])
+    return {"timestamp": datetime.now().isoformat(), "hosts": hosts, "total": len(hosts)}
+
+@app.get("/api/fleet/hosts/{agent_id}/series")
+async def get_fleet_host_series(agent_id: str, seconds: int = 3600, token: str = Depends(verify_token)):
+    """Stored sample series for one host"""
+    host = fleet_hosts.get(agent_id)
+    if host is None:
+        raise HTTPException(status_code=404, detail=f"Unknown fleet host: {agent_id}")
+    since = time.time() - seconds
+    samples = [sample for sample in host.samples if sample["timestamp"] >= since]
+    return {"agent_id": agent_id, "samples": samples, "count": len(samples)}
+
+@app.get("/api/fleet/summary")
+async def get_fleet_summary(top: int = 5, disk_percent: float = 90.0, token: str = Depends(verify_token)):
+    """Fleet-wide view: busiest hosts and disks that are nearly full"""
+    try:
+        online = [host for host in fleet_hosts.values() if host.is_online() and host.latest]
+        
+        def top_hosts(field: str):
+            ranked = heapq.nlargest(top, online, key=lambda host: host.latest.get(field, 0))
+            return [{"agent_id": host.agent_id, "hostname": host.hostname, field: host.latest.get(field, 0)}
+                    for host in ranked]
+        
+        disks_nearly_full = []
+        for host in online:
+            for disk in host.latest.get("disks", []):
+                if disk["percent"] >= disk_percent:
+                    disks_nearly_full.append({"agent_id": host.agent_id, "hostname": host.hostname, **disk})
+        disks_nearly_full.sort(key=lambda d: d["percent"], reverse=True)
+        
+        return {
+            "timestamp": datetime.now().isoformat(),
+            "hosts_total": len(fleet_hosts),
+            "hosts_online": len(online),
+            "offline_hosts": sorted(agent_id for agent_id, host in fleet_hosts.items() if not host.is_online()),
+            "top_cpu": top_hosts("cpu_percent"),
+            "top_memory": top_hosts("memory_percent"),
+            "top_load": top_hosts("load_1"),
+            "disks_nearly_full": disks_nearly_full
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error building fleet summary: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Fan-out queries: the aggregator asks every online agent concurrently over a
+# pooled client, streams answers back as NDJSON as they arrive and reports the
+# agents that missed the deadline instead of waiting for them.
+FLEET_FANOUT_TIMEOUT = float(os.getenv("FLEET_FANOUT_TIMEOUT", "5"))
+FLEET_FANOUT_MAX_TIMEOUT = 60.0
+FLEET_FANOUT_MAX_CONNECTIONS = int(os.getenv("FLEET_FANOUT_MAX_CONNECTIONS", "200"))
+
+fleet_http_client: Optional[httpx.AsyncClient] = None
+
+def get_fleet_http_client() -> httpx.AsyncClient:
+    """Shared keep-alive client so repeated fan-outs reuse agent connections"""
+    global fleet_http_client
+    if fleet_http_client is None:
+        fleet_http_client = httpx.AsyncClient(
+            headers={"Authorization": f"Bearer {FLEET_TOKEN}"},
+            limits=httpx.Limits(
+                max_connections=FLEET_FANOUT_MAX_CONNECTIONS,
+                max_keepalive_connections=FLEET_FANOUT_MAX_CONNECTIONS,
+                keepalive_expiry=60.0
+            )
+        )
+    return fleet_http_client
+
+@app.on_event("shutdown")
+async def close_fleet_http_client():
+    global fleet_http_client
+    if fleet_http_client is not None:
+        await fleet_http_client.aclose()
+        fleet_http_client = None
+
+async def fan_out_to_fleet(path: str, params: dict, timeout: float, transform):
+    """Query every reachable agent and yield NDJSON-ready records as they answer.
+
+    ``transform`` turns an agent's JSON response into the per-host result.
+    The final record summarises who answered, who failed and who missed the
+    deadline.
+    """
+    loop = asyncio.get_event_loop()
+    started = loop.time()
+    deadline = started + timeout
+    client = get_fleet_http_client()
+    reachable = [host for host in fleet_hosts.values() if host.agent_url and host.is_online()]
+    skipped = sorted(agent_id for agent_id, host in fleet_hosts.items() if host not in reachable)
+    
+    async def query(host: FleetHost):
+        response = await client.get(f"{host.agent_url}{path}", params=params, timeout=timeout)
+        response.raise_for_status()
+        return transform(response.json())
+    
+    tasks = {asyncio.create_task(query(host)): host for host in reachable}
+    pending = set(tasks)
+    responded, failed = 0, 0
+    try:
+        while pending:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                host = tasks[task]
+                record = {
+                    "agent_id": host.agent_id,
+                    "hostname": host.hostname,
+                    "elapsed_ms": round((loop.time() - started) * 1000, 1)
+                }
+                error = task.exception()
+                if error is None:
+                    responded += 1
+                    record.update(type="result", data=task.result())
+                else:
+                    failed += 1
+                    record.update(type="error", error=str(error) or error.__class__.__name__)
+                yield record
+    finally:
+        # Stragglers (or everyone, if the client went away) are cancelled
+        for task in pending:
+            task.cancel()
+    
+    yield {
+        "type": "summary",
+        "hosts_queried": len(reachable),
+        "responded": responded,
+        "failed": failed,
+        "stragglers": sorted(tasks[task].agent_id for task in pending),
+        "skipped": skipped,
+        "elapsed_ms": round((loop.time() - started) * 1000, 1)
+    }
+
+async def fleet_query_response(path: str, params: dict, timeout: float, transform, stream: bool):
+    timeout = max(0.1, min(timeout, FLEET_FANOUT_MAX_TIMEOUT))
+    records = fan_out_to_fleet(path, params, timeout, transform)
+    if stream:
+        async def ndjson():
+            async for record in records:
+                yield json.dumps(record) + "\n"
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+    
+    results, errors = [], []
+    async for record in records:
+        if record["type"] == "result":
+            results.append(record)
+        elif record["type"] == "error":
+            errors.append(record)
+        else:
+            summary = record
+    return {"results": results, "errors": errors, "summary": summary}
+
+@app.get("/api/fleet/processes")
+async def fleet_processes(
+    name: str = "",
+    limit: int = 50,
+    timeout: float = FLEET_FANOUT_TIMEOUT,
+    stream: bool = True,
+    token: str = Depends(verify_token)
+):
+    """Find processes by name across every agent"""
+    needle = name.lower()
+    
+    def transform(data: dict):
+        returned = data.get("processes", [])
+        processes = returned
+        if needle:
+            processes = [p for p in returned if needle in (p.get("name") or "").lower()]
+        total = (data.get("pagination") or {}).get("total")
+        # An agent that applied the filter reports every match in pagination.total,
+        # not just the page it sent back; otherwise count what survived our filter
+        matched = total if total is not None and len(processes) == len(returned) else len(processes)
+        return {"processes": processes[:limit], "matched": matched}
+    
+    # Agents filter server-side; the local filter only guards against agents that ignore `name`
+    params = {"name": name, "limit": limit, "sort_by": "cpu_percent", "sort_order": "desc"}
+    return await fleet_query_response("/api/system/processes", params, timeout, transform, stream)
+
+@app.get("/api/fleet/disk")
+async def fleet_disk(
+    percent_gt: float = 0.0,
+    timeout: float = FLEET_FANOUT_TIMEOUT,
+    stream: bool = True,
+    token: str = Depends(verify_token)
+):
+    """Partitions above a usage threshold across every agent"""
+    def transform(data: dict):
+        partitions = {
+            device: usage for device, usage in data.get("partitions", {}).items()
+            if usage.get("percent", 0) > percent_gt
+        }
+        return {"partitions": partitions, "io_counters": data.get("io_counters")}
+    
+    return await fleet_query_response("/api/system/disk", {}, timeout, transform, stream)
+
 if __name__ == "__main__":
+    import sys
+    if "--collector" in sys.argv:
+        # Run only the shared metrics collector (e.g. one per host in front of many workers)
+        run_collector()
+        sys.exit(0)
     import uvicorn
     logger.info("Starting System Monitor API server...")
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run(app, host=os.getenv("HOST", "0.0.0.0"), port=int(os.getenv("PORT", "8000")))
\ No newline at end of file
@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+AUTH = {"Authorization": "Bearer valid-token"}
+
+@pytest.fixture
+def client():
+    """TestClient with the background collectors switched off"""
+    from fastapi.testclient import TestClient
+    saved = (main.COLLECTOR_ENABLED, main.PROCESS_HISTORY_ENABLED, main.PROCESS_MEMORY_ENABLED)
+    main.COLLECTOR_ENABLED = main.PROCESS_HISTORY_ENABLED = main.PROCESS_MEMORY_ENABLED = False
+    with TestClient(main.app) as test_client:
+        yield test_client
+    main.COLLECTOR_ENABLED, main.PROCESS_HISTORY_ENABLED, main.PROCESS_MEMORY_ENABLED = saved
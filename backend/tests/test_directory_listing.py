@@ -0,0 +1,85 @@
+import os
+import tempfile
+import time
+
+import pytest
+
+import main
+from conftest import AUTH
+
+@pytest.fixture
+def listing_dir():
+    # Not under /tmp: the listing endpoint refuses system directories
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(__file__))) as path:
+        yield path
+
+def list_page(client, path, cursor=None, limit=40):
+    params = {"path": path, "limit": limit}
+    if cursor:
+        params["cursor"] = cursor
+    response = client.get("/api/files/list", params=params, headers=AUTH)
+    assert response.status_code == 200
+    return response.json()
+
+def test_cursor_pages_survive_concurrent_changes(client, listing_dir):
+    for index in range(200):
+        open(os.path.join(listing_dir, f"file{index:03d}"), "w").close()
+    os.mkdir(os.path.join(listing_dir, "subdir"))
+    
+    seen, cursor, pages = [], None, 0
+    while True:
+        page = list_page(client, listing_dir, cursor)
+        seen.extend(item["name"] for item in page["items"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+        pages += 1
+        # Churn between pages: entries before and after the cursor come and go
+        os.remove(os.path.join(listing_dir, f"file{pages:03d}"))
+        open(os.path.join(listing_dir, f"file{pages:03d}a"), "w").close()
+        os.remove(os.path.join(listing_dir, f"file{199 - pages:03d}"))
+        open(os.path.join(listing_dir, f"zz{pages:03d}"), "w").close()
+    
+    assert len(seen) == len(set(seen))
+    assert seen[0] == "subdir"
+    assert seen[1:] == sorted(seen[1:], key=str.lower)
+    # Entries present for the whole walk are listed exactly once
+    untouched = {f"file{index:03d}" for index in range(200)} - {f"file{p:03d}" for p in range(1, pages + 1)} \
+        - {f"file{199 - p:03d}" for p in range(1, pages + 1)}
+    assert untouched <= set(seen)
+    # Entries created behind the cursor are not listed; ones ahead of it are
+    assert "file001a" not in seen
+    assert f"zz{pages:03d}" in seen
+
+def test_cursor_resumes_after_a_deleted_entry(client, listing_dir):
+    for name in ("a", "b", "c", "d"):
+        open(os.path.join(listing_dir, name), "w").close()
+    first = list_page(client, listing_dir, limit=2)
+    assert [item["name"] for item in first["items"]] == ["a", "b"]
+    os.remove(os.path.join(listing_dir, "b"))
+    second = list_page(client, listing_dir, first["next_cursor"], limit=2)
+    assert [item["name"] for item in second["items"]] == ["c", "d"]
+    assert second["next_cursor"] is None
+
+def wait_for_listing(client, path, predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        names = [item["name"] for item in list_page(client, path, limit=100)["items"]]
+        if predicate(names) or time.monotonic() > deadline:
+            return names
+        time.sleep(0.05)
+
+@pytest.mark.skipif(not main.directory_watcher.available, reason="needs inotify")
+def test_watched_symlink_to_directory_is_keyed_like_the_scan(client, listing_dir):
+    target = os.path.join(listing_dir, "target")
+    os.mkdir(target)
+    watched = os.path.join(listing_dir, "watched")
+    os.mkdir(watched)
+    open(os.path.join(watched, "afile"), "w").close()
+    assert wait_for_listing(client, watched, lambda names: names == ["afile"]) == ["afile"]
+    
+    # Created while watched: listed with the directories, as a fresh scan would
+    os.symlink(target, os.path.join(watched, "link"))
+    assert wait_for_listing(client, watched, lambda names: "link" in names) == ["link", "afile"]
+    os.remove(os.path.join(watched, "link"))
+    assert wait_for_listing(client, watched, lambda names: "link" not in names) == ["afile"]
@@ -0,0 +1,101 @@
+import os
+import tempfile
+import threading
+import time
+
+import pytest
+
+import main
+from conftest import AUTH
+
+@pytest.fixture
+def tree():
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(__file__))) as path:
+        for index in range(30):
+            directory = os.path.join(path, f"dir{index:02d}", "nested")
+            os.makedirs(directory)
+            with open(os.path.join(directory, "data"), "wb") as handle:
+                handle.write(b"x" * 1000)
+        yield path
+
+@pytest.fixture
+def small_scan_pool(monkeypatch):
+    pool = main.WorkloadExecutor("test_scan", workers=1, max_queue=2)
+    monkeypatch.setattr(main, "scan_executor", pool)
+    yield pool
+    pool.shutdown()
+    main.workload_executors.pop("test_scan", None)
+
+def wait_for_job(client, job_id, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        job = client.get(f"/api/files/du/{job_id}", headers=AUTH).json()
+        if job["status"] != "running" or time.monotonic() > deadline:
+            return job
+        time.sleep(0.02)
+
+def test_jobs_wait_for_a_saturated_scan_pool(client, tree, small_scan_pool):
+    # Each job wants more directories in flight than the pool accepts
+    jobs = [client.post("/api/files/du", json={"path": tree, "exact": True}, headers=AUTH).json() for _ in range(3)]
+    for job in jobs:
+        finished = wait_for_job(client, job["id"])
+        assert finished["status"] == "completed", finished["error"]
+        assert finished["progress"]["directories"] == 61
+        assert finished["files"] == 30
+    assert small_scan_pool.stats()["rejected"] > 0
+
+def test_running_jobs_are_capped(client, tree, small_scan_pool, monkeypatch):
+    monkeypatch.setattr(main, "DU_MAX_RUNNING", 1)
+    release = threading.Event()
+    for _ in range(3):
+        small_scan_pool.submit(release.wait)
+    try:
+        first = client.post("/api/files/du", json={"path": tree}, headers=AUTH)
+        assert first.status_code == 200
+        second = client.post("/api/files/du", json={"path": tree}, headers=AUTH)
+        assert second.status_code == 503
+    finally:
+        release.set()
+    assert wait_for_job(client, first.json()["id"])["status"] == "completed"
+    third = client.post("/api/files/du", json={"path": tree}, headers=AUTH)
+    assert third.status_code == 200
+    assert wait_for_job(client, third.json()["id"])["status"] == "completed"
+
+@pytest.fixture
+def treemaps():
+    yield main.treemap_indexes
+    for index in main.treemap_indexes.values():
+        if index.task is not None:
+            index.task.cancel()
+    main.treemap_indexes.clear()
+
+def wait_for_treemap(client, path, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        index = client.get("/api/files/treemap", params={"path": path}, headers=AUTH).json()["index"]
+        if index["status"] != "scanning" or time.monotonic() > deadline:
+            return index
+        time.sleep(0.02)
+
+def test_treemap_waits_for_a_saturated_scan_pool(client, tree, small_scan_pool, treemaps):
+    index = wait_for_treemap(client, tree)
+    assert index["status"] == "complete"
+    assert index["directories_indexed"] == 61 and index["files"] == 30
+    assert small_scan_pool.stats()["rejected"] > 0
+
+def test_treemap_scans_are_capped(client, tree, small_scan_pool, treemaps, monkeypatch):
+    monkeypatch.setattr(main, "TREEMAP_MAX_SCANNING", 1)
+    release = threading.Event()
+    for _ in range(3):
+        small_scan_pool.submit(release.wait)
+    try:
+        first = os.path.join(tree, "dir00")
+        assert client.get("/api/files/treemap", params={"path": first}, headers=AUTH).status_code == 200
+        other = client.get("/api/files/treemap", params={"path": os.path.join(tree, "dir01")}, headers=AUTH)
+        assert other.status_code == 503
+        # Refreshing the tree that is already scanning replaces it rather than adding one
+        again = client.get("/api/files/treemap", params={"path": first, "refresh": True}, headers=AUTH)
+        assert again.status_code == 200
+    finally:
+        release.set()
+    assert wait_for_treemap(client, first)["status"] == "complete"
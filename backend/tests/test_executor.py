@@ -0,0 +1,46 @@
+import threading
+
+import pytest
+
+import main
+from conftest import AUTH
+
+@pytest.fixture
+def saturated_pool():
+    """A one-worker pool with no queue whose only worker is busy"""
+    pool = main.WorkloadExecutor("test_saturated", workers=1, max_queue=0)
+    release = threading.Event()
+    pool.submit(release.wait)
+    yield pool
+    release.set()
+    pool.shutdown()
+    main.workload_executors.pop("test_saturated", None)
+
+def test_submit_beyond_queue_is_rejected(saturated_pool):
+    with pytest.raises(main.ExecutorSaturated) as raised:
+        saturated_pool.submit(print)
+    assert raised.value.status_code == 503
+    stats = saturated_pool.stats()
+    assert stats["rejected"] == 1 and stats["active"] == 1 and stats["queued"] == 0
+
+def test_saturated_pool_queues_up_to_its_limit():
+    pool = main.WorkloadExecutor("test_queue", workers=1, max_queue=2)
+    release = threading.Event()
+    try:
+        futures = [pool.submit(release.wait) for _ in range(3)]
+        with pytest.raises(main.ExecutorSaturated):
+            pool.submit(release.wait)
+        release.set()
+        assert all(future.result(5) for future in futures)
+        assert pool.stats()["completed"] == 3
+        pool.submit(print).result(5)
+    finally:
+        release.set()
+        pool.shutdown()
+        main.workload_executors.pop("test_queue", None)
+
+def test_saturation_reaches_the_client_as_503(client, saturated_pool, monkeypatch):
+    monkeypatch.setattr(main, "metrics_executor", saturated_pool)
+    response = client.get("/api/system/cpu/detailed", headers=AUTH)
+    assert response.status_code == 503
+    assert "test_saturated" in response.json()["detail"]
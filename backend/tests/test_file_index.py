@@ -0,0 +1,62 @@
+import asyncio
+import os
+
+import pytest
+
+import main
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    root = tmp_path / "root"
+    for directory in ("src/app", "src/lib", "logs/2024", "docs"):
+        (root / directory).mkdir(parents=True)
+    for name in ("src/app/Main.py", "src/app/util.py", "src/lib/helpers.py", "logs/access.log",
+                 "logs/2024/access.log", "logs/error.log", "docs/README.md", "docs/a_b.txt"):
+        (root / name).write_text("x")
+    # A one-worker scan pool with no queue forces the walk to back off and retry
+    pool = main.WorkloadExecutor("test_index_scan", workers=1, max_queue=0)
+    monkeypatch.setattr(main, "scan_executor", pool)
+    file_index = main.FileIndex(str(tmp_path / "index.db"), [str(root)])
+    
+    async def build():
+        await file_index._write(file_index._write_connection)
+        await file_index.rebuild()
+        file_index.watcher.close()
+    try:
+        asyncio.run(build())
+    finally:
+        pool.shutdown()
+        main.workload_executors.pop("test_index_scan", None)
+    file_index.root = str(root)
+    return file_index
+
+def found(index, q, limit=100, kind=None, under=None):
+    mode, rows, truncated = index.find(q, limit, kind, under)
+    return mode, sorted(os.path.relpath(row[0], index.root) for row in rows), truncated
+
+def test_rebuild_indexes_every_entry(index):
+    assert index.status == "ready"
+    # 8 files, 6 directories below the root, and the root itself
+    assert index.last_scan["indexed"] == 15
+
+def test_substring_is_case_insensitive(index):
+    assert found(index, "main") == ("substring", ["src/app/Main.py"], False)
+    assert found(index, "access")[1] == ["logs/2024/access.log", "logs/access.log"]
+
+def test_short_and_wildcard_like_substrings(index):
+    # Under three characters there are no trigrams; LIKE metacharacters are literal
+    assert found(index, "py")[1] == ["src/app/Main.py", "src/app/util.py", "src/lib/helpers.py"]
+    assert found(index, "a_b")[1] == ["docs/a_b.txt"]
+
+def test_glob_matches_name_or_whole_path(index):
+    assert found(index, "*.log") == ("glob", ["logs/2024/access.log", "logs/access.log", "logs/error.log"], False)
+    assert found(index, "logs/*/access.log")[1] == ["logs/2024/access.log"]
+
+def test_substring_with_slash_matches_the_path(index):
+    assert found(index, "app/util")[1] == ["src/app/util.py"]
+
+def test_kind_under_and_limit(index):
+    assert found(index, "s", kind="dir")[1] == ["docs", "logs", "src"]
+    assert found(index, ".py", under=os.path.join(index.root, "src", "lib"))[1] == ["src/lib/helpers.py"]
+    mode, rows, truncated = found(index, ".log", limit=2)
+    assert len(rows) == 2 and truncated
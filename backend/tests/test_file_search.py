@@ -0,0 +1,34 @@
+import json
+import os
+import tempfile
+
+import pytest
+
+import main
+from conftest import AUTH
+
+@pytest.fixture
+def tree():
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(__file__))) as path:
+        for index in range(20):
+            directory = os.path.join(path, f"dir{index:02d}")
+            os.makedirs(directory)
+            with open(os.path.join(directory, "notes.txt"), "w") as handle:
+                handle.write(f"first line\nneedle {index}\n")
+        yield path
+
+def test_streamed_search_survives_a_saturated_walk_pool(client, tree, monkeypatch):
+    pool = main.WorkloadExecutor("test_walk", workers=1, max_queue=0)
+    monkeypatch.setattr(main, "scan_executor", pool)
+    try:
+        response = client.post("/api/files/search", json={"path": tree, "pattern": "needle", "stream": True},
+                               headers=AUTH)
+        assert response.status_code == 200
+        records = [json.loads(line) for line in response.text.splitlines()]
+    finally:
+        pool.shutdown()
+        main.workload_executors.pop("test_walk", None)
+    matches = [record for record in records if record["type"] == "match"]
+    assert len(matches) == 20 and {match["line"] for match in matches} == {2}
+    assert records[-1]["type"] == "summary" and records[-1]["stopped"] is None
+    assert pool.stats()["rejected"] > 0
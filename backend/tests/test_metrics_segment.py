@@ -0,0 +1,86 @@
+import json
+import secrets
+import threading
+
+import pytest
+
+import main
+
+def history_row(value: float) -> tuple:
+    return (value,) + (0,) * (len(main.HISTORY_DTYPE.names) - 1)
+
+@pytest.fixture
+def segment():
+    segment = main.MetricsSegment.create(f"sg_test_{secrets.token_hex(4)}", snapshot_capacity=4096, history_capacity=16)
+    yield segment
+    segment.close()
+    segment.unlink()
+
+def test_read_returns_latest_snapshot_and_history(segment):
+    for i in range(20):
+        segment.write(json.dumps({"i": i}).encode(), history_row(float(i)))
+    seq, payload, history = segment.read(history_count=5)
+    assert seq % 2 == 0
+    assert json.loads(payload) == {"i": 19}
+    assert list(history["timestamp"]) == [15.0, 16.0, 17.0, 18.0, 19.0]
+
+def test_read_gives_up_while_write_in_progress(segment):
+    segment.write(b"{}", history_row(1.0))
+    segment.header[main.HDR_SEQ] += 1  # writer stuck mid-write
+    assert segment.read() is None
+
+def test_concurrent_reads_never_see_torn_snapshots(segment):
+    stop = threading.Event()
+
+    def writer():
+        i = 0
+        while not stop.is_set():
+            i += 1
+            # Payload and history row are written together; a torn read would mismatch
+            segment.write(json.dumps({"i": i, "pad": "x" * (i % 500)}).encode(), history_row(float(i)))
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        consistent = 0
+        for _ in range(2000):
+            result = segment.read(history_count=1)
+            if result is None:
+                continue
+            _, payload, history = result
+            snapshot = json.loads(payload)
+            assert snapshot["pad"] == "x" * (snapshot["i"] % 500)
+            assert history["timestamp"][-1] == snapshot["i"]
+            consistent += 1
+        assert consistent > 0
+    finally:
+        stop.set()
+        thread.join()
+
+def test_attach_rejects_other_layout_and_discard_allows_recreate():
+    name = f"sg_test_{secrets.token_hex(4)}"
+    old = main.MetricsSegment.create(name, snapshot_capacity=64, history_capacity=4)
+    old.header[main.HDR_LAYOUT] = main.SEGMENT_LAYOUT_VERSION - 1
+    try:
+        with pytest.raises(main.SegmentLayoutMismatch):
+            main.MetricsSegment.attach(name)
+        main.MetricsSegment.discard(name)
+        fresh = main.MetricsSegment.create(name, snapshot_capacity=64, history_capacity=4)
+        attached = main.MetricsSegment.attach(name)
+        assert attached.header[main.HDR_LAYOUT] == main.SEGMENT_LAYOUT_VERSION
+        attached.close()
+        fresh.close()
+        fresh.unlink()
+    finally:
+        old.close()
+
+def test_history_samples_round_float32_noise():
+    history = main.np.zeros(2, dtype=main.HISTORY_DTYPE)
+    history["timestamp"] = [1700000000.123456, 1700000001.5]
+    history["cpu_percent"] = [12.9, 0.1]
+    history["net_sent_bytes_per_sec"] = [1234.5678, 0]
+    samples = main.history_samples(history)
+    assert samples["cpu_percent"] == [12.9, 0.1]
+    # float64 columns are passed through untouched
+    assert samples["timestamp"] == [1700000000.123456, 1700000001.5]
+    assert samples["net_sent_bytes_per_sec"] == [1234.5678, 0.0]
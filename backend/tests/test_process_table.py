@@ -0,0 +1,54 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+import main
+
+def row_for(snapshot, pid):
+    return next(row for row in snapshot.rows if row["pid"] == pid)
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="exec rename is checked through /proc")
+def test_exec_renames_process():
+    process = subprocess.Popen(["sh", "-c", "sleep 0.3; exec sleep 5"])
+    try:
+        table = main.ProcessTable()
+        assert row_for(table.refresh(), process.pid)["name"] == "sh"
+        time.sleep(0.8)
+        snapshot = table.refresh()
+        assert row_for(snapshot, process.pid)["name"] == "sleep"
+        # The sorted name index follows the rename instead of keeping both names
+        names = [name for name, pid, _ in table._name_index if pid == process.pid]
+        assert names == ["sleep"]
+    finally:
+        process.kill()
+        process.wait()
+
+def tied_snapshot(count):
+    rows = [{"pid": pid, "ppid": 1, "name": f"p{pid}", "username": "root", "status": "sleeping",
+             "cpu_percent": float(pid % 3), "memory_percent": 0.0, "rss": 0, "num_threads": 1}
+            for pid in range(count)]
+    keys = [(row["pid"], 0.0) for row in rows]
+    return main.ProcessSnapshot(1, rows, keys, [], [], [], [])
+
+@pytest.mark.parametrize("reverse", [False, True])
+def test_select_pages_through_ties(reverse):
+    snapshot = tied_snapshot(3000)
+    seen = []
+    for offset in range(0, 3000, 50):
+        total, rows = snapshot.select([], "cpu_percent", reverse, offset, 50)
+        assert total == 3000
+        seen.extend(row["pid"] for row in rows)
+    # Every row shows up exactly once and the pages agree with one full sort
+    assert sorted(seen) == list(range(3000))
+    _, everything = snapshot.select([], "cpu_percent", reverse, 0, 3000)
+    assert seen == [row["pid"] for row in everything]
+
+def test_process_detail_cache_is_pruned(client):
+    from conftest import AUTH
+    main.system_cache["process_detail_999999_1.0_cpu_times"] = ({"user": 0}, time.time() - 60)
+    response = client.get(f"/api/system/processes/{os.getpid()}", headers=AUTH)
+    assert response.status_code == 200
+    assert "process_detail_999999_1.0_cpu_times" not in main.system_cache
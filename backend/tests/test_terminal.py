@@ -0,0 +1,147 @@
+import asyncio
+import json
+import re
+
+import psutil
+import pytest
+
+import main
+
+pytestmark = pytest.mark.skipif(main.pty is None, reason="terminal sessions need a pty")
+
+async def collect_output(outbox, until: str, timeout: float = 5.0) -> str:
+    text = ""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while until not in text:
+        event = await asyncio.wait_for(outbox.get(), max(0.01, deadline - loop.time()))
+        text += event.get("data", "")
+    return text
+
+def test_dangerous_input_line_is_discarded(tmp_path):
+    async def scenario():
+        session = main.TerminalSession("test-input", str(tmp_path))
+        outbox = session.subscribe()
+        await session.start()
+        try:
+            target = tmp_path / "keep"
+            target.mkdir()
+            # Typed one key at a time, the way an interactive client sends it
+            for char in f"rm -rf {target}":
+                assert session.send_input(char) is None
+            assert session.send_input("\r") == f"rm -rf {target}"
+            session.send_input("echo still-here\r")
+            await collect_output(outbox, "still-here")
+            assert target.exists()
+        finally:
+            await session.close()
+    asyncio.run(scenario())
+
+def test_shell_owns_the_pty_as_controlling_terminal(tmp_path):
+    async def scenario():
+        session = main.TerminalSession("test-ctty", str(tmp_path))
+        outbox = session.subscribe()
+        await session.start()
+        try:
+            # ^C only reaches the foreground job through the controlling terminal
+            session.send_input("sleep 30; echo not-interrupted\r")
+            await asyncio.sleep(0.3)
+            session.interrupt()
+            session.send_input("echo done\r")
+            text = await collect_output(outbox, "done")
+            assert "not-interrupted" not in text
+        finally:
+            await session.close()
+    asyncio.run(scenario())
+
+def test_close_kills_jobs_that_ignore_hangup(tmp_path):
+    async def scenario():
+        session = main.TerminalSession("test-close", str(tmp_path))
+        outbox = session.subscribe()
+        await session.start()
+        # The shell and its foreground job both ignore SIGHUP, so close() has to escalate
+        session.send_input("trap '' HUP; sleep 30 & echo job=$!; wait\r")
+        text = await collect_output(outbox, "\n")
+        job = int(re.search(r"job=(\d+)", text).group(1))
+        await session.close()
+        await asyncio.sleep(0.1)
+        # Gone, or a zombie waiting for whichever init adopted it
+        try:
+            assert psutil.Process(job).status() == psutil.STATUS_ZOMBIE
+        except psutil.NoSuchProcess:
+            pass
+    asyncio.run(scenario())
+
+def test_outbox_pauses_the_session_until_drained(tmp_path):
+    async def scenario():
+        session = main.TerminalSession("test-pause", str(tmp_path))
+        outbox = main.TerminalOutbox(session, limit=100)
+        session.subscribers.append(outbox)
+        for _ in range(3):
+            outbox.put({"type": "output", "data": "x" * 40}, 40)
+        assert session.paused
+        await outbox.get()
+        assert session.paused  # 80 bytes still queued, above half the limit
+        await outbox.get()
+        assert not session.paused
+    asyncio.run(scenario())
+
+def test_outbox_truncates_with_one_gap_notice(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "TERMINAL_OVERFLOW_POLICY", "truncate")
+    async def scenario():
+        session = main.TerminalSession("test-truncate", str(tmp_path))
+        outbox = main.TerminalOutbox(session, limit=100)
+        for _ in range(5):
+            outbox.put({"type": "output", "data": "x" * 40}, 40)
+        events = [await outbox.get() for _ in range(len(outbox.events))]
+        assert [event.get("dropped_bytes") for event in events] == [None, None, 120]
+        assert not session.paused
+        # Once drained, output flows again
+        outbox.put({"type": "output", "data": "y"}, 1)
+        assert (await outbox.get())["data"] == "y"
+    asyncio.run(scenario())
+
+def receive_until(websocket, done):
+    """Collect binary payloads and JSON messages until done(payload, messages) holds"""
+    payload, messages = b"", []
+    while not done(payload, messages):
+        message = websocket.receive()
+        if message.get("bytes") is not None:
+            payload += message["bytes"][2:]
+        else:
+            messages.append(json.loads(message["text"]))
+    return payload, messages
+
+def test_mux_channel_stops_at_its_credit(client):
+    with client.websocket_connect("/ws/terminals") as websocket:
+        websocket.send_json({"type": "open", "session": "test-mux-credit", "window": 16})
+        opened = websocket.receive_json()
+        assert opened["type"] == "opened" and opened["window"] == 16
+        channel = opened["channel"]
+        websocket.send_json({"type": "command", "channel": channel, "command": "printf '%064d' 0"})
+        received, _ = receive_until(websocket, lambda payload, messages: len(payload) >= 16)
+        assert received == b"0" * 16
+        # The window is spent: nothing but JSON arrives before the pong
+        websocket.send_json({"type": "ping"})
+        extra, _ = receive_until(websocket, lambda payload, messages: any(m["type"] == "pong" for m in messages))
+        assert extra == b""
+        websocket.send_json({"type": "credit", "channel": channel, "bytes": 1024})
+        rest, _ = receive_until(websocket, lambda payload, messages: len(payload) >= 48)
+        assert rest[:48] == b"0" * 48
+        websocket.send_json({"type": "close", "channel": channel, "terminate": True})
+
+def test_mux_reuses_the_lowest_free_channel_id(client):
+    with client.websocket_connect("/ws/terminals") as websocket:
+        ids = {}
+        for session in ("test-mux-a", "test-mux-b"):
+            websocket.send_json({"type": "open", "session": session})
+            _, messages = receive_until(websocket, lambda payload, messages: any(m["type"] == "opened" for m in messages))
+            ids[session] = next(m for m in messages if m["type"] == "opened")["channel"]
+        assert sorted(ids.values()) == [1, 2]
+        websocket.send_json({"type": "close", "channel": ids["test-mux-a"], "terminate": True})
+        receive_until(websocket, lambda payload, messages: any(m["type"] == "closed" for m in messages))
+        websocket.send_json({"type": "open", "session": "test-mux-c"})
+        _, messages = receive_until(websocket, lambda payload, messages: any(m["type"] == "opened" for m in messages))
+        assert next(m for m in messages if m["type"] == "opened")["channel"] == ids["test-mux-a"]
+        for channel in (ids["test-mux-a"], ids["test-mux-b"]):
+            websocket.send_json({"type": "close", "channel": channel, "terminate": True})